@@ -0,0 +1,514 @@
+"""Offline search over exported messages (JSON and JSONL files on disk).
+
+Exports are searched with the same keyword matcher and exclusion filters as
+!find, in a pool of worker processes so every core is busy:
+
+- JSONL files (one message object per line) are memory-mapped and split into
+  byte ranges of CHUNK_SIZE, each searched by one worker. A range owns the
+  lines that start inside it.
+- JSON files (DiscordChatExporter exports, or a plain array of messages) are
+  memory-mapped too. When the messages array is pretty-printed (as
+  DiscordChatExporter writes it), every message starts on a new line at the
+  same indentation, and JSON strings can't hold a raw newline, so the array
+  is split into byte ranges the same way; a range owns the messages that
+  start inside it. Compact arrays are decoded one message at a time.
+
+Most lines of an archive don't mention any keyword, so workers look for the
+keywords in the raw bytes of their range first (at C speed) and only parse
+the lines or messages that could match. That check accepts every way a keyword can
+be written in JSON (any letter case, \\uXXXX escapes, characters whose
+lowercase form is the keyword's), so it never skips a line the matcher would
+have matched.
+
+Workers return plain tuples; this module does not import discord, to keep
+worker start-up fast.
+"""
+
+import bisect
+import codecs
+import json
+import mmap
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from matcher import ExclusionFilter, KeywordMatcher, classify_spans
+from normalize import original_spans
+
+CHUNK_SIZE = 32 * 1024 * 1024  # Bytes of a JSONL file searched by one worker task
+ARCHIVE_EXTENSIONS = (".json", ".jsonl")
+PREFILTER_MAX_KEYWORDS = 64  # Beyond this, scanning for every keyword gets slower than parsing every line
+STREAM_WINDOW = 1024 * 1024  # Bytes decoded at a time from a compact JSON array
+
+
+class ArchiveSource:
+    """Stands in for the guild, channels and owner of an archive search session."""
+
+    __slots__ = ("id", "name")
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+def find_archive_files(paths):
+    """Return the export files among the paths, expanding directories recursively."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in sorted(os.walk(path)):
+                files.extend(os.path.join(directory, name) for name in sorted(names)
+                             if name.lower().endswith(ARCHIVE_EXTENSIONS))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            print(f"Archive not found: {path}")
+    return files
+
+
+def plan_tasks(files, chunk_size=CHUNK_SIZE):
+    """Split the files into (file index, path, start, end) tasks, in file order.
+
+    JSONL files get one task per chunk_size bytes, and so do the messages
+    arrays of pretty-printed JSON files. Other JSON files are one task each
+    (end is None), decoded as a stream.
+    """
+    tasks = []
+    for file_index, path in enumerate(files):
+        if path.lower().endswith(".jsonl"):
+            start, stop = 0, os.path.getsize(path)
+        else:
+            layout = read_json_layout(path)
+            if layout is None or layout.indent is None:
+                tasks.append((file_index, path, 0, None))
+                continue
+            start, stop = layout.start, layout.stop
+        for offset in range(start, max(stop, start + 1), chunk_size):
+            tasks.append((file_index, path, offset, min(offset + chunk_size, stop)))
+    return tasks
+
+
+_MESSAGES_KEY = re.compile(rb'"messages"\s*:\s*\[')
+_SEPARATORS = re.compile(r"[\s,]*")
+
+
+class JsonLayout:
+    """Where the messages array of a JSON export is, and the channel it came from."""
+
+    __slots__ = ("guild_id", "channel_id", "channel_name", "start", "stop", "indent")
+
+    def __init__(self, guild_id, channel_id, channel_name, start, stop, indent):
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.channel_name = channel_name
+        self.start = start  # Offset just after the array's [
+        self.stop = stop  # Offset of the array's ]
+        self.indent = indent  # Whitespace before each message's {, or None if not one per line
+
+
+def _skip_whitespace(data, position):
+    while position < len(data) and data[position] in b" \t\r\n":
+        position += 1
+    return position
+
+
+def json_layout(data, channel_name=""):
+    """Find the messages array in the raw bytes of a JSON export, or return None if there is none.
+
+    Only the header before the array (DiscordChatExporter's guild and
+    channel) is decoded.
+    """
+    guild_id = None
+    channel_id = 0
+    first = _skip_whitespace(data, 0)
+    if data[first:first + 1] == b"[":
+        start = first + 1
+    else:
+        match = _MESSAGES_KEY.search(data)
+        if match is None:
+            return None
+        start = match.end()
+        try:
+            header = json.loads(data[first:match.start()].rstrip().rstrip(b",") + b"}")
+        except ValueError:
+            header = {}
+        if isinstance(header, dict):
+            guild_id = (header.get("guild") or {}).get("id")
+            channel = header.get("channel") or {}
+            channel_id = _int_id(channel.get("id"))
+            channel_name = channel.get("name") or channel_name
+    # The array ends at the file's last ], as nothing follows it but scalar fields
+    stop = data.rfind(b"]")
+    if stop < start:
+        return None
+    element = _skip_whitespace(data, start)
+    line_start = data.rfind(b"\n", start, element) + 1
+    indent = data[line_start:element] if line_start and data[element:element + 1] == b"{" else None
+    return JsonLayout(guild_id, channel_id, channel_name, start, stop, indent)
+
+
+def read_json_layout(path):
+    """Return the JsonLayout of a JSON export file (see json_layout), or None."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return json_layout(data)
+
+
+# Lowercase character -> characters that lowercase to it, built on first use
+_lowercase_sources = None
+
+
+def _sources(ch):
+    """Return every character whose lowercase form is ch, including ch itself."""
+    global _lowercase_sources
+    if _lowercase_sources is None:
+        _lowercase_sources = {}
+        # All cased characters lie in the first two Unicode planes
+        for code in range(0x20000):
+            source = chr(code)
+            lower = source.lower()
+            if lower != source and len(lower) == 1:
+                _lowercase_sources.setdefault(lower, []).append(source)
+        # İ lowercases to i plus a combining dot
+        _lowercase_sources.setdefault("i", []).append("İ")
+    return [ch] + _lowercase_sources.get(ch, [])
+
+
+_SHORT_ESCAPES = {'"': b'\\\\"', "\\": b"\\\\\\\\", "/": b"\\\\/", "\b": b"\\\\b",
+                  "\f": b"\\\\f", "\n": b"\\\\n", "\r": b"\\\\r", "\t": b"\\\\t"}
+
+
+def _json_forms(ch):
+    """Return regex alternatives for every way JSON can encode the character."""
+    code = ord(ch)
+    if code > 0xFFFF:
+        # Escaped as a surrogate pair
+        high = 0xD800 + ((code - 0x10000) >> 10)
+        low = 0xDC00 + ((code - 0x10000) & 0x3FF)
+        escape = b"\\\\u%04x\\\\u%04x" % (high, low)
+    else:
+        escape = b"\\\\u%04x" % code
+    forms = [re.escape(ch.encode("utf-8")), escape]
+    if ch in _SHORT_ESCAPES:
+        forms.append(_SHORT_ESCAPES[ch])
+    return forms
+
+
+def _escape_pattern(keywords):
+    """Compile a bytes regex that matches the keywords in any JSON encoding of any letter case."""
+    alternatives = []
+    for keyword in keywords:
+        parts = []
+        for ch in keyword:
+            forms = [form for source in _sources(ch) for form in _json_forms(source)]
+            parts.append(b"(?:" + b"|".join(forms) + b")")
+        alternatives.append(b"".join(parts))
+    # IGNORECASE folds ASCII letters, including the hex digits of escapes
+    return re.compile(b"|".join(alternatives), re.IGNORECASE)
+
+
+# ASCII characters that no other character lowercases to (unlike k and i), so
+# JSON can only write them as themselves, their other case or a \u00XX escape
+_PLAIN_RUN = re.compile(r"[a-hjl-z0-9 ]+")
+_ESCAPED_PLAIN = re.compile(rb"\\u00(?:20|3[0-9]|4[1-9a-f]|5[0-9a]|6[1-9a-f]|7[0-9a])", re.IGNORECASE)
+
+
+class Prefilter:
+    """Finds the lines of raw JSONL that could contain a keyword.
+
+    Every keyword is searched by its longest run of plain characters, with
+    bytes.find over the lowercased range. Lines that escape a plain character
+    are always candidates. Keywords without plain characters fall back to a
+    regex that spells out every encoding of every character.
+    """
+
+    def __init__(self, keywords):
+        anchors = []
+        self.fallback = []  # Keywords without plain characters
+        for keyword in keywords:
+            anchor = max(_PLAIN_RUN.findall(keyword), key=len, default="")
+            if anchor:
+                anchors.append(anchor.encode("ascii"))
+            else:
+                self.fallback.append(keyword)
+        self.anchors = list(dict.fromkeys(anchors))
+        self.pattern = _escape_pattern(self.fallback) if self.fallback else None
+
+    @classmethod
+    def build(cls, keywords):
+        """Return a prefilter for the keywords, or None if every line has to be parsed.
+
+        That is the case with too many keywords, or with a keyword that can
+        only be found through the combining dot that İ lowercases to.
+        """
+        if not keywords or len(keywords) > PREFILTER_MAX_KEYWORDS:
+            return None
+        prefilter = cls(keywords)
+        if any("\u0307" in keyword for keyword in prefilter.fallback):
+            return None
+        return prefilter
+
+    def line_starts(self, chunk):
+        """Return the sorted offsets of the chunk's lines that could contain a keyword."""
+        return sorted({chunk.rfind(b"\n", 0, hit) + 1 for hit in self.hits(chunk)})
+
+    def hits(self, chunk):
+        """Return offsets in the chunk where a keyword could be (at least one per line that has one)."""
+        hits = []
+        lowered = chunk.lower()
+        for anchor in self.anchors:
+            position = lowered.find(anchor)
+            while position >= 0:
+                hits.append(position)
+                # One hit per line is enough
+                newline = lowered.find(b"\n", position)
+                if newline < 0:
+                    break
+                position = lowered.find(anchor, newline + 1)
+        hits.extend(match.start() for match in _ESCAPED_PLAIN.finditer(chunk))
+        if self.pattern is not None:
+            hits.extend(match.start() for match in self.pattern.finditer(chunk))
+        return hits
+
+
+def _int_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _message_row(message, channel_id, channel_name, spans=(), keyword_ids=()):
+    """Return (id, channel_id, channel_name, author_id, author_name, content, spans, keyword IDs) for an exported message.
+
+    Accepts DiscordChatExporter messages (author and channel as objects) and
+    flat records (author_id, author_name, channel_id, channel_name fields).
+    """
+    author = message.get("author")
+    if isinstance(author, dict):
+        author_id = _int_id(author.get("id"))
+        author_name = author.get("name") or ""
+    else:
+        author_id = _int_id(message.get("author_id"))
+        author_name = message.get("author_name") or (author if isinstance(author, str) else "")
+    channel = message.get("channel")
+    if isinstance(channel, dict):
+        channel_id = _int_id(channel.get("id")) or channel_id
+        channel_name = channel.get("name") or channel_name
+    else:
+        channel_id = _int_id(message.get("channel_id")) or channel_id
+        channel_name = message.get("channel_name") or (channel if isinstance(channel, str) else channel_name)
+    return (_int_id(message.get("id")), channel_id, channel_name, author_id, author_name, message.get("content"),
+            spans, keyword_ids)
+
+
+class _ChunkSearcher:
+    """Matches the messages of one task against the keywords and each guild's exclusions."""
+
+    def __init__(self, matcher, exclusions, default_guild_id):
+        self.matcher = matcher
+        self.exclusions = exclusions  # {guild ID string: {keyword: [words]}}
+        self.default_guild_id = default_guild_id
+        self._filters = {}
+        self.rows = []
+
+    def filters_for(self, guild_id):
+        key = str(guild_id) if guild_id else self.default_guild_id
+        filters = self._filters.get(key)
+        if filters is None:
+            guild_exclusions = self.exclusions.get(key, {}) if key else {}
+            filters = {keyword: ExclusionFilter(words) for keyword, words in guild_exclusions.items() if words}
+            self._filters[key] = filters
+        return filters
+
+    def check(self, message, channel_id, channel_name, guild_id=None):
+        if not isinstance(message, dict):
+            return
+        content = message.get("content")
+        if not isinstance(content, str) or not content:
+            return
+        guild_id = message.get("guild_id") or guild_id
+        matched, _, spans = classify_spans(self.matcher, content.lower(), self.filters_for(guild_id))
+        if matched:
+            self.rows.append(_message_row(message, channel_id, channel_name, original_spans(content, spans),
+                                          self.matcher.keyword_ids(matched)))
+
+
+# Compiled per worker process and reused by its tasks: (keywords, matcher, prefilter)
+_compiled = None
+
+
+def _compile(keywords):
+    global _compiled
+    if _compiled is None or _compiled[0] != keywords:
+        _compiled = (keywords, KeywordMatcher(keywords), Prefilter.build(keywords))
+    return _compiled[1], _compiled[2]
+
+
+def search_task(task, keywords, exclusions, default_guild_id=None):
+    """Search one task in a worker process. Returns (messages scanned, matching rows)."""
+    _, path, start, end = task
+    matcher, prefilter = _compile(tuple(keywords))
+    searcher = _ChunkSearcher(matcher, exclusions, default_guild_id)
+    channel_name = os.path.splitext(os.path.basename(path))[0]
+    if path.lower().endswith(".jsonl"):
+        scanned = _search_jsonl(path, start, end, searcher, prefilter, channel_name)
+    else:
+        scanned = _search_json(path, start, end, searcher, prefilter, channel_name)
+    return scanned, searcher.rows
+
+
+def _search_json(path, start, end, searcher, prefilter, channel_name):
+    """Search the messages of a JSON export that start in [start, end), or all of them if end is None."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            layout = json_layout(data, channel_name)
+            if layout is None:
+                return 0
+            if end is None or layout.indent is None:
+                return _stream_json(data, layout, searcher)
+
+            # Messages whose { lies in the range belong to it; the last one runs up to the next message
+            marker = b"\n" + layout.indent + b"{"
+            first = data.find(marker, max(layout.start, start - len(marker) + 1), layout.stop)
+            if first < 0 or first > end - len(marker):
+                return 0
+            following = data.find(marker, end - len(marker) + 1, layout.stop)
+            chunk = data[first:layout.stop if following < 0 else following]
+
+    starts = []
+    position = 0
+    while position >= 0:
+        starts.append(position)
+        position = chunk.find(marker, position + 1)
+    if prefilter is None:
+        candidates = range(len(starts))
+    else:
+        candidates = sorted({bisect.bisect_right(starts, hit) - 1 for hit in prefilter.hits(chunk)})
+    starts.append(len(chunk))
+    for index in candidates:
+        try:
+            message = json.loads(chunk[starts[index]:starts[index + 1]].strip().rstrip(b","))
+        except ValueError:
+            continue
+        searcher.check(message, layout.channel_id, layout.channel_name, layout.guild_id)
+    return len(starts) - 1
+
+
+def _stream_json(data, layout, searcher):
+    """Decode the messages of a compact JSON array one at a time, STREAM_WINDOW bytes at a time."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")("replace")
+    text = ""
+    position = 0
+    offset = layout.start  # Next byte to decode
+    scanned = 0
+
+    def read_more():
+        nonlocal text, position, offset
+        window = data[offset:offset + STREAM_WINDOW]
+        offset += len(window)
+        text = text[position:] + utf8.decode(window, offset >= len(data))
+        position = 0
+
+    while True:
+        position = _SEPARATORS.match(text, position).end()
+        if position >= len(text):
+            if offset >= len(data):
+                break
+            read_more()
+            continue
+        if text[position] == "]":
+            break
+        try:
+            message, position = decoder.raw_decode(text, position)
+        except ValueError:
+            # A message running past the decoded text, or a broken end of the file
+            if offset >= len(data):
+                break
+            read_more()
+            continue
+        scanned += 1
+        searcher.check(message, layout.channel_id, layout.channel_name, layout.guild_id)
+    return scanned
+
+
+def _search_jsonl(path, start, end, searcher, prefilter, channel_name):
+    """Search the lines of a JSONL file that start in [start, end)."""
+    if end <= start:
+        return 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        size = len(data)
+        # The line running into the range belongs to the previous chunk
+        if start > 0:
+            newline = data.find(b"\n", start - 1)
+            start = size if newline < 0 else newline + 1
+        # ... and the range's last line is finished even if it runs past end
+        if start >= end:
+            return 0
+        newline = data.find(b"\n", end - 1)
+        stop = size if newline < 0 else newline
+
+        # One copy of the range; counting, lowercasing and finding run at C speed on bytes
+        chunk = data[start:stop]
+    scanned = chunk.count(b"\n") + 1
+    if prefilter is None:
+        lines = chunk.split(b"\n")
+    else:
+        lines = []
+        for line_start in prefilter.line_starts(chunk):
+            line_end = chunk.find(b"\n", line_start)
+            lines.append(chunk[line_start:line_end if line_end >= 0 else len(chunk)])
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        searcher.check(message, 0, channel_name)
+    return scanned
+
+
+def search_archives(files, keywords, exclusions=None, default_guild_id=None, workers=None, chunk_size=CHUNK_SIZE):
+    """Search export files in a process pool, yielding (file index, messages scanned, rows, file done).
+
+    Results come back in file and chunk order while later chunks are still
+    being searched; at most two tasks per worker are in flight, so a slow
+    consumer doesn't pile up results in memory.
+    """
+    keywords = list(dict.fromkeys(keywords))
+    exclusions = exclusions or {}
+    default_guild_id = str(default_guild_id) if default_guild_id else None
+    tasks = plan_tasks(files, chunk_size)
+    last_task = {task[0]: index for index, task in enumerate(tasks)}
+    workers = workers or os.cpu_count() or 1
+
+    # Spawned workers: forking a process that runs Tk and the bot's threads is unsafe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        pending = deque()
+        try:
+            for index, task in enumerate(tasks):
+                pending.append((index, task, pool.submit(search_task, task, keywords, exclusions, default_guild_id)))
+                if len(pending) < 2 * workers:
+                    continue
+                index, task, future = pending.popleft()
+                scanned, rows = future.result()
+                yield task[0], scanned, rows, last_task[task[0]] == index
+            while pending:
+                index, task, future = pending.popleft()
+                scanned, rows = future.result()
+                yield task[0], scanned, rows, last_task[task[0]] == index
+        finally:
+            for _, _, future in pending:
+                future.cancel()
@@ -0,0 +1,560 @@
+"""Offline benchmarks for ChatScrub.
+
+Usage:
+    python benchmark.py matcher [--messages 20000] [--keywords 1 2 5 10 50 200 1000] [--repeat 3]
+    python benchmark.py normalize [--messages 50000] [--non-ascii 0.2] [--hit-rate 0.02]
+    python benchmark.py search [--channels 4] [--messages 20000] [--hit-rate 0.02] [--latency 0.0] [--cursors 4] [--normalize]
+    python benchmark.py delete [--channels 4] [--messages 2000] [--latency 0.0]
+    python benchmark.py render [--results 5000]
+
+search, delete and render run the bot's own code (!find, the window's
+deletion job, the results page) against the fake guild in fake_discord.py, so
+they need no Discord connection. render needs a display and is skipped
+without one.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from types import SimpleNamespace
+
+from fake_discord import FakeClient, FakeContext, FakeGuild, FakeMember, SyntheticHistory
+from matcher import ExclusionFilter, KeywordMatcher, classify_spans, match_keywords
+from match_pool import MATCH_BATCH_SIZE, MatchPool, MatchSpec
+from message_index import MessageIndex
+from normalize import CONFUSABLES, normalize
+from results import MatchRecord
+from ui_events import UIEventQueue
+
+GUILD_ID = 1 << 40
+
+
+def random_word(rng, min_len=3, max_len=9):
+    """Return a random lowercase word."""
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(min_len, max_len)))
+
+
+def make_corpus(rng, message_count, keywords, hit_rate, vocabulary):
+    """Build synthetic lowercase message contents with roughly hit_rate keyword hits."""
+    messages = []
+    for _ in range(message_count):
+        words = rng.choices(vocabulary, k=rng.randint(3, 40))
+        if rng.random() < hit_rate:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(keywords))
+        messages.append(" ".join(words))
+    return messages
+
+
+def legacy_match(keywords, text, exclusions):
+    """The original per-keyword loop from find: first matching keyword, then its exclusions."""
+    text = text.lower()
+    matched_keyword = None
+    for keyword in keywords:
+        if keyword in text:
+            matched_keyword = keyword
+            break
+    if matched_keyword is None:
+        return False
+    for exclude_word in exclusions.get(matched_keyword, []):
+        if exclude_word in text:
+            return False
+    return True
+
+
+def time_it(func):
+    """Run func once and return (result, seconds)."""
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def best_of(repeat, func):
+    """Run func repeat times and return (result, fastest seconds)."""
+    runs = [time_it(func) for _ in range(max(1, repeat))]
+    return runs[0][0], min(seconds for _, seconds in runs)
+
+
+# Run-to-run spread of the matcher timings on an idle machine
+TIMING_NOISE = 0.05
+
+
+def bench_matcher(args):
+    """Compare KeywordMatcher against the legacy per-keyword loop.
+
+    "per message" is match_keywords on one text at a time; "batched" is how
+    searches match, MATCH_BATCH_SIZE texts per call through MatchSpec.match,
+    which also finds where the keywords are. Sets below
+    KeywordMatcher.AUTOMATON_THRESHOLD are searched with str.find rather than
+    the automaton, and their batches must not be slower than the loop they
+    replaced, which found no spans, beyond timing noise. Returns 1 if one of
+    them is.
+    """
+    rng = random.Random(args.seed)
+    vocabulary = [random_word(rng) for _ in range(5000)]
+
+    print(f"{'keywords':>8} {'engine':>9} {'legacy msg/s':>14} {'per message':>12} {'batched':>12} {'speedup':>8} "
+          f"{'legacy hits':>12} {'hits':>8}")
+    slower = []
+    for keyword_count in args.keywords:
+        keywords = list(dict.fromkeys(random_word(rng, 5, 10) for _ in range(keyword_count)))
+        exclusions = {keyword: [random_word(rng) for _ in range(args.exclusions)] for keyword in keywords}
+        messages = make_corpus(rng, args.messages, keywords, args.hit_rate, vocabulary)
+
+        legacy_hits, legacy_time = best_of(args.repeat, lambda: sum(
+            1 for text in messages if legacy_match(keywords, text, exclusions)
+        ))
+
+        exclusion_filters = {keyword: ExclusionFilter(words) for keyword, words in exclusions.items()}
+        matcher, compile_time = time_it(lambda: KeywordMatcher(keywords))
+        hits, scan_time = best_of(args.repeat, lambda: sum(
+            1 for text in messages if match_keywords(matcher, text.lower(), exclusion_filters)
+        ))
+        spec = MatchSpec(matcher, exclusion_filters)
+        batches = [messages[start:start + MATCH_BATCH_SIZE] for start in range(0, len(messages), MATCH_BATCH_SIZE)]
+        batch_hits, batch_time = best_of(args.repeat, lambda: sum(len(spec.match(batch)[0]) for batch in batches))
+        assert batch_hits == hits
+        speedup = legacy_time / (compile_time + batch_time)
+        small = len(keywords) < KeywordMatcher.AUTOMATON_THRESHOLD
+        if small and speedup < 1 - TIMING_NOISE:
+            slower.append(len(keywords))
+
+        print(f"{len(keywords):>8} {'find' if small else 'automaton':>9} {args.messages / legacy_time:>14,.0f} "
+              f"{args.messages / (compile_time + scan_time):>12,.0f} {args.messages / (compile_time + batch_time):>12,.0f} "
+              f"{speedup:>7.2f}x {legacy_hits:>12} {hits:>8}")
+
+    if slower:
+        print(f"⚠️ Slower than the legacy loop with {', '.join(map(str, slower))} keywords")
+        return 1
+    print(f"Keyword sets below {KeywordMatcher.AUTOMATON_THRESHOLD} are no slower than the legacy loop, within timing noise")
+    return 0
+
+
+LOOKALIKES = {latin: lookalike for lookalike, latin in CONFUSABLES.items()}
+ACCENTED_WORDS = ["café", "naïve", "über", "señor", "zoë", "привет", "日本語", "🙂"]
+
+
+def obfuscate(rng, word):
+    """Disguise a keyword the way normalization sees through: lookalikes, zero-width spaces, accents or fullwidth."""
+    style = rng.randrange(4)
+    if style == 0:
+        return "".join(LOOKALIKES.get(ch, ch) for ch in word)
+    if style == 1:
+        return "\u200b".join(word)
+    if style == 2:
+        return "".join(ch + "\u0301" for ch in word)
+    return "".join(chr(ord(ch) + 0xFEE0) for ch in word)  # Fullwidth forms
+
+
+def bench_normalize(args):
+    """Compare lowercasing with Unicode normalization on the scan path."""
+    rng = random.Random(args.seed)
+    vocabulary = [random_word(rng) for _ in range(5000)]
+    keywords = list(dict.fromkeys(random_word(rng, 5, 10) for _ in range(args.keywords)))
+    messages = []
+    for _ in range(args.messages):
+        words = rng.choices(vocabulary, k=rng.randint(3, 40))
+        if rng.random() < args.non_ascii:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(ACCENTED_WORDS))
+        if rng.random() < args.hit_rate:
+            keyword = rng.choice(keywords)
+            words.insert(rng.randrange(len(words) + 1), obfuscate(rng, keyword) if rng.random() < 0.5 else keyword)
+        messages.append(" ".join(words).capitalize())
+    matcher = KeywordMatcher(keywords)
+
+    normalize("warm up")  # Builds the translation table
+    runs = [
+        ("lower", lambda: [text.lower() for text in messages]),
+        ("normalize", lambda: [normalize(text) for text in messages]),
+    ]
+    print(f"{args.messages} messages, {args.non_ascii:.0%} with non-ASCII text, "
+          f"{args.hit_rate:.0%} with a keyword (half of them disguised)")
+    print(f"{'texts':>10} {'us/msg':>8} {'msg/s':>12} {'matches':>8}")
+    for label, func in runs:
+        texts, seconds = time_it(func)
+        hits = sum(1 for text in texts if matcher.contains_any(text))
+        print(f"{label:>10} {seconds / args.messages * 1e6:>8.2f} {args.messages / seconds:>12,.0f} {hits:>8}")
+
+
+def quietly(func):
+    """Call func with the bot's console output discarded."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return func()
+
+
+def traced_peak(func):
+    """Call func and return (result, peak bytes allocated while it ran), or None for the peak if not tracing."""
+    if not tracemalloc.is_tracing():
+        return func(), None
+    tracemalloc.reset_peak()
+    result = func()
+    return result, tracemalloc.get_traced_memory()[1]
+
+
+def with_tracemalloc(func):
+    """Call func with tracemalloc running (which slows everything down, so timings are taken without it)."""
+    tracemalloc.start()
+    try:
+        return func()
+    finally:
+        tracemalloc.stop()
+
+
+def make_guild(args, keywords):
+    """Build the fake guild: args.channels channels of args.messages synthetic messages each."""
+    guild = FakeGuild(GUILD_ID)
+    for index in range(args.channels):
+        history = SyntheticHistory(args.messages, args.content_length, args.hit_rate, keywords,
+                                   args.span_days, seed=args.seed + index)
+        guild.add_channel(f"bench-{index}", history, args.latency)
+    return guild
+
+
+def bench_keywords(args):
+    rng = random.Random(args.seed)
+    return list(dict.fromkeys(random_word(rng, 6, 10) for _ in range(args.keywords)))
+
+
+def format_mb(peak):
+    return "-" if peak is None else f"{peak / 2 ** 20:.1f}"
+
+
+async def search_once(chatscrub, ctx, keywords, concurrency, normalize=False, cursors=4, export=None):
+    """Run !find over every channel of the guild and return the finished session."""
+    channels = [f"#{channel.name}" for channel in ctx.guild.channels]
+    options = [f"export={export}"] if export else []
+    await chatscrub.find.callback(ctx, *keywords, *channels, f"concurrency={concurrency}", f"cursors={cursors}",
+                                  f"normalize={'on' if normalize else 'off'}", *options)
+    job = chatscrub.scheduler.jobs(ctx.guild.id)[-1]
+    await job.task
+    if job.state != "done":
+        raise RuntimeError(f"search job ended as {job.state}: {job.error}")
+    return chatscrub.sessions.all()[-1]
+
+
+def run_searches(args, keywords):
+    """Search a fresh fake guild twice: first fetching everything, then answered from the message index.
+
+    Returns [(label, session, seconds, peak bytes or None)].
+    """
+    import chatscrub
+    chatscrub.match_pool = MatchPool(workers=args.workers)
+    with tempfile.TemporaryDirectory() as directory:
+        chatscrub.message_index = MessageIndex(os.path.join(directory, "message_index.db"))
+        chatscrub.EXPORT_DIR = os.path.join(directory, "exports")
+        try:
+            guild = make_guild(args, keywords)
+            results = []
+            for label in ("fetch", "index"):
+                ctx = FakeContext(guild, FakeMember(1, "benchmark"))
+                (session, seconds), peak = traced_peak(lambda: time_it(lambda: quietly(
+                    lambda: asyncio.run(search_once(chatscrub, ctx, keywords, args.concurrency, args.normalize,
+                                                    args.cursors, args.export)))))
+                results.append((label, session, seconds, peak))
+            return results
+        finally:
+            chatscrub.message_index.close()
+            chatscrub.match_pool.shutdown()
+
+
+def bench_search(args):
+    """Measure !find: messages scanned and matches found per second, and peak memory."""
+    keywords = bench_keywords(args)
+    timed = run_searches(args, keywords)
+    traced = [None] * len(timed) if args.no_memory else with_tracemalloc(lambda: run_searches(args, keywords))
+
+    print(f"{args.channels} channels x {args.messages} messages, {len(keywords)} keywords, "
+          f"hit rate {args.hit_rate}, {args.latency * 1000:.0f} ms per request")
+    print(f"{'pass':>6} {'scanned':>9} {'matches':>8} {'seconds':>8} {'scanned/s':>11} {'matches/s':>10} {'peak MB':>8}")
+    for (label, session, seconds, _), traced_run in zip(timed, traced):
+        peak = traced_run[3] if traced_run else None
+        print(f"{label:>6} {session.messages_scanned:>9} {session.matches_found:>8} {seconds:>8.2f} "
+              f"{session.messages_scanned / seconds:>11,.0f} {session.matches_found / seconds:>10,.0f} {format_mb(peak):>8}")
+
+
+class DeletionHost:
+    """Just enough of the window for DiscordBotUI.perform_deletion: the app and the status callbacks it posts."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def set_status(self, text, color="blue"):
+        pass
+
+    def apply_deletion(self, session, deleted_msg_ids, channel_progress):
+        pass
+
+
+def run_deletion(args, keywords):
+    """Delete every message of a fresh fake guild through the window's deletion job.
+
+    Returns (deleted count, API requests, seconds, peak bytes or None).
+    """
+    from gui import DiscordBotUI
+    from jobs import JobScheduler
+    from search_session import SessionRegistry
+
+    guild = make_guild(args, keywords)
+    with tempfile.TemporaryDirectory() as directory:
+        app = SimpleNamespace(bot=FakeClient([guild]), scheduler=JobScheduler(), ui_events=UIEventQueue(),
+                              message_index=MessageIndex(os.path.join(directory, "message_index.db")))
+        host = DeletionHost(app)
+        session = SessionRegistry().create(guild, FakeMember(1, "benchmark"), keywords, guild.channels)
+        for channel in guild.channels:
+            for index in range(args.messages):
+                session.store.append(MatchRecord.from_message(channel.message(index)))
+        positions = array("Q", range(len(session.store)))  # Everything selected
+
+        async def delete_all():
+            job = app.scheduler.submit("delete", guild.id, f"{len(positions)} messages",
+                                       lambda job: DiscordBotUI.perform_deletion(host, job, session, positions),
+                                       "high", owner_name="benchmark")
+            await job.task
+
+        try:
+            (_, seconds), peak = traced_peak(lambda: time_it(lambda: quietly(lambda: asyncio.run(delete_all()))))
+        finally:
+            app.message_index.close()
+        app.ui_events.process()
+    deleted = sum(channel.deleted for channel in guild.channels)
+    requests = sum(channel.requests for channel in guild.channels)
+    return deleted, requests, seconds, peak
+
+
+def bench_delete(args):
+    """Measure the window's deletion job: deletions per second, API requests and peak memory."""
+    try:
+        import gui  # noqa: F401 (the deletion job lives in the window class)
+    except ImportError as e:
+        print(f"Skipped: the deletion job needs Tkinter ({e})")
+        return
+    keywords = bench_keywords(args)
+    deleted, requests, seconds, _ = run_deletion(args, keywords)
+    peak = None if args.no_memory else with_tracemalloc(lambda: run_deletion(args, keywords))[3]
+
+    print(f"{args.channels} channels x {args.messages} messages over {args.span_days} days "
+          f"(older than 14 days are deleted one by one), {args.latency * 1000:.0f} ms per request")
+    print(f"{'deleted':>8} {'requests':>9} {'seconds':>8} {'deleted/s':>10} {'peak MB':>8}")
+    print(f"{deleted:>8} {requests:>9} {seconds:>8.2f} {deleted / seconds:>10,.0f} {format_mb(peak):>8}")
+
+
+def bench_select(args):
+    """Measure the selection model: selecting every result, a channel or an author, and reading it for deletion."""
+    from results import ResultStore, ResultView
+    from selection import Selection
+
+    guild = make_guild(args, bench_keywords(args))
+    store = ResultStore()
+    for channel in guild.channels:
+        for index in range(args.messages):
+            store.append(MatchRecord.from_message(channel.message(index)))
+    # The final order of a search is a view with positions, not the store's own order
+    view = ResultView(store, array("Q", sorted(range(len(store)), key=store.id_at)))
+    channel_id = guild.channels[0].id
+    author_id = guild.channels[0].message(0).author.id
+    selection = Selection()
+
+    operations = [
+        ("select all", lambda: selection.select(view.mask())),
+        ("invert all", lambda: selection.invert(view.mask())),
+        ("select page", lambda: selection.select(view.mask(0, args.page_size))),
+        ("page selected?", lambda: selection.covers(view.mask(0, args.page_size))),
+        ("select channel", lambda: selection.select(store.mask_where(channel_id=channel_id) & view.mask())),
+        ("select author", lambda: selection.select(store.mask_where(author_id=author_id) & view.mask())),
+        ("positions", selection.positions),
+    ]
+    print(f"{len(store)} results, {args.repeat} runs per operation, pages of {args.page_size}")
+    print(f"{'operation':>15} {'median ms':>10} {'max ms':>8}")
+    for label, operation in operations:
+        times = [time_it(operation)[1] for _ in range(args.repeat)]
+        print(f"{label:>15} {statistics.median(times) * 1000:>10.2f} {max(times) * 1000:>8.2f}")
+    store.close()
+
+
+def bench_results(args):
+    """Measure removing deleted results from the final view and paging through what remains."""
+    from results import ResultStore, ResultView
+
+    store = ResultStore()
+    for index in range(args.results):
+        store.append(MatchRecord(index + 1, 1, "bench", 1, "user", "needle"))
+    order = array("Q", range(args.results - 1, -1, -1))  # Newest first, like a merged final order
+    rng = random.Random(args.seed)
+    removed = rng.sample(range(args.results), min(args.deleted, args.results))
+    batches = [removed[start:start + args.batch] for start in range(0, len(removed), args.batch)]
+
+    def rebuild():
+        # Filtering the whole view per finished deletion, as the view did before it had tombstones
+        positions = order
+        gone = set()
+        for batch in batches:
+            gone.update(batch)
+            positions = array("Q", (position for position in positions if position not in gone))
+        return ResultView(store, positions)
+
+    def tombstones():
+        view = ResultView(store, order)
+        for batch in batches:
+            view.remove(batch)
+        return view
+
+    def page_through(view):
+        for start in range(0, len(view), args.page_size):
+            view.ids(start, start + args.page_size)
+
+    print(f"{args.results} results, {len(removed)} removed in batches of {args.batch}, pages of {args.page_size}")
+    print(f"{'view':>11} {'remove ms':>10} {'all pages ms':>13} {'remaining':>10}")
+    for label, remove in (("rebuild", rebuild), ("tombstones", tombstones)):
+        view, remove_seconds = time_it(remove)
+        page_seconds = time_it(lambda: page_through(view))[1]
+        print(f"{label:>11} {remove_seconds * 1000:>10.1f} {page_seconds * 1000:>13.1f} {len(view):>10}")
+    store.close()
+
+
+def bench_render(args):
+    """Measure drawing a page of results in the window at each page size."""
+    try:
+        import tkinter as tk
+        from gui import DiscordBotUI
+    except ImportError as e:
+        print(f"Skipped: {e}")
+        return
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        print(f"Skipped: no display ({e})")
+        return
+
+    from jobs import JobScheduler
+    from search_session import SessionRegistry
+
+    keywords = bench_keywords(args)
+    args.channels = max(1, args.channels)
+    args.messages = max(1, args.results // args.channels)
+    args.hit_rate = 1.0
+    guild = make_guild(args, keywords)
+    app = SimpleNamespace(bot=FakeClient([guild]), sessions=SessionRegistry(), scheduler=JobScheduler(),
+                          ui_events=UIEventQueue(), message_index=None, exclusion_lists={})
+    try:
+        ui = DiscordBotUI(root, app)
+        session = app.sessions.create(guild, FakeMember(1, "benchmark"), keywords, guild.channels)
+        matcher = KeywordMatcher(keywords)
+        for channel in guild.channels:
+            for index in range(args.messages):
+                # Keyword spans as a search would have found them, for the highlighting
+                message = channel.message(index)
+                spans = classify_spans(matcher, message.content.lower(), {})[2]
+                session.store.append(MatchRecord.from_message(message, spans))
+        session.matches_found = len(session.store)
+        session.finish()
+        ui.show_session(session)
+        root.update()
+
+        print(f"{len(session.results)} results, {args.repeat} draws per page size")
+        print(f"{'page size':>10} {'median ms':>10} {'max ms':>8} {'peak MB':>8}")
+        for page_size in args.page_sizes:
+            ui.page_size_var.set(page_size)
+            ui.change_page_size()
+            root.update()
+
+            def draw():
+                ui.display_current_page()
+                root.update()
+
+            times = [time_it(draw)[1] for _ in range(args.repeat)]
+            peak = None if args.no_memory else with_tracemalloc(lambda: traced_peak(draw))[1]
+            print(f"{page_size:>10} {statistics.median(times) * 1000:>10.1f} {max(times) * 1000:>8.1f} "
+                  f"{format_mb(peak):>8}")
+    finally:
+        root.destroy()
+
+
+BENCHMARKS = {
+    "matcher": bench_matcher,
+    "normalize": bench_normalize,
+    "search": bench_search,
+    "delete": bench_delete,
+    "select": bench_select,
+    "results": bench_results,
+    "render": bench_render,
+}
+
+
+def add_guild_arguments(parser, messages, hit_rate=0.02):
+    """Options describing the fake guild's synthetic history."""
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=messages, help="messages per channel")
+    parser.add_argument("--content-length", type=int, default=80, help="characters per message")
+    parser.add_argument("--hit-rate", type=float, default=hit_rate, help="fraction of messages with a keyword")
+    parser.add_argument("--keywords", type=int, default=3)
+    parser.add_argument("--span-days", type=float, default=30, help="age of the oldest message")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every API request takes")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run for peak memory")
+    parser.add_argument("--seed", type=int, default=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChatScrub benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    matcher_parser = subparsers.add_parser("matcher", help="keyword matcher vs. legacy loop")
+    matcher_parser.add_argument("--messages", type=int, default=20000)
+    matcher_parser.add_argument("--keywords", type=int, nargs="+", default=[1, 2, 5, 10, 50, 200, 1000])
+    matcher_parser.add_argument("--repeat", type=int, default=3, help="runs timed per keyword set; the fastest counts")
+    matcher_parser.add_argument("--exclusions", type=int, default=5, help="exclusion words per keyword")
+    matcher_parser.add_argument("--hit-rate", type=float, default=0.02)
+    matcher_parser.add_argument("--seed", type=int, default=1)
+
+    normalize_parser = subparsers.add_parser("normalize", help="Unicode normalization vs. lowercasing")
+    normalize_parser.add_argument("--messages", type=int, default=50000)
+    normalize_parser.add_argument("--keywords", type=int, default=10)
+    normalize_parser.add_argument("--non-ascii", type=float, default=0.2, help="fraction of messages with non-ASCII text")
+    normalize_parser.add_argument("--hit-rate", type=float, default=0.02)
+    normalize_parser.add_argument("--seed", type=int, default=1)
+
+    search_parser = subparsers.add_parser("search", help="!find against a fake guild")
+    add_guild_arguments(search_parser, messages=20000)
+    search_parser.add_argument("--concurrency", type=int, default=4, help="channels scanned at the same time")
+    search_parser.add_argument("--workers", type=int, default=None,
+                               help="matching processes (0 matches on the event loop; default: one per CPU core)")
+    search_parser.add_argument("--cursors", type=int, default=4,
+                               help="time ranges of one channel fetched at the same time (1 reads it front to back)")
+    search_parser.add_argument("--normalize", action="store_true", help="search with normalize=on")
+    search_parser.add_argument("--export", choices=["jsonl", "csv", "jsonl.gz", "csv.gz"],
+                               help="also stream the matches to an export file")
+
+    delete_parser = subparsers.add_parser("delete", help="the window's deletion job against a fake guild")
+    add_guild_arguments(delete_parser, messages=2000)
+
+    select_parser = subparsers.add_parser("select", help="selecting results across all pages")
+    add_guild_arguments(select_parser, messages=20000, hit_rate=1.0)
+    select_parser.add_argument("--page-size", type=int, default=100)
+    select_parser.add_argument("--repeat", type=int, default=20, help="runs timed per operation")
+
+    results_parser = subparsers.add_parser("results", help="removing deleted results and paging")
+    results_parser.add_argument("--results", type=int, default=50000)
+    results_parser.add_argument("--deleted", type=int, default=10000)
+    results_parser.add_argument("--batch", type=int, default=100, help="results removed per finished deletion")
+    results_parser.add_argument("--page-size", type=int, default=100)
+    results_parser.add_argument("--seed", type=int, default=1)
+
+    render_parser = subparsers.add_parser("render", help="drawing a results page (needs a display)")
+    add_guild_arguments(render_parser, messages=0, hit_rate=1.0)
+    render_parser.add_argument("--results", type=int, default=5000)
+    render_parser.add_argument("--page-sizes", nargs="+", default=["50", "100", "500", "1000", "All"])
+    render_parser.add_argument("--repeat", type=int, default=20, help="draws timed per page size")
+
+    args = parser.parse_args()
+    return BENCHMARKS[args.benchmark](args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,527 @@
+"""Scanning the channels of a search: the local index first, then Discord.
+
+A channel's history up to its high-water mark is answered from the message
+index (see message_index.py). Only newer messages are fetched, split into
+time ranges that several cursors fetch at once (see scan_planner.py), and
+matched in the worker processes (see match_pool.py) while fetching goes on.
+Fetched messages are written to the index in batches, and the channel is
+checkpointed as far as its history is stored without gaps, so an
+interrupted search can be resumed.
+
+SearchScan holds what the channels of one search share; ChannelScan scans
+one of them.
+"""
+
+import asyncio
+import bisect
+import time
+from array import array
+from collections import deque
+
+import discord
+
+import metrics
+from export import EXPORT_BATCH
+from jobs import HISTORY_PAGE_SIZE
+from match_pool import MATCH_BATCH_SIZE
+from message_index import CANDIDATE_PAGE_SIZE
+from results import MatchRecord
+from scan_planner import plan_ranges
+from search_filters import message_flags
+
+INDEX_BATCH_SIZE = 500  # Number of fetched messages written to the index at once
+UI_BATCH_SIZE = 500  # Matches recorded between two updates of the results view
+
+
+def edited_timestamp(message):
+    """Return when a message was last edited as a timestamp, or None if it never was."""
+    return message.edited_at.timestamp() if message.edited_at else None
+
+
+async def chain_history(messages, history):
+    """Yield messages that were already fetched, then the rest of the history (if any)."""
+    for message in messages:
+        yield message
+    if history is not None:
+        async for message in history:
+            yield message
+
+
+async def next_batch(pipeline):
+    """Wait for the oldest batch of a match pipeline, timing how long the scan waits for matching."""
+    with metrics.scan_step_seconds.time(step="match"):
+        return await pipeline.next()
+
+
+class SearchScan:
+    """The parts of a search its channel scans share.
+
+    message_index, match_pool and scheduler are the bot's; report(event,
+    session, key=None) sends progress to the window. checkpoints are the
+    channel checkpoints of the search being resumed, by channel ID. Matches
+    are also written to exporter, if given.
+    """
+
+    def __init__(self, ctx, job, session, match_spec, filters, message_index, match_pool, scheduler, report,
+                 search_id, checkpoints=None, cursors=1, exporter=None):
+        self.ctx = ctx
+        self.job = job
+        self.session = session
+        self.match_spec = match_spec
+        self.filters = filters
+        self.message_index = message_index
+        self.match_pool = match_pool
+        self.scheduler = scheduler
+        self.report = report
+        self.search_id = search_id
+        self.checkpoints = checkpoints or {}
+        self.cursors = cursors
+        self.exporter = exporter
+        # Store positions of each channel's matches, so channels can be scanned concurrently
+        self.channel_positions = {channel_id: array("Q") for channel_id in session.channel_ids}
+        self.semaphore = asyncio.Semaphore(session.concurrency)
+
+    def message_texts(self, messages):
+        """Return the texts of fetched messages to match; messages the filters reject get none."""
+        if not self.filters.checks_messages:
+            return [message.content for message in messages]
+        return [message.content if self.filters.accepts(message.author.id, message_flags(message)) else ""
+                for message in messages]
+
+    def row_texts(self, rows):
+        """Return the texts of index rows to match."""
+        return [row[4] for row in rows]
+
+    async def scan_channel(self, channel):
+        await ChannelScan(self, channel).run()
+
+    def order(self, channels):
+        """Return the store positions of all matches: channels in the given order, oldest message first."""
+        order = array("Q")
+        for channel in channels:
+            order.extend(self.channel_positions[channel.id])
+        return order
+
+
+class ChannelScan:
+    """One channel of a search: answered from the local index, then fetched from Discord."""
+
+    def __init__(self, search, channel):
+        self.search = search
+        self.session = search.session
+        self.channel = channel
+        self.progress = search.session.channel_progress[channel.id]
+        self.positions = search.channel_positions[channel.id]
+        self.current_batch = 0  # Matches not yet reported to the UI
+        self.pending_match_ids = []  # Matches from the local index not yet recorded in a checkpoint
+        self.checkpoint_position = None  # Last message ID recorded in a checkpoint
+        self.fetch_started = None  # When fetching from Discord began, for the channel's scan rate
+        self.fetched = 0
+        self.extends_index = True  # Whether fetched messages continue the indexed history without a gap
+        self.fetch_ranges = []  # Time ranges of the history fetched from Discord, oldest first
+        self.frontier = 0  # First fetch range not done; everything before it is in the index
+        self.index_lock = asyncio.Lock()  # The ranges' index writes and checkpoints, one at a time
+
+    async def run(self):
+        """Scan the channel, answering stored history from the local index and fetching only newer messages."""
+        search = self.search
+        channel = self.channel
+        resume_after = None
+        state = search.checkpoints.get(channel.id)
+        if state:
+            resume_after = await self.restore_checkpoint(state)
+            if state["done"]:
+                self.progress["status"] = "done"
+                return
+
+        async with search.semaphore:
+            print(f"Searching in #{channel.name}...")
+
+            try:
+                high_water_mark = await self.answer_from_index(resume_after)
+                await self.fetch_new_messages(high_water_mark, resume_after)
+            except discord.Forbidden:
+                self.progress["status"] = "no permission"
+                print(f"No permission to read messages in #{channel.name}")
+                await search.ctx.send(f"⚠️ No permission to read messages in #{channel.name}")
+            except Exception as e:
+                self.progress["status"] = "error"
+                print(f"Error searching channel {channel.name}: {e}")
+                await search.ctx.send(f"⚠️ Error searching #{channel.name}: {e}")
+
+            # Fetched messages can always be stored, even if the scan stopped early;
+            # only the ones that continue the complete history move the high-water mark
+            try:
+                for fetch_range in self.fetch_ranges:
+                    await self.flush_range(fetch_range)
+                if self.progress["status"] == "done":
+                    await self.save_checkpoint(self.checkpoint_position, done=True)
+            except Exception as e:
+                print(f"Error updating message index for #{channel.name}: {e}")
+            metrics.channel_scan_rate.remove(guild=search.ctx.guild.id, channel=channel.name)
+
+        # The ranges' matches follow the ones from the index, oldest range first
+        for fetch_range in self.fetch_ranges:
+            self.positions.extend(fetch_range.positions)
+
+        # Process any remaining matches in the final batch
+        if self.current_batch:
+            search.report("update_matches", self.session, key=("matches", self.session.session_id))
+
+    # Recording matches
+
+    async def limit_reached(self):
+        """Check the result limit, warning the user the first time it is hit."""
+        session = self.session
+        if not session.limit_reached():
+            return False
+        if not session.limit_warning_sent:
+            session.limit_warning_sent = True
+            await self.search.ctx.send(f"⚠️ Reached limit of {session.max_results} matches. "
+                                       "Try a more specific search.")
+        self.progress["status"] = "stopped (limit reached)"
+        return True
+
+    async def add_match(self, record, fetch_range=None):
+        """Record a match (of a fetch range, or from the index) and stream it to the UI in batches."""
+        session = self.session
+        exporter = self.search.exporter
+        session.matches_found += 1
+        self.progress["matches"] += 1
+        position = session.store.append(record)
+        if exporter is not None:
+            exporter.write(record)
+            if exporter.pending >= EXPORT_BATCH:
+                await exporter.flush_async()
+        if fetch_range is None:
+            self.positions.append(position)
+            self.pending_match_ids.append(record.id)
+        else:
+            fetch_range.positions.append(position)
+            fetch_range.pending_match_ids.append(record.id)
+        self.current_batch += 1
+
+        # Process in smaller batches to keep UI responsive
+        if self.current_batch >= UI_BATCH_SIZE:
+            # Batches that pile up are merged into one redraw by the event queue
+            self.search.report("update_matches", session, key=("matches", session.session_id))
+            self.current_batch = 0
+
+    async def add_stored_match(self, row, spans=None, keyword_ids=None):
+        """Record a match read from the local index; its keyword spans and IDs are found again if not given."""
+        if spans is None:
+            _, _, found_spans, found_keyword_ids = self.search.match_spec.match(self.search.row_texts([row]))
+            spans, keyword_ids = (found_spans[0], found_keyword_ids[0]) if found_spans else ((), ())
+        await self.add_match(MatchRecord.from_row(self.channel, row, spans, keyword_ids))
+
+    # Answering from the index
+
+    async def answer_from_index(self, resume_after=None):
+        """Match the stored history within the date range, after resume_after. Returns the high-water mark.
+
+        Author and has: filters are applied by the query.
+        """
+        search = self.search
+        filters = search.filters
+        message_index = search.message_index
+        progress = self.progress
+        high_water_mark = await asyncio.to_thread(message_index.high_water_mark, self.channel.id)
+        index_max = high_water_mark
+        if index_max and filters.before_id:
+            index_max = min(index_max, filters.before_id - 1)
+        index_min = max(resume_after or 0, filters.after_id or 0) or None
+        if not index_max or (index_min is not None and index_min >= index_max):
+            return high_water_mark
+
+        progress["status"] = "searching index"
+        stored_count = await asyncio.to_thread(message_index.count_messages, self.channel.id, index_max, index_min)
+        self.session.messages_scanned += stored_count
+        progress["scanned"] += stored_count
+        metrics.messages_scanned.inc(stored_count, source="index")
+
+        # Match in the worker processes, a few batches ahead of recording the matches
+        match_spec = search.match_spec
+        pipeline = search.match_pool.pipeline(match_spec)
+        completed = True
+        try:
+            # Read the stored rows a page at a time, so a search that has to look at
+            # every row never holds the channel's whole history in memory
+            page_min = index_min
+            while completed:
+                rows = await asyncio.to_thread(message_index.candidate_messages, self.channel.id,
+                                               match_spec.matcher.keywords, index_max, page_min, filters.author_ids,
+                                               filters.has_mask, match_spec.normalize, CANDIDATE_PAGE_SIZE)
+                for start in range(0, len(rows), MATCH_BATCH_SIZE):
+                    batch = rows[start:start + MATCH_BATCH_SIZE]
+                    pipeline.submit(batch, search.row_texts(batch))
+                    if pipeline.full() and not await self.add_matched_rows(*await next_batch(pipeline)):
+                        completed = False
+                        break
+                if len(rows) < CANDIDATE_PAGE_SIZE:
+                    break
+                page_min = rows[-1][0]
+            while completed and pipeline:
+                completed = await self.add_matched_rows(*await next_batch(pipeline))
+            if completed:
+                await self.save_checkpoint(high_water_mark)
+        finally:
+            pipeline.cancel()
+        return high_water_mark
+
+    async def add_matched_rows(self, rows, result):
+        """Record the matching rows of a batch from the local index. Returns False once the limit is hit."""
+        matched, excluded_hits, spans, keyword_ids = result
+        metrics.exclusion_hits.inc(excluded_hits, source="index")
+        await self.search.job.wait_if_paused()
+        for count, index in enumerate(matched):
+            if await self.limit_reached():
+                metrics.matches_found.inc(count, source="index")
+                return False
+            await self.add_stored_match(rows[index], spans[count], keyword_ids[count])
+        metrics.matches_found.inc(len(matched), source="index")
+        return True
+
+    # Fetching from Discord
+
+    async def fetch_new_messages(self, high_water_mark, resume_after=None):
+        """Fetch the history past the high-water mark (or the checkpoint), within the date range.
+
+        Messages fetched from after a later after: date don't continue the
+        indexed history, so they can't extend it.
+        """
+        search = self.search
+        filters = search.filters
+        progress = self.progress
+        fetch_after = max(high_water_mark or 0, resume_after or 0)
+        if filters.after_id and filters.after_id > fetch_after:
+            fetch_after = filters.after_id
+        self.extends_index = fetch_after == (high_water_mark or 0)
+        if progress["status"] == "stopped (limit reached)":
+            return
+        if filters.before_id and fetch_after >= filters.before_id - 1:
+            progress["status"] = "done"  # The index already covers the whole date range
+            return
+
+        progress["status"] = "fetching"
+        self.fetch_started = time.monotonic()
+        # The first page of the history shows whether the channel is big enough to
+        # split into time ranges, fetched by several cursors at once
+        after = discord.Object(id=fetch_after) if fetch_after else None
+        before = discord.Object(id=filters.before_id) if filters.before_id else None
+        history = search.scheduler.paced(self.channel.history(limit=HISTORY_PAGE_SIZE, after=after, before=before,
+                                                              oldest_first=True), search.job)
+        first_page = [message async for message in history]
+        self.fetch_ranges = plan_ranges(fetch_after or None, filters.before_id, first_page, search.cursors)
+        if len(self.fetch_ranges) > 1:
+            print(f"Fetching #{self.channel.name} in {len(self.fetch_ranges)} time ranges, "
+                  f"{min(search.cursors, len(self.fetch_ranges))} at a time")
+        if await self.fetch_ranges_concurrently():
+            progress["status"] = "done"
+
+    async def fetch_ranges_concurrently(self):
+        """Fetch the ranges with up to search.cursors cursors, oldest range first. Returns True if all are done."""
+        queue = deque(self.fetch_ranges)
+        stopped = False
+
+        async def cursor():
+            nonlocal stopped
+            while queue and not stopped:
+                fetch_range = queue.popleft()
+                if not await self.fetch_range_messages(fetch_range):
+                    stopped = True
+                    return
+                await self.finish_range(fetch_range)
+
+        tasks = [asyncio.create_task(cursor()) for _ in range(min(self.search.cursors, len(self.fetch_ranges)))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # One cursor failed (or the scan was cancelled); stop the others before giving up
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return not stopped
+
+    async def fetch_range_messages(self, fetch_range):
+        """Fetch one range of the history, matching it in the worker processes while fetching goes on.
+
+        Returns True once the whole range is recorded, False if the scan stopped early.
+        """
+        search = self.search
+        history = None
+        if not fetch_range.exhausted:
+            after = discord.Object(id=fetch_range.fetch_after) if fetch_range.fetch_after else None
+            before = discord.Object(id=fetch_range.before_id) if fetch_range.before_id else None
+            # One API permit per page of history, shared fairly with other servers' jobs
+            history = search.scheduler.paced(self.channel.history(limit=None, after=after, before=before,
+                                                                  oldest_first=True), search.job)
+        pipeline = search.match_pool.pipeline(search.match_spec)
+        batch = []
+        completed = False
+        try:
+            async for message in chain_history(fetch_range.prefetched, history):
+                if await self.limit_reached():
+                    break
+
+                batch.append(message)
+                if len(batch) >= MATCH_BATCH_SIZE:
+                    pipeline.submit(batch, search.message_texts(batch))
+                    batch = []
+                    # Record the oldest batch's matches before fetching too far ahead
+                    if pipeline.full() and not await self.add_matched_messages(fetch_range,
+                                                                               *await next_batch(pipeline)):
+                        break
+            else:
+                completed = True
+            fetch_range.prefetched = []
+
+            # Give the API permit back, then record the batches still being matched, in order
+            if history is not None:
+                await history.aclose()
+            if batch:
+                pipeline.submit(batch, search.message_texts(batch))
+            while pipeline:
+                if not await self.add_matched_messages(fetch_range, *await next_batch(pipeline)):
+                    completed = False
+                    break
+        finally:
+            pipeline.cancel()
+            if history is not None:
+                await history.aclose()
+        return completed
+
+    async def add_matched_messages(self, fetch_range, messages, result):
+        """Record a matched batch of a range's fetched messages in fetch order and queue it for the index.
+
+        Messages only count as scanned, and only go to the index (and so
+        into a checkpoint), once their matches are recorded. Returns False
+        once the result limit is hit.
+        """
+        session = self.session
+        progress = self.progress
+        matched, excluded_hits, spans, keyword_ids = result
+        matched = dict(zip(matched, zip(spans, keyword_ids)))
+        scanned = matches = 0
+        completed = True
+        for index, message in enumerate(messages):
+            if index in matched:
+                if await self.limit_reached():
+                    completed = False
+                    break
+                message_spans, message_keyword_ids = matched[index]
+                record = MatchRecord.from_message(message, message_spans, message_keyword_ids)
+                await self.add_match(record, fetch_range)
+                matches += 1
+
+            scanned += 1
+            fetch_range.scanned += 1
+            session.messages_scanned += 1
+            progress["scanned"] += 1
+
+            if progress["scanned"] % 100 == 0:
+                print(f"Scanned {progress['scanned']} messages in #{self.channel.name}...")
+
+            # Add the message to the index in batches, checkpointing after each one
+            fetch_range.pending_rows.append((message.id, message.author.id, str(message.author),
+                                             message.created_at.timestamp(), message.content,
+                                             edited_timestamp(message), message_flags(message)))
+            if len(fetch_range.pending_rows) >= INDEX_BATCH_SIZE:
+                await self.flush_range(fetch_range)
+        self.record_fetch_metrics(scanned, matches, excluded_hits)
+        return completed
+
+    def record_fetch_metrics(self, scanned, matches, excluded_hits):
+        """Count a recorded batch of fetched messages and update the channel's scan rate."""
+        self.fetched += scanned
+        metrics.messages_scanned.inc(scanned, source="fetch")
+        metrics.matches_found.inc(matches, source="fetch")
+        metrics.exclusion_hits.inc(excluded_hits, source="fetch")
+        elapsed = time.monotonic() - self.fetch_started
+        if elapsed > 0:
+            metrics.channel_scan_rate.set(self.fetched / elapsed, guild=self.search.ctx.guild.id,
+                                          channel=self.channel.name)
+
+    # Storing and checkpointing
+
+    async def restore_checkpoint(self, state):
+        """Restore the progress and matches of an interrupted search; returns the last checkpointed message ID."""
+        session = self.session
+        self.checkpoint_position = state["last_message_id"]
+        self.progress["scanned"] = state["scanned"]
+        session.messages_scanned += state["scanned"]
+        for row in await asyncio.to_thread(self.search.message_index.checkpoint_results, self.search.search_id,
+                                           self.channel.id):
+            await self.add_stored_match(row)
+        self.pending_match_ids.clear()  # Already recorded in the checkpoint
+        return self.checkpoint_position
+
+    async def save_checkpoint(self, last_message_id, match_ids=None, done=False):
+        """Checkpoint the channel; everything up to last_message_id must already be in the index.
+
+        match_ids are the matches up to last_message_id not checkpointed
+        yet (by default the ones found in the index); they are cleared.
+        """
+        self.checkpoint_position = last_message_id
+        if match_ids is None:
+            match_ids = self.pending_match_ids
+        new_result_ids = match_ids.copy()
+        match_ids.clear()
+        # Messages past the checkpoint (not stored yet, or in ranges past the frontier)
+        # are fetched again on resume, so they don't count yet
+        scanned = self.progress["scanned"]
+        for index, fetch_range in enumerate(self.fetch_ranges[self.frontier:]):
+            scanned -= len(fetch_range.pending_rows) if index == 0 else fetch_range.scanned
+        await asyncio.to_thread(self.search.message_index.save_checkpoint, self.search.search_id, self.channel.id,
+                                last_message_id, scanned, new_result_ids, done)
+
+    async def flush_range(self, fetch_range):
+        """Write a range's fetched messages to the index.
+
+        Only the range at the frontier continues the complete history, so
+        only its messages move the high-water mark and the checkpoint.
+        Later ranges are stored and catch up when the frontier reaches them.
+        """
+        fetch_ranges = self.fetch_ranges
+        async with self.index_lock:
+            rows, fetch_range.pending_rows = fetch_range.pending_rows, []
+            if not rows:
+                return
+            fetch_range.last_message_id = rows[-1][0]
+            at_frontier = self.frontier < len(fetch_ranges) and fetch_ranges[self.frontier] is fetch_range
+            with metrics.scan_step_seconds.time(step="index"):
+                # Messages fetched past a gap are stored without moving the high-water mark
+                await asyncio.to_thread(self.search.message_index.store_messages, self.channel.id, rows,
+                                        fetch_range.last_message_id if at_frontier and self.extends_index else None)
+            if at_frontier:
+                await self.save_checkpoint(fetch_range.last_message_id, fetch_range.pending_match_ids)
+
+    async def finish_range(self, fetch_range):
+        """Mark a fully fetched range done and move the frontier past the ranges that are done."""
+        fetch_ranges = self.fetch_ranges
+        await self.flush_range(fetch_range)
+        fetch_range.done = True
+        async with self.index_lock:
+            last_message_id = None
+            match_ids = []
+            while self.frontier < len(fetch_ranges):
+                current = fetch_ranges[self.frontier]
+                if not current.done:
+                    # Its messages stored so far now continue the complete history; its
+                    # matches of messages not stored yet wait for its next flush
+                    if current.last_message_id:
+                        last_message_id = current.last_message_id
+                        stored = bisect.bisect_right(current.pending_match_ids, last_message_id)
+                        match_ids.extend(current.pending_match_ids[:stored])
+                        del current.pending_match_ids[:stored]
+                    break
+                last_message_id = current.boundary or last_message_id
+                match_ids.extend(current.pending_match_ids)
+                current.pending_match_ids.clear()
+                self.frontier += 1
+            if last_message_id is None:
+                return
+            if self.extends_index:
+                await asyncio.to_thread(self.search.message_index.store_messages, self.channel.id, [],
+                                        last_message_id)
+            await self.save_checkpoint(last_message_id, match_ids)
@@ -1,18 +1,34 @@
+"""ChatScrub: a Discord bot for finding and deleting messages by keyword.
+
+Run with the Tkinter window (default) or with --headless on servers without a
+display. Importing this module has no side effects: the token, the message
+index and the window are only set up by main().
+"""
+
 import os
+import sys
+import argparse
 import discord
-import tkinter as tk
-from tkinter import ttk
 from discord.ext import commands
 from dotenv import load_dotenv
 import asyncio
 import threading
 import time
-import json
 import os.path
-
-# Load bot token from .env file
-load_dotenv()
-TOKEN = os.getenv("DISCORD_BOT_TOKEN")
+from matcher import ExclusionCache, KeywordMatcher
+from message_index import MessageIndex
+from results import MatchRecord, ResultView
+from search_session import SessionRegistry
+from jobs import PRIORITIES, JobScheduler
+from ui_events import UIEventQueue
+from exclusion_store import ExclusionStore
+from archive_search import ArchiveSource, find_archive_files, search_archives
+from export import MatchExporter, export_path, export_results, parse_export
+from match_pool import MatchPool, MatchSpec
+from normalize import normalize as normalize_text
+from search_filters import SearchFilters, parse_filters
+from channel_scan import SearchScan
+import metrics
 
 # Bot setup with necessary intents
 intents = discord.Intents.default()
@@ -20,637 +36,145 @@ intents.message_content = True
 intents.guilds = True
 intents.messages = True
 
-# Initialize the bot with a command prefix and specified intents
-bot = commands.Bot(command_prefix="!", intents=intents)
+# Initialize the bot with a command prefix and specified intents; every API
+# request is timed for the metrics
+bot = commands.Bot(command_prefix="!", intents=intents, http_trace=metrics.http_trace())
+
+# Search sessions: counters, results and limits of every running and recently
+# finished search, so searches in several servers can run at the same time
+sessions = SessionRegistry()
 
-# Store found messages for UI selection
-found_messages = {}
+# Searches and deletions run as background jobs that share the API budget fairly between servers
+scheduler = JobScheduler()
 
-# Progress tracking variables
-search_in_progress = False
-messages_scanned = 0
-matches_found = 0  # New counter for matches
-channels_total = 0
-current_channel = ""
-search_start_time = 0
-search_end_time = 0
-max_results = 100000  # Maximum number of results to store (to prevent memory issues)
+# Search defaults (limit=, concurrency= and cursors= override them for one search)
+DEFAULT_MAX_RESULTS = None  # Maximum number of results to store (None for no limit; older results spill to disk)
+DEFAULT_SCAN_CONCURRENCY = 4  # Number of channels scanned at the same time
+MAX_SCAN_CONCURRENCY = 16
+DEFAULT_CHANNEL_CURSORS = 4  # Time ranges of one big channel fetched at the same time
+MAX_CHANNEL_CURSORS = 16
+DEFAULT_NORMALIZE = False  # Fold Unicode lookalikes, accents and invisible characters before matching
+ARCHIVE_WORKERS = None  # Processes for searches of exported archives (None for one per CPU core)
+EXPORT_DIR = "exports"  # Files written by export= and !export
+METRICS_PORT = None  # Serve Prometheus metrics on localhost at this port (None to disable; --metrics-port)
+
+# Matching of large batches runs in worker processes, keeping the event loop free
+match_pool = MatchPool()
+
+# Events from the bot thread to the UI; Tk widgets are only touched from the Tk thread
+ui_events = UIEventQueue()
+ui = None  # The Tkinter window, or None when running headless
 
 # Exclusion system variables
-exclusion_lists = {}  # Dictionary to store exclusion lists by guild ID
-EXCLUSION_FILE = "exclusion_lists.json"  # File to store exclusion lists
+EXCLUSION_DIR = "exclusion_lists"  # One JSON file per guild
+EXCLUSION_FILE = "exclusion_lists.json"  # Old single-file store, migrated on first load
+exclusion_store = ExclusionStore(EXCLUSION_DIR, legacy_file=EXCLUSION_FILE)
+exclusion_lists = exclusion_store.lists  # Dictionary to store exclusion lists by guild ID
+exclusion_cache = ExclusionCache()  # Compiled exclusion filters per (guild, keyword)
 
 def load_exclusion_lists():
-    """Load exclusion lists from file."""
-    global exclusion_lists
+    """Load exclusion lists from disk. Called once at startup."""
     try:
-        if os.path.exists(EXCLUSION_FILE):
-            with open(EXCLUSION_FILE, 'r') as f:
-                exclusion_lists = json.load(f)
-                print(f"Loaded exclusion lists for {len(exclusion_lists)} guilds")
+        exclusion_store.load()
+        print(f"Loaded exclusion lists for {len(exclusion_lists)} guilds")
     except Exception as e:
         print(f"Error loading exclusion lists: {e}")
-        exclusion_lists = {}
+    exclusion_cache.invalidate()
 
-def save_exclusion_lists():
-    """Save exclusion lists to file."""
-    try:
-        with open(EXCLUSION_FILE, 'w') as f:
-            json.dump(exclusion_lists, f, indent=2)
-        print("Exclusion lists saved to file")
-    except Exception as e:
-        print(f"Error saving exclusion lists: {e}")
-
-class DiscordBotUI:
-    def __init__(self, root):
-        """Initialize the Tkinter UI for managing Discord messages."""
-        self.root = root
-        self.root.title("Discord Message Manager")
-        self.root.geometry("900x600")
-        
-        # Make root window resizable
-        self.root.columnconfigure(0, weight=1)
-        self.root.rowconfigure(0, weight=1)
+# Local message index so repeat searches only fetch new messages
+MESSAGE_INDEX_FILE = "message_index.db"
+message_index = None  # Opened by main()
 
-        # Progress Frame
-        self.progress_frame = ttk.LabelFrame(self.root, text="Search Progress")
-        self.progress_frame.pack(fill="x", padx=10, pady=5)
-        
-        # Progress Bar
-        self.progress_var = tk.DoubleVar()
-        self.progress_bar = ttk.Progressbar(self.progress_frame, variable=self.progress_var, mode="indeterminate")
-        self.progress_bar.pack(fill="x", padx=5, pady=5)
-        
-        # Progress Labels
-        self.progress_status = ttk.Label(self.progress_frame, text="Ready")
-        self.progress_status.pack(anchor="w", padx=5)
-        
-        self.progress_details = ttk.Label(self.progress_frame, text="")
-        self.progress_details.pack(anchor="w", padx=5)
-        
-        self.elapsed_time = ttk.Label(self.progress_frame, text="")
-        self.elapsed_time.pack(anchor="w", padx=5)
+def save_exclusion_lists(guild_id):
+    """Schedule a guild's exclusion lists to be written to disk (batched with other changes)."""
+    exclusion_store.mark_dirty(guild_id)
 
-        # Pagination Frame
-        self.pagination_frame = ttk.Frame(self.root)
-        self.pagination_frame.pack(fill="x", padx=10, pady=5)
-        
-        self.page_info = ttk.Label(self.pagination_frame, text="No results")
-        self.page_info.pack(side="left", padx=5)
-        
-        self.prev_button = ttk.Button(self.pagination_frame, text="← Prev", command=self.prev_page, state="disabled")
-        self.prev_button.pack(side="left", padx=5)
-        
-        self.next_button = ttk.Button(self.pagination_frame, text="Next →", command=self.next_page, state="disabled")
-        self.next_button.pack(side="left", padx=5)
-        
-        # Select items per page
-        ttk.Label(self.pagination_frame, text="Items per page:").pack(side="left", padx=(20, 5))
-        self.page_size_var = tk.StringVar(value="100")
-        page_size_combo = ttk.Combobox(self.pagination_frame, textvariable=self.page_size_var, 
-                                        values=["50", "100", "500","1000"], width=5)
-        page_size_combo.pack(side="left")
-        page_size_combo.bind("<<ComboboxSelected>>", self.change_page_size)
-
-        # Selected count label (NEW)
-        self.selected_count_var = tk.StringVar(value="0 items selected")
-        self.selected_count = ttk.Label(self.pagination_frame, textvariable=self.selected_count_var)
-        self.selected_count.pack(side="right", padx=10)
-
-        # Main Frame (Holds everything else) - Now with weight for resizing
-        self.main_frame = ttk.Frame(self.root)
-        self.main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
-        self.main_frame.columnconfigure(0, weight=1)
-        self.main_frame.rowconfigure(0, weight=1)
-
-        # Canvas for Scrollable Content
-        self.canvas = tk.Canvas(self.main_frame)
-        self.v_scrollbar = ttk.Scrollbar(self.main_frame, orient="vertical", command=self.canvas.yview)
-        self.h_scrollbar = ttk.Scrollbar(self.main_frame, orient="horizontal", command=self.canvas.xview)
-        
-        self.scrollable_frame = ttk.Frame(self.canvas)
-        self.scrollable_frame.columnconfigure(0, weight=1)  # Make the scrollable frame expandable
-
-        # Create a window in the canvas for the scrollable frame
-        self.canvas_window = self.canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        self.canvas.configure(yscrollcommand=self.v_scrollbar.set, xscrollcommand=self.h_scrollbar.set)
-
-        # Configure canvas to resize with window
-        self.canvas.bind("<Configure>", self.on_canvas_configure)
-        self.scrollable_frame.bind("<Configure>", self.on_frame_configure)
-
-        # Packing UI Components with proper expansion
-        self.h_scrollbar.pack(side="bottom", fill="x")
-        self.v_scrollbar.pack(side="right", fill="y")
-        self.canvas.pack(side="left", fill="both", expand=True)
-
-        # "Select All" Checkbox
-        self.select_all_var = tk.BooleanVar()
-        self.select_all_checkbox = ttk.Checkbutton(self.root, text="Select All Visible Items", 
-                                                  variable=self.select_all_var, command=self.toggle_all)
-        self.select_all_checkbox.pack(pady=5)
-
-        # Delete Button
-        self.delete_button = ttk.Button(self.root, text="Delete Selected", command=self.delete_selected)
-        self.delete_button.pack(pady=5)
-        
-        # Add a button to show exclusions
-        self.exclusions_button = ttk.Button(self.root, text="Show Exclusion Lists", command=self.show_exclusions)
-        self.exclusions_button.pack(pady=5)
-
-        # Status Label
-        self.status_label = ttk.Label(self.root, text="", foreground="blue")
-        self.status_label.pack(pady=5)
-
-        # Store checkboxes and message data
-        self.checkboxes = []
-        self.message_vars = []
-        
-        # Track selected messages across all pages (NEW)
-        self.selected_messages = {}
-
-        # Pagination variables
-        self.current_page = 1
-        self.items_per_page = 25
-        self.all_messages = {}
-        self.total_pages = 1
-        
-        # Start progress updater
-        self.update_progress_display()
-        
-    def on_canvas_configure(self, event):
-        """Handle canvas resize event to update the scrollable area width."""
-        # Update the width of the scrollable frame window to fill the canvas
-        self.canvas.itemconfig(self.canvas_window, width=event.width)
-        
-    def on_frame_configure(self, event):
-        """Reset the scroll region to encompass the inner frame."""
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
-
-    def display_messages(self, messages, keywords):
-        """Store all messages and display the first page."""
-        if not hasattr(self, 'all_messages') or self.all_messages is None:
-            self.all_messages = {}
-            
-        # Update with new messages
-        self.all_messages.update(messages)
-        self.keywords = keywords
-        
-        # Reset selections when starting a new search
-        self.selected_messages = {}
-        
-        # Calculate total pages
-        self.total_pages = max(1, (len(self.all_messages) + self.items_per_page - 1) // self.items_per_page)
-        self.current_page = 1
-        
-        # Display the first page
-        self.display_current_page()
-        
-        # Update progress display after search completes
-        global search_in_progress, search_end_time
-        search_in_progress = False
-        search_end_time = time.time()
-        self.update_progress_ui()
-        
-    def update_matches(self, new_messages):
-        """Update the matches with new batch of messages during incremental search."""
+def resolve_channel(guild, word):
+    """Return the channel referred to by #name, <#id> or a raw channel ID, or None."""
+    if word.startswith("#"):
+        return discord.utils.get(guild.channels, name=word[1:])
+    if word.startswith("<#") and word.endswith(">"):
         try:
-            # Add new messages to all_messages
-            if not hasattr(self, 'all_messages'):
-                self.all_messages = {}
-                
-            self.all_messages.update(new_messages)
-            
-            # If this is the first batch, set keywords if not already set
-            if not hasattr(self, 'keywords'):
-                self.keywords = []
-            
-            # Calculate total pages
-            self.total_pages = max(1, (len(self.all_messages) + self.items_per_page - 1) // self.items_per_page)
-            
-            # Update pagination controls
-            self.update_pagination_controls()
-            
-            # Show loading message in UI
-            self.status_label.config(text=f"Processing {len(self.all_messages)} matches...", foreground="blue")
-            
-            # Force UI update
-            self.root.update_idletasks()
-            
-            print(f"Added batch of {len(new_messages)} messages, total now: {len(self.all_messages)}")
-        except Exception as e:
-            print(f"Error updating matches: {e}")
-
-    def display_current_page(self):
-        """Display current page of messages."""
-        # Save current selections before clearing the page
-        self.save_current_selections()
-        
-        # Clear existing widgets
-        for widget in self.scrollable_frame.winfo_children():
-            widget.destroy()
-
-        self.checkboxes.clear()
-        self.message_vars.clear()
-        
-        # Calculate start and end indices for the current page
-        start_idx = (self.current_page - 1) * self.items_per_page + 1
-        end_idx = min(start_idx + self.items_per_page - 1, len(self.all_messages))
-        
-        # Configure columns in scrollable frame for proper expansion
-        self.scrollable_frame.columnconfigure(0, weight=0)  # Checkbox column (fixed width)
-        self.scrollable_frame.columnconfigure(1, weight=0)  # Number column (fixed width)
-        self.scrollable_frame.columnconfigure(2, weight=1)  # Message content column (expandable)
-        
-        # Set the width of the scrollable frame to match the canvas
-        canvas_width = self.canvas.winfo_width()
-        if canvas_width > 1:  # Ensure canvas has been rendered
-            self.scrollable_frame.config(width=canvas_width)
-        
-        # Display only messages for current page
-        row = 0
-        for msg_id in range(start_idx, end_idx + 1):
-            if msg_id in self.all_messages:
-                msg_obj, msg_text = self.all_messages[msg_id]
-                
-                # Create checkbox variable with trace to track changes
-                var = tk.BooleanVar()
-                
-                # Set the checkbox state based on stored selections
-                if msg_obj.id in self.selected_messages:
-                    var.set(True)
-                    
-                # Add trace to update selection dictionary when checkbox changes
-                var.trace_add("write", lambda *args, m_id=msg_obj.id, v=var: self.on_checkbox_change(m_id, v))
-                
-                # Create a frame for this row that spans the full width
-                row_frame = ttk.Frame(self.scrollable_frame)
-                row_frame.grid(row=row, column=0, sticky="ew", padx=5, pady=2, columnspan=3)
-                row_frame.columnconfigure(2, weight=1)  # Make the text widget column expandable
-                
-                # Checkbox
-                chk = ttk.Checkbutton(row_frame, variable=var)
-                chk.grid(row=0, column=0, sticky="w", padx=(0,5))
-                
-                # Message number label
-                num_label = ttk.Label(row_frame, text=f"{msg_id}.")
-                num_label.grid(row=0, column=1, sticky="w", padx=(0,10))
-                
-                # Text widget for message content with better sizing
-                text_widget = tk.Text(row_frame, wrap="word", height=4, borderwidth=1, relief="solid")
-                text_widget.grid(row=0, column=2, sticky="nsew", padx=(0,5))
-                
-                # Insert message content
-                text_widget.insert("1.0", msg_text)
-                
-                # Apply highlighting to all keywords
-                for keyword in self.keywords:
-                    self.highlight_keyword(text_widget, keyword)
-                
-                # Make text widget read-only
-                text_widget.config(state="disabled")
-                
-                self.checkboxes.append(chk)
-                self.message_vars.append((var, msg_obj))
-                row += 1
-        
-        # Update page information and button states
-        self.update_pagination_controls()
-        
-        # Update selection counts
-        self.update_selection_count()
-        
-        # Force layout update to properly display the scrollable content
-        self.scrollable_frame.update_idletasks()
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
-        self.canvas.yview_moveto(0)  # Scroll to top when page changes
-        
-    def on_checkbox_change(self, message_id, var):
-        """Track checkbox changes to maintain selections across pages."""
-        if var.get():
-            # Add to selections if checked
-            for _, msg_obj in self.message_vars:
-                if msg_obj.id == message_id:
-                    self.selected_messages[message_id] = msg_obj
-                    break
-        else:
-            # Remove from selections if unchecked
-            if message_id in self.selected_messages:
-                del self.selected_messages[message_id]
-                
-        # Update selection count display
-        self.update_selection_count()
-    
-    def save_current_selections(self):
-        """Save current page selections before changing pages."""
-        for var, msg_obj in self.message_vars:
-            if var.get():
-                self.selected_messages[msg_obj.id] = msg_obj
-            elif msg_obj.id in self.selected_messages:
-                del self.selected_messages[msg_obj.id]
-    
-    def update_selection_count(self):
-        """Update the selection count display."""
-        count = len(self.selected_messages)
-        self.selected_count_var.set(f"{count} {'item' if count == 1 else 'items'} selected")
-        
-        # Update Select All checkbox state based on current page
-        all_selected = all(var.get() for var, _ in self.message_vars) if self.message_vars else False
-        self.select_all_var.set(all_selected)
-
-    def highlight_keyword(self, text_widget, keyword):
-        """Highlight all occurrences of a keyword in a text widget."""
-        # Make sure text widget is editable for highlighting
-        text_widget.config(state="normal")
-        
-        # Configure the highlight tag with both red color and underline
-        text_widget.tag_configure("highlight", foreground="red", underline=True)
-        
-        # Use a simple and reliable approach
-        start_pos = "1.0"
-        while True:
-            # Find next match position (case-insensitive)
-            pos = text_widget.search(keyword, start_pos, stopindex="end", nocase=1)
-            if not pos:
-                break
-                
-            # Calculate end position
-            end_pos = f"{pos}+{len(keyword)}c"
-            
-            # Add tag to this match
-            text_widget.tag_add("highlight", pos, end_pos)
-            
-            # Move to position after this match
-            start_pos = end_pos
-            
-        # Make text widget read-only again
-        text_widget.config(state="disabled")
-
-    def update_pagination_controls(self):
-        """Update pagination controls based on current state."""
-        # Update page info text
-        total_items = len(self.all_messages)
-        start_idx = (self.current_page - 1) * self.items_per_page + 1
-        end_idx = min(start_idx + self.items_per_page - 1, total_items)
-        
-        self.page_info.config(text=f"Showing {start_idx}-{end_idx} of {total_items} results " +
-                             f"(Page {self.current_page} of {self.total_pages})")
-        
-        # Enable/disable pagination buttons
-        self.prev_button.config(state="normal" if self.current_page > 1 else "disabled")
-        self.next_button.config(state="normal" if self.current_page < self.total_pages else "disabled")
-
-    def prev_page(self):
-        """Go to previous page."""
-        if self.current_page > 1:
-            self.current_page -= 1
-            self.display_current_page()
-
-    def next_page(self):
-        """Go to next page."""
-        if self.current_page < self.total_pages:
-            self.current_page += 1
-            self.display_current_page()
-
-    def change_page_size(self, event=None):
-        """Change number of items displayed per page."""
-        try:
-            self.items_per_page = int(self.page_size_var.get())
-            self.total_pages = max(1, (len(self.all_messages) + self.items_per_page - 1) // self.items_per_page)
-            self.current_page = 1  # Reset to first page
-            self.display_current_page()
+            return guild.get_channel(int(word.strip("<#>")))
         except ValueError:
-            pass  # Ignore invalid input
-
-    def update_progress_ui(self):
-        """Update the progress UI based on current search status"""
-        global search_in_progress, messages_scanned, current_channel, search_start_time, search_end_time
-        
-        if search_in_progress:
-            if self.progress_bar['mode'] == 'determinate':
-                self.progress_bar['mode'] = 'indeterminate'
-            
-            self.progress_bar.start(10)
-            self.progress_status.config(text="Searching...")
-            
-            # Calculate elapsed time during active search
-            elapsed = time.time() - search_start_time
-            elapsed_str = f"Time elapsed: {int(elapsed // 60)}m {int(elapsed % 60)}s"
-            self.elapsed_time.config(text=elapsed_str)
-            
-            self.progress_details.config(
-                text=f"Scanning channel: {current_channel}\nMessages scanned: {messages_scanned}\nMatches found: {matches_found}"
-            )
-        else:
-            self.progress_bar.stop()
-            self.progress_bar['mode'] = 'determinate'
-            self.progress_var.set(100) if messages_scanned > 0 else self.progress_var.set(0)
-            
-            if messages_scanned > 0:
-                # Use the final elapsed time when search is complete
-                if search_end_time > 0:
-                    elapsed = search_end_time - search_start_time
-                    elapsed_str = f"Total time: {int(elapsed // 60)}m {int(elapsed % 60)}s"
-                    self.elapsed_time.config(text=elapsed_str)
-                
-                self.progress_status.config(text="Search complete!")
-                self.progress_details.config(text=f"Scanned {messages_scanned} messages across {channels_total} channels\nFound {matches_found} matches")
-            else:
-                self.progress_status.config(text="Ready")
-                self.progress_details.config(text="")
-                self.elapsed_time.config(text="")
-
-    def update_progress_display(self):
-        """Update progress display periodically"""
-        self.update_progress_ui()
-        self.root.after(500, self.update_progress_display)  # Update every 500ms
-
-    def toggle_all(self):
-        """Check or uncheck all visible message checkboxes."""
-        new_state = self.select_all_var.get()
-        
-        # Update all checkboxes on current page
-        for var, msg_obj in self.message_vars:
-            var.set(new_state)
-            
-            # Update the global selection dictionary 
-            if new_state:
-                self.selected_messages[msg_obj.id] = msg_obj
-            elif msg_obj.id in self.selected_messages:
-                del self.selected_messages[msg_obj.id]
-                
-        # Update selection count
-        self.update_selection_count()
-
-    def delete_selected(self):
-        """Delete selected messages with feedback."""
-        selected_msgs = list(self.selected_messages.values())
-        
-        if not selected_msgs:
-            self.status_label.config(text="No messages selected.", foreground="red")
+            return None
+    # Add support for raw channel IDs
+    if word.isdigit():
+        return guild.get_channel(int(word))
+    return None
+
+class ConsoleReporter:
+    """Reports search progress and results on stdout when running headless."""
+
+    PROGRESS_INTERVAL = 5  # Seconds between progress lines of a search
+    RESULT_PREVIEW = 20  # Results printed when a search finishes
+
+    def __init__(self):
+        self.last_progress = {}  # Time of the last progress line, by session ID
+
+    def start_search(self, session):
+        print(f"Search #{session.session_id} started in {session.guild_name} by {session.owner_name}: "
+              f"{', '.join(session.keywords)} in {session.channels_total} channels")
+
+    def update_matches(self, session):
+        now = time.time()
+        if now - self.last_progress.get(session.session_id, 0) >= self.PROGRESS_INTERVAL:
+            self.last_progress[session.session_id] = now
+            print(f"Search #{session.session_id}: {session.messages_scanned} scanned, {session.matches_found} matches")
+
+    def finalize_results(self, session):
+        self.last_progress.pop(session.session_id, None)
+        if session.error:
+            print(f"Search #{session.session_id} failed: {session.error}")
             return
-
-        self.status_label.config(text=f"Deleting {len(selected_msgs)} messages...", foreground="blue")
-        self.root.update_idletasks()
-
-        # Create a new asyncio task for deletion
-        self.root.after(10, lambda: bot.loop.create_task(self.perform_deletion(selected_msgs)))
-
-    async def perform_deletion(self, to_delete):
-        """Perform async message deletion and update status."""
-        deleted_msg_ids = []
-        failed_deletions = 0
-        success_deletions = 0
-        
-        # Delete messages one by one for better reliability
-        for msg in to_delete:
-            try:
-                await msg.delete()
-                deleted_msg_ids.append(msg.id)
-                success_deletions += 1
-                # Update status after each successful deletion
-                self.status_label.config(text=f"Deleting messages... ({success_deletions}/{len(to_delete)})", foreground="blue")
-                self.root.update_idletasks()
-            except discord.Forbidden:
-                print(f"❌ No permission to delete message in #{msg.channel.name}")
-                failed_deletions += 1
-            except discord.HTTPException as e:
-                print(f"⚠️ Error deleting message: {e}")
-                failed_deletions += 1
-            except Exception as e:
-                print(f"⚠️ Unexpected error: {e}")
-                failed_deletions += 1
-        
-        # If we successfully deleted any messages, update the UI
-        if deleted_msg_ids:
-            # Remove deleted messages from all_messages
-            new_all_messages = {}
-            new_idx = 1
-            
-            for idx, (msg, text) in self.all_messages.items():
-                if msg.id not in deleted_msg_ids:
-                    new_all_messages[new_idx] = (msg, text)
-                    new_idx += 1
-            
-            # Update all_messages and redisplay
-            self.all_messages = new_all_messages
-            
-            # Remove deleted messages from selection dictionary 
-            for msg_id in deleted_msg_ids:
-                if msg_id in self.selected_messages:
-                    del self.selected_messages[msg_id]
-                    
-            # Update pagination
-            self.total_pages = max(1, (len(self.all_messages) + self.items_per_page - 1) // self.items_per_page)
-            
-            # Adjust current page if needed
-            if self.current_page > self.total_pages:
-                self.current_page = self.total_pages
-                
-            # Refresh display
-            self.display_current_page()
-        
-        # Final status update
-        if failed_deletions > 0:
-            self.status_label.config(
-                text=f"Deleted {success_deletions} messages. Failed to delete {failed_deletions} messages.", 
-                foreground="orange"
-            )
-        else:
-            self.status_label.config(
-                text=f"Successfully deleted {success_deletions} messages!", 
-                foreground="green"
-            )
-            
-    def finalize_results(self, keywords):
-        """Finalize the display of results after all batches have been processed."""
-        try:
-            # Make sure we have the keywords
-            self.keywords = keywords
-                
-            # Reset to first page
-            self.current_page = 1
-                
-            # Calculate total pages
-            self.total_pages = max(1, (len(self.all_messages) + self.items_per_page - 1) // self.items_per_page)
-                
-            # Display the first page
-            self.display_current_page()
-                
-            # Update progress display
-            global search_in_progress, search_end_time
-            search_in_progress = False
-                
-            # Update status
-            self.status_label.config(text=f"Displaying {len(self.all_messages)} matches", foreground="green")
-                
-            # Force UI update
-            self.root.update_idletasks()
-                
-            print(f"Results display finalized. {len(self.all_messages)} messages ready.")
-            
-        except Exception as e:
-            print(f"Error finalizing results: {e}")
-            self.status_label.config(text=f"Error displaying results: {e}", foreground="red")
-    
-    def show_exclusions(self):
-        """Show the current exclusion lists in a popup window."""
-        # Create a popup window
-        popup = tk.Toplevel(self.root)
-        popup.title("Keyword Exclusion Lists")
-        popup.geometry("500x400")
-        
-        # Create a frame for the content
-        frame = ttk.Frame(popup, padding=10)
-        frame.pack(fill=tk.BOTH, expand=True)
-        
-        # Get current guild ID if available
-        try:
-            guild_id = str(next(iter(bot.guilds)).id)
-            guild_exclusions = exclusion_lists.get(guild_id, {})
-            
-            if not guild_exclusions:
-                ttk.Label(frame, text="No exclusion lists set up for this server.").pack(pady=10)
-            else:
-                # Create a text widget to display the exclusions
-                text = tk.Text(frame, wrap=tk.WORD, width=60, height=20)
-                text.pack(fill=tk.BOTH, expand=True)
-                
-                # Add scrollbar
-                scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=text.yview)
-                scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-                text.config(yscrollcommand=scrollbar.set)
-                
-                # Add the exclusions to the text widget
-                for keyword, exclusions in guild_exclusions.items():
-                    if exclusions:
-                        text.insert(tk.END, f"\nKeyword: {keyword}\n")
-                        for exclude in exclusions:
-                            text.insert(tk.END, f"  - {exclude}\n")
-                            
-                # Make the text widget read-only
-                text.config(state=tk.DISABLED)
-        except Exception as e:
-            ttk.Label(frame, text=f"Error loading exclusion lists: {e}").pack(pady=10)
-        
-        # Add a close button
-        ttk.Button(popup, text="Close", command=popup.destroy).pack(pady=10)
-
-# Instantiate UI
-root = tk.Tk()
-ui = DiscordBotUI(root)
-
-def run_discord_bot():
+        print(f"Search #{session.session_id} finished: {len(session.results)} matches, "
+              f"{session.messages_scanned} messages scanned in {session.elapsed():.1f}s")
+        for record in session.results[:self.RESULT_PREVIEW]:
+            print(f"  {record.display_text()}")
+        if len(session.results) > self.RESULT_PREVIEW:
+            print(f"  ... and {len(session.results) - self.RESULT_PREVIEW} more")
+
+console = ConsoleReporter()
+
+def report(event, session, key=None):
+    """Send a search event to the window (through the event queue), or to stdout when headless."""
+    if ui is not None:
+        ui_events.post(getattr(ui, event), session, key=key)
+    else:
+        getattr(console, event)(session)
+
+async def send_result_preview(ctx, session, count=10):
+    """Post the first matches of a finished search to Discord, with links to the messages."""
+    lines = []
+    for record in session.results[:count]:
+        content = record.content if len(record.content) <= 100 else record.content[:100] + "…"
+        link = f"https://discord.com/channels/{session.guild_id}/{record.channel_id}/{record.id}"
+        lines.append(f"[#{record.channel_name}] {record.author_name}: {content} <{link}>")
+    if len(session.results) > count:
+        lines.append(f"… and {len(session.results) - count} more")
+    
+    # Send in chunks to avoid Discord message limits
+    chunk = ""
+    for line in lines:
+        if len(chunk) + len(line) + 1 > 1900:
+            await ctx.send(chunk)
+            chunk = ""
+        chunk += line + "\n"
+    if chunk:
+        await ctx.send(chunk)
+
+def run_discord_bot(token):
     """Runs the Discord bot safely in a separate thread."""
     asyncio.set_event_loop(asyncio.new_event_loop())
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(bot.start(TOKEN))
+    loop.run_until_complete(bot.start(token))
 
 @bot.event
 async def on_ready():
     """Event handler for when the bot is ready."""
     print(f"✅ Logged in as {bot.user}")
-    load_exclusion_lists()  # Load exclusion lists when bot starts
+    # Exclusion lists are loaded once in main(); on_ready fires again on every
+    # reconnect and must not replace edits made since
 
 @bot.command()
 async def addexclude(ctx, keyword, *exclude_words):
@@ -688,7 +212,8 @@ async def addexclude(ctx, keyword, *exclude_words):
     
     # Save changes
     if added_words:
-        save_exclusion_lists()
+        exclusion_cache.invalidate(guild_id, keyword)
+        save_exclusion_lists(guild_id)
         
         # Format the response message
         if len(added_words) == 1:
@@ -731,13 +256,15 @@ async def removeexclude(ctx, keyword, exclude_word=None):
         exclude_word = exclude_word.lower().strip()
         if exclude_word in exclusion_lists[guild_id][keyword]:
             exclusion_lists[guild_id][keyword].remove(exclude_word)
-            save_exclusion_lists()
+            exclusion_cache.invalidate(guild_id, keyword)
+            save_exclusion_lists(guild_id)
             await ctx.send(f"Removed `{exclude_word}` from exclusion list for keyword `{keyword}`")
         else:
             await ctx.send(f"`{exclude_word}` is not in the exclusion list for keyword `{keyword}`")
     else:
         del exclusion_lists[guild_id][keyword]
-        save_exclusion_lists()
+        exclusion_cache.invalidate(guild_id, keyword)
+        save_exclusion_lists(guild_id)
         await ctx.send(f"Removed all exclusions for keyword `{keyword}`")
 
 @bot.command()
@@ -816,7 +343,8 @@ async def bulkexclude(ctx, *, content):
     
     # Save changes
     if added_count > 0:
-        save_exclusion_lists()
+        exclusion_cache.invalidate(guild_id, keyword)
+        save_exclusion_lists(guild_id)
         await ctx.send(f"✅ Added {added_count} words to the exclusion list for keyword `{keyword}`")
         
     if already_count > 0:
@@ -829,31 +357,89 @@ async def bulkexclude(ctx, *, content):
 @bot.command()
 async def find(ctx, *args):
     """Find messages containing any of the given keywords in the specified channels."""
-    global found_messages, search_in_progress, messages_scanned, matches_found, channels_total, current_channel, search_start_time, search_end_time, max_results
-    
-    # Reset search state
-    found_messages.clear()
-    search_in_progress = True
-    messages_scanned = 0
-    matches_found = 0
-    current_channel = ""
-    search_start_time = time.time()
-    search_end_time = 0
+    # Limits apply to this search only
+    max_results = DEFAULT_MAX_RESULTS
+    scan_concurrency = DEFAULT_SCAN_CONCURRENCY
+    channel_cursors = DEFAULT_CHANNEL_CURSORS
+    priority = "normal"
+    normalize = DEFAULT_NORMALIZE
+    export = None
 
     # Check for limit parameter
     limit_param = next((arg for arg in args if arg.startswith("limit=")), None)
     if limit_param:
         try:
             requested_limit = int(limit_param.split("=")[1])
-            max_results = min(requested_limit, 100000)
+            # limit=0 removes the limit; results that don't fit in memory spill to disk
+            max_results = requested_limit if requested_limit > 0 else None
             args = tuple(arg for arg in args if not arg.startswith("limit="))
-            await ctx.send(f"Search limit set to {max_results} matches.")
+            await ctx.send(f"Search limit set to {max_results or 'unlimited'} matches.")
         except (ValueError, IndexError):
             pass
 
+    # Check for concurrency parameter (number of channels scanned at once)
+    concurrency_param = next((arg for arg in args if arg.startswith("concurrency=")), None)
+    if concurrency_param:
+        try:
+            requested_concurrency = int(concurrency_param.split("=")[1])
+            scan_concurrency = max(1, min(requested_concurrency, MAX_SCAN_CONCURRENCY))
+            args = tuple(arg for arg in args if not arg.startswith("concurrency="))
+        except (ValueError, IndexError):
+            pass
+
+    # Check for cursors parameter (time ranges of one big channel fetched at once; 1 reads it front to back)
+    cursors_param = next((arg for arg in args if arg.startswith("cursors=")), None)
+    if cursors_param:
+        try:
+            requested_cursors = int(cursors_param.split("=")[1])
+            channel_cursors = max(1, min(requested_cursors, MAX_CHANNEL_CURSORS))
+            args = tuple(arg for arg in args if not arg.startswith("cursors="))
+        except (ValueError, IndexError):
+            pass
+
+    # Check for priority parameter (order among this server's jobs)
+    priority_param = next((arg for arg in args if arg.startswith("priority=")), None)
+    if priority_param:
+        requested_priority = priority_param.split("=", 1)[1].lower()
+        if requested_priority not in PRIORITIES:
+            await ctx.send(f"Unknown priority `{requested_priority}`. Use one of: {', '.join(PRIORITIES)}.")
+            return
+        priority = requested_priority
+        args = tuple(arg for arg in args if not arg.startswith("priority="))
+
+    # Check for normalize parameter (match through lookalikes, accents and invisible characters)
+    normalize_param = next((arg for arg in args if arg.startswith("normalize=")), None)
+    if normalize_param:
+        requested_normalize = normalize_param.split("=", 1)[1].lower()
+        if requested_normalize not in ("on", "off"):
+            await ctx.send("Use `normalize=on` or `normalize=off`.")
+            return
+        normalize = requested_normalize == "on"
+        args = tuple(arg for arg in args if not arg.startswith("normalize="))
+
+    # Check for export parameter (stream every match to a file in EXPORT_DIR as it is found)
+    export_param = next((arg for arg in args if arg.startswith("export=")), None)
+    if export_param:
+        export = export_param.split("=", 1)[1].lower()
+        try:
+            parse_export(export)
+        except ValueError as e:
+            await ctx.send(f"⚠️ {e}")
+            return
+        args = tuple(arg for arg in args if not arg.startswith("export="))
+
+    # Split off the filters (after:, before:, author:, has:)
+    try:
+        filters, args = parse_filters(ctx.guild, args)
+    except ValueError as e:
+        await ctx.send(f"⚠️ {e}")
+        return
+
     if len(args) < 2:
-        await ctx.send("Usage: `!find keyword1 keyword2 ... #channel1 #channel2` (optional: limit=50000)")
-        search_in_progress = False
+        await ctx.send("Usage: `!find keyword1 keyword2 ... #channel1 #channel2` "
+                       "(optional: limit=50000 concurrency=4 cursors=4 priority=high|normal|low normalize=on "
+                       "export=jsonl|csv|jsonl.gz|csv.gz "
+                       "after:2024-01-31 before:7d author:@user has:link|file|image|video|embed|sticker|mention)")
         return
 
     # Extract keywords (ignore anything that starts with '#' or '<#')
@@ -862,125 +448,408 @@ async def find(ctx, *args):
     # Extract channels correctly
     channels = []
     for word in args:
-        if word.startswith("#"):
-            channel = discord.utils.get(ctx.guild.channels, name=word[1:])
-        elif word.startswith("<#") and word.endswith(">"):
-            try:
-                channel_id = int(word.strip("<#>"))
-                channel = ctx.guild.get_channel(channel_id)
-            except ValueError:
-                continue
-        # Add support for raw channel IDs
-        elif word.isdigit():
-            try:
-                channel_id = int(word)
-                channel = ctx.guild.get_channel(channel_id)
-            except ValueError:
-                continue
-        else:
-            continue
-        
+        channel = resolve_channel(ctx.guild, word)
         if channel:
             channels.append(channel)
 
+    # Scanning the same channel twice would only duplicate its matches
+    channels = list(dict.fromkeys(channels))
+
     if not channels:
         await ctx.send("No valid channels specified. Please use `#channel-name`, `<#channel-id>` or raw channel ID.")
-        search_in_progress = False
-        search_end_time = time.time()
         return
 
+    # Each user runs one search per server at a time; its checkpoint would replace the running one's
+    if active_search_job(ctx):
+        await ctx.send("⚠️ You already have a search running in this server. Wait for it to finish first.")
+        return
+
+    submit_search(ctx, keywords, channels, max_results, scan_concurrency, priority,
+                  normalize=normalize, filters=filters, channel_cursors=channel_cursors, export=export)
+
+def active_search_job(ctx):
+    """Return the invoking user's unfinished search job in this server, or None."""
+    return next((job for job in scheduler.jobs(ctx.guild.id)
+                 if job.kind == "search" and job.owner_id == ctx.author.id and not job.finished), None)
+
+def submit_search(ctx, keywords, channels, max_results, scan_concurrency, priority, checkpoint=None,
+                  normalize=DEFAULT_NORMALIZE, filters=None, channel_cursors=DEFAULT_CHANNEL_CURSORS, export=None):
+    """Start a search as a background job."""
+    description = f"`{', '.join(keywords)}` in {len(channels)} channels"
+    return scheduler.submit(
+        "search", ctx.guild.id, description,
+        lambda job: run_search(ctx, job, keywords, channels, max_results, scan_concurrency, checkpoint,
+                               normalize, filters, channel_cursors, export),
+        priority, ctx.author.id, str(ctx.author),
+    )
+
+def can_control_job(ctx, job):
+    """Jobs can be controlled from their own server by whoever started them or by moderators."""
+    if job is None or job.guild_id != ctx.guild.id:
+        return False
+    return job.owner_id == ctx.author.id or ctx.author.guild_permissions.manage_messages
+
+@bot.command()
+async def resume(ctx, job_id: int = None):
+    """Resume a paused job, or continue your interrupted search in this server from its last checkpoints."""
+    if job_id is not None:
+        job = scheduler.get(job_id)
+        if not can_control_job(ctx, job):
+            await ctx.send(f"There is no job #{job_id} you can resume in this server.")
+        elif job.state != "paused":
+            await ctx.send(f"Job #{job_id} is not paused ({job.state}).")
+        else:
+            job.unpause()
+            await ctx.send(f"▶️ Job #{job_id} resumed.")
+        return
+    
+    if active_search_job(ctx):
+        await ctx.send("⚠️ You already have a search running in this server.")
+        return
+    
+    checkpoint = await asyncio.to_thread(message_index.load_search, ctx.guild.id, ctx.author.id)
+    if not checkpoint:
+        await ctx.send("You have no interrupted search to resume in this server.")
+        return
+    
+    params = checkpoint["params"]
+    channels = [channel for channel in (ctx.guild.get_channel(channel_id) for channel_id in params["channel_ids"]) if channel]
+    if not channels:
+        await ctx.send("None of the channels from the interrupted search exist anymore.")
+        await asyncio.to_thread(message_index.finish_search, checkpoint["search_id"])
+        return
+    
+    done_channels = sum(1 for state in checkpoint["channels"].values() if state["done"])
+    await ctx.send(f"⏯️ Resuming search for `{', '.join(params['keywords'])}` "
+                   f"({done_channels} of {len(channels)} channels already finished).")
+    
+    submit_search(ctx, params["keywords"], channels, params["max_results"], params["concurrency"],
+                  params.get("priority", "normal"), checkpoint, params.get("normalize", False),
+                  SearchFilters.from_params(params.get("filters")),
+                  params.get("cursors", DEFAULT_CHANNEL_CURSORS), params.get("export"))
+
+@bot.command()
+async def jobs(ctx):
+    """List this server's background jobs."""
+    guild_jobs = scheduler.jobs(ctx.guild.id)
+    if not guild_jobs:
+        await ctx.send("No jobs in this server.")
+        return
+    
+    lines = [job.summary() for job in guild_jobs]
+    waiting = scheduler.permits.waiting().get(ctx.guild.id, 0)
+    if waiting:
+        lines.append(f"{waiting} requests waiting for their turn at the Discord API")
+    
+    # Send in chunks to avoid Discord message limits
+    chunk = ""
+    for line in lines:
+        if len(chunk) + len(line) + 1 > 1900:
+            await ctx.send(chunk)
+            chunk = ""
+        chunk += line + "\n"
+    if chunk:
+        await ctx.send(chunk)
+
+@bot.command()
+async def pause(ctx, job_id: int):
+    """Pause a running job at its next Discord API request."""
+    job = scheduler.get(job_id)
+    if not can_control_job(ctx, job):
+        await ctx.send(f"There is no job #{job_id} you can pause in this server.")
+    elif job.finished or job.state == "paused":
+        await ctx.send(f"Job #{job_id} is already {job.state}.")
+    else:
+        job.pause()
+        await ctx.send(f"⏸️ Job #{job_id} paused. Use `!resume {job_id}` to continue it.")
+
+@bot.command()
+async def cancel(ctx, job_id: int):
+    """Stop a job. A cancelled search keeps its checkpoints, so `!resume` can still continue it."""
+    job = scheduler.get(job_id)
+    if not can_control_job(ctx, job) or not scheduler.cancel(job_id):
+        await ctx.send(f"There is no running job #{job_id} you can cancel in this server.")
+        return
+    await ctx.send(f"⏹️ Job #{job_id} cancelled.")
+
+@bot.command()
+async def stats(ctx):
+    """Show scan rates, Discord API latency, rate limits, deletions and redraw times since the bot started."""
+    chunk = "📊 **ChatScrub stats**\n"
+    for line in metrics.stats_lines(ctx.guild.id):
+        if len(chunk) + len(line) + 1 > 1900:
+            await ctx.send(chunk)
+            chunk = ""
+        chunk += line + "\n"
+    await ctx.send(chunk)
+
+@bot.command(name="export")
+async def export_session(ctx, *args):
+    """Write the results of a finished search in this server to a JSONL or CSV file (optionally gzipped).
+
+    Takes a search number (default: your latest finished search here) and a
+    format: jsonl (default), csv, jsonl.gz or csv.gz.
+    """
+    session_id = next((int(arg.lstrip("#")) for arg in args if arg.lstrip("#").isdigit()), None)
+    formats = [arg for arg in args if not arg.lstrip("#").isdigit()]
+    try:
+        export_format, compress = parse_export(formats[0] if formats else "jsonl")
+    except ValueError as e:
+        await ctx.send(f"⚠️ {e}")
+        return
+    
+    # Sessions from this server that the user started, or any of them for moderators
+    candidates = [
+        session for session in sessions.all()
+        if session.guild_id == ctx.guild.id and not session.in_progress
+        and (session.owner_id == ctx.author.id or ctx.author.guild_permissions.manage_messages)
+    ]
+    if session_id is not None:
+        candidates = [session for session in candidates if session.session_id == session_id]
+    else:
+        candidates = [session for session in candidates if session.owner_id == ctx.author.id]
+    if not candidates:
+        await ctx.send(f"There is no finished search{f' #{session_id}' if session_id else ''} "
+                       "you can export in this server.")
+        return
+    
+    session = candidates[-1]
+    path = export_path(EXPORT_DIR, ctx.guild.id, session.session_id, export_format, compress)
+    # The window may drop deleted results from the session's view meanwhile; the worker thread reads a copy
+    results = session.results.snapshot()
+    try:
+        count = await asyncio.to_thread(export_results, results, path, export_format, compress, ctx.guild.id,
+                                        session.keyword_names)
+    except OSError as e:
+        await ctx.send(f"⚠️ Can't write the export file `{path}`: {e}")
+        return
+    await ctx.send(f"📄 Exported {count} matches of search #{session.session_id} to `{path}`.")
+
+async def run_search(ctx, job, keywords, channels, max_results=DEFAULT_MAX_RESULTS,
+                     scan_concurrency=DEFAULT_SCAN_CONCURRENCY, checkpoint=None, normalize=DEFAULT_NORMALIZE,
+                     filters=None, channel_cursors=DEFAULT_CHANNEL_CURSORS, export=None):
+    """Scan the channels for the keywords and show the matches in the UI.
+    
+    Counters, results and limits live in a new search session, so searches in
+    other servers (or by other users) run alongside this one. Progress is
+    checkpointed per channel while scanning. When a checkpoint from an
+    interrupted search is given, each channel continues after its last
+    checkpointed message instead of starting from the oldest one.
+    
+    Runs as a scheduler job: Discord requests wait for the job's turn at the
+    API, and pausing or cancelling the job stops the scan at the next one.
+    Each channel is scanned by a ChannelScan (see channel_scan.py).
+    
+    With normalize, keywords, exclusion words and messages are Unicode
+    normalized (see normalize.py) before matching instead of just lowercased.
+    
+    filters (a SearchFilters) limit the search to a date range, authors and
+    messages with certain contents. The date range limits what is fetched
+    and read from the index; the other filters are applied before matching.
+    
+    A channel with a long history is split into time ranges (see
+    scan_planner.py) that up to channel_cursors cursors fetch at the same
+    time. Each range's matches are kept apart and put back in order when the
+    channel is done; the high-water mark and the checkpoint only advance over
+    ranges that are complete from the oldest one on.
+    
+    With export (jsonl, csv, jsonl.gz or csv.gz), every match is also
+    streamed to a new file in EXPORT_DIR as it is found (see export.py). A
+    resumed search writes a new file, starting with the checkpointed matches.
+    """
+    filters = filters or SearchFilters()
+    session = sessions.create(ctx.guild, ctx.author, keywords, channels, max_results, scan_concurrency)
+
     # Get the guild's exclusion lists
     guild_id = str(ctx.guild.id)
     guild_exclusions = exclusion_lists.get(guild_id, {})
     
-    channels_total = len(channels)
-    msg_index = 1
-    batch_size = 500  # Process in smaller batches for better UI responsiveness
-    current_batch = {}
+    # Compile all keywords into a single matcher for this search, and fetch
+    # the cached exclusion filters for those keywords
+    if normalize:
+        matcher = KeywordMatcher([normalize_text(keyword) for keyword in keywords])
+        exclusion_filters = exclusion_cache.filters_for(guild_id, keywords, guild_exclusions, normalize_text)
+        # Matched keywords are normalized forms; records name them by the search term they came from
+        terms = {}
+        for keyword in keywords:
+            terms.setdefault(normalize_text(keyword), keyword)
+        session.keyword_names = [terms[keyword] for keyword in matcher.keywords]
+    else:
+        matcher = KeywordMatcher(keywords)
+        exclusion_filters = exclusion_cache.filters_for(guild_id, keywords, guild_exclusions)
+        session.keyword_names = list(matcher.keywords)
+    # The match workers lowercase or normalize the texts, off the event loop
+    match_spec = MatchSpec(matcher, exclusion_filters, normalize)
+
+    # The export file is opened before anything is scanned, so a search that can't write it doesn't start
+    exporter = None
+    if export:
+        export_format, compress = parse_export(export)
+        path = export_path(EXPORT_DIR, ctx.guild.id, session.session_id, export_format, compress)
+        try:
+            exporter = await asyncio.to_thread(MatchExporter, path, export_format, compress, ctx.guild.id,
+                                               session.keyword_names)
+        except OSError as e:
+            session.finish(error=f"Can't write the export file `{path}`: {e}")
+            report("start_search", session)
+            report("finalize_results", session)
+            await ctx.send(f"⚠️ {session.error}")
+            return
+    try:
+        await scan_channels(ctx, job, session, channels, match_spec, filters, checkpoint, channel_cursors,
+                            exporter, export)
+    except BaseException:
+        # The checkpoints stay in the index so the search can be resumed
+        if session.in_progress:
+            session.finish()
+            report("finalize_results", session)
+        raise
+    finally:
+        # The export keeps the matches found so far, also when the search stops midway
+        if exporter is not None:
+            try:
+                await exporter.close_async()
+            except OSError as e:
+                await ctx.send(f"⚠️ Can't finish the export file `{exporter.path}`: {e}")
+
+async def scan_channels(ctx, job, session, channels, match_spec, filters, checkpoint, channel_cursors,
+                        exporter, export):
+    """Scan the channels of a started search session and finish it (see run_search)."""
+    session.start()
+    job.progress = lambda: f"{session.messages_scanned} scanned, {session.matches_found} matches"
+    
+    # Register the search so it can be resumed if the bot stops midway
+    if checkpoint:
+        search_id = checkpoint["search_id"]
+        channel_checkpoints = checkpoint["channels"]
+    else:
+        params = {
+            "keywords": session.keywords,
+            "channel_ids": [channel.id for channel in channels],
+            "max_results": session.max_results,
+            "concurrency": session.concurrency,
+            "cursors": channel_cursors,
+            "priority": job.priority,
+            "normalize": match_spec.normalize,
+            "filters": filters.to_params(),
+            "export": export,
+        }
+        search_id = await asyncio.to_thread(message_index.create_search, ctx.guild.id, ctx.author.id, params)
+        channel_checkpoints = {}
+    session.search_id = search_id
     
     # Reset UI state
-    root.after(0, lambda: setattr(ui, 'all_messages', {}))
-    root.after(0, lambda: setattr(ui, 'keywords', keywords))
-    root.after(0, lambda: ui.status_label.config(text="Starting search...", foreground="blue"))
-
-    await ctx.send(f"Searching for: `{', '.join(keywords)}` in {len(channels)} channels. Max results: {max_results}")
-
-    for channel in channels:
-        current_channel = channel.name
-        print(f"Searching in #{channel.name}...")
-        
-        try:
-            async for message in channel.history(limit=None, oldest_first=True):
-                messages_scanned += 1
-                
-                if messages_scanned % 100 == 0:
-                    print(f"Scanned {messages_scanned} messages...")
-                
-                if matches_found >= max_results:
-                    await ctx.send(f"⚠️ Reached limit of {max_results} matches. Try a more specific search.")
-                    break
-                
-                message_content = message.content.lower()
-                
-                # Check for matches with exclusion filtering (FIXED LOGIC HERE)
-                found_match = False
-                matched_keyword = None
-
-                for keyword in keywords:
-                    if keyword in message_content:
-                        matched_keyword = keyword
-                        found_match = True
-                        break
-
-                # If we found a match, check if it should be excluded
-                if found_match and matched_keyword in guild_exclusions:
-                    for exclude_word in guild_exclusions[matched_keyword]:
-                        if exclude_word in message_content:
-                            found_match = False
-                            break
-
-                if found_match:
-                    matches_found += 1
-                    msg_text = f"[{channel.name}] {message.author}: {message.content} ({message.created_at.strftime('%Y-%m-%d %H:%M:%S')})"
-                    found_messages[msg_index] = (message, msg_text)
-                    current_batch[msg_index] = (message, msg_text)
-                    
-                    # Process in smaller batches to keep UI responsive
-                    if len(current_batch) >= batch_size:
-                        batch_copy = current_batch.copy()
-                        root.after(0, lambda b=batch_copy: ui.update_matches(b))
-                        current_batch.clear()
-                        # Add small delay to allow UI to process
-                        await asyncio.sleep(0.1)
-                    
-                    msg_index += 1
-
-        except discord.Forbidden:
-            print(f"No permission to read messages in #{channel.name}")
-            await ctx.send(f"⚠️ No permission to read messages in #{channel.name}")
-        except Exception as e:
-            print(f"Error searching channel {channel.name}: {e}")
-            await ctx.send(f"⚠️ Error searching #{channel.name}: {e}")
-
-    # Process any remaining matches in the final batch
-    if current_batch:
-        final_batch = current_batch.copy()
-        root.after(0, lambda: ui.update_matches(final_batch))
-    
-    search_end_time = time.time()
+    report("start_search", session)
+
+    await ctx.send(f"Searching for: `{', '.join(session.keywords)}` in {len(channels)} channels "
+                   f"({session.concurrency} at a time). Max results: {session.max_results or 'unlimited'}"
+                   + (f". Only messages {filters.describe()}." if filters else "")
+                   + (". Unicode normalization on." if match_spec.normalize else "")
+                   + (f". Exporting matches to `{exporter.path}`." if exporter else ""))
+
+    # The channels' scans (see channel_scan.py) share the session, the matching and the export
+    scan = SearchScan(ctx, job, session, match_spec, filters, message_index, match_pool, scheduler, report,
+                      search_id, channel_checkpoints, channel_cursors, exporter)
+
+    # Scan all channels concurrently, at most scan_concurrency at a time
+    await asyncio.gather(*(scan.scan_channel(channel) for channel in channels))
+    
+    # Channels that failed midway (e.g. after a disconnect) keep their checkpoints;
+    # otherwise the search is finished and there is nothing left to resume
+    failed_channels = [channel for channel in channels if session.channel_progress[channel.id]["status"] == "error"]
+    if failed_channels:
+        await ctx.send(f"⚠️ {len(failed_channels)} channels could not be finished. "
+                       "Use `!resume` to continue them from their last checkpoint.")
+    else:
+        await asyncio.to_thread(message_index.finish_search, search_id)
+    
+    # Merge the per-channel results into one ordered result set: channels in
+    # the order they were given, messages oldest first within each channel.
+    # Only store positions are reordered; the records stay where they are
+    session.finish(ResultView(session.store, scan.order(channels)))
     
     # Signal that search is complete and display results
-    await ctx.send(f"✅ Search complete! Found {matches_found} messages matching your keywords.")
+    await ctx.send(f"✅ Search complete! Found {session.matches_found} messages matching your keywords."
+                   + (f" Exported to `{exporter.path}`." if exporter else ""))
+    if ui is None and session.matches_found:
+        # Without the window, Discord is where the results are seen
+        await send_result_preview(ctx, session)
+    
+    # Final UI update to show all results in merged order; the queue applies
+    # it after every batch posted before it
+    report("finalize_results", session)
+
+def run_archive_search(paths, keywords, guild_id=None, workers=ARCHIVE_WORKERS):
+    """Search exported messages on disk for the keywords, with the same exclusions as !find.
+    
+    Each export file is shown as one channel of the search session. Messages
+    are checked against the exclusion lists of the guild they were exported
+    from, or of guild_id when the export doesn't say. Blocks until the search
+    is done, so the window runs it in a thread of its own.
+    """
+    keywords = [keyword.lower() for keyword in keywords]
+    files = find_archive_files(paths)
+    if not files:
+        print("No export files found to search.")
+        return None
+    
+    channels = [ArchiveSource(index, os.path.basename(path)) for index, path in enumerate(files)]
+    session = sessions.create(ArchiveSource(guild_id or 0, "Archives"), ArchiveSource(0, "local"), keywords, channels)
+    # The channel IDs are file numbers, so deleting would send requests for messages that aren't there
+    session.read_only = True
+    session.start()
+    report("start_search", session)
+    
+    # Only the exclusions of the searched keywords are sent to the worker processes
+    exclusions = {
+        guild: {keyword: list(guild_lists[keyword]) for keyword in keywords if guild_lists.get(keyword)}
+        for guild, guild_lists in list(exclusion_lists.items())
+    }
     
     try:
-        # Give UI time to process all batches, then display first page
-        await asyncio.sleep(0.5)
-        
-        # Final UI update to show all results
-        root.after(0, lambda: ui.finalize_results(keywords))
+        # Chunks come back in file order, so the store is already in result order
+        for file_index, scanned, rows, file_done in search_archives(files, keywords, exclusions, guild_id, workers):
+            progress = session.channel_progress[file_index]
+            progress["status"] = "done" if file_done else "scanning"
+            progress["scanned"] += scanned
+            progress["matches"] += len(rows)
+            session.messages_scanned += scanned
+            metrics.messages_scanned.inc(scanned, source="archive")
+            metrics.matches_found.inc(len(rows), source="archive")
+            for row in rows:
+                session.store.append(MatchRecord(*row))
+            session.matches_found += len(rows)
+            if rows:
+                report("update_matches", session, key=("matches", session.session_id))
     except Exception as e:
-        print(f"Error finalizing search results: {e}")
-        await ctx.send(f"⚠️ Error displaying results: {e}")
+        print(f"Error searching archives: {e}")
+    finally:
+        session.finish()
+        report("finalize_results", session)
+    return session
+
+@bot.command()
+async def clearindex(ctx, *args):
+    """Forget the locally stored history of the given channels (or all channels in this server).
+    
+    The next search fetches their full history from Discord again, which also
+    picks up messages that were edited since they were stored.
+    
+    Usage: !clearindex [#channel1 #channel2 ...]
+    """
+    if not args:
+        channels = list(ctx.guild.channels)
+    else:
+        channels = [channel for channel in (resolve_channel(ctx.guild, word) for word in args) if channel]
+        if not channels:
+            await ctx.send("No valid channels specified. Please use `#channel-name`, `<#channel-id>` or raw channel ID.")
+            return
+    
+    await asyncio.to_thread(message_index.clear_channels, [channel.id for channel in channels])
+    if args:
+        await ctx.send(f"🗑️ Cleared the local message index for {', '.join(f'#{channel.name}' for channel in channels)}.")
+    else:
+        await ctx.send("🗑️ Cleared the local message index for all channels in this server.")
 
 @bot.command()
 async def testkeyword(ctx, keyword, *, sample_text):
@@ -991,23 +860,21 @@ async def testkeyword(ctx, keyword, *, sample_text):
     # Get the guild's exclusion list for this keyword
     guild_id = str(ctx.guild.id)
     exclusions = exclusion_lists.get(guild_id, {}).get(keyword, [])
+    exclusion_filter = exclusion_cache.get(guild_id, keyword, exclusions)
     
     # First check basic match
     if keyword in sample_text:
         # Then check for exclusions
-        should_exclude = False
-        excluding_word = None
-        
-        for exclude_word in exclusions:
-            if exclude_word in sample_text:
-                should_exclude = True
-                excluding_word = exclude_word
-                break
+        excluding_word = exclusion_filter.first_match(sample_text)
                 
-        if should_exclude:
+        if excluding_word:
             await ctx.send(f"❌ Keyword `{keyword}` matched but was excluded by `{excluding_word}`")
         else:
             await ctx.send(f"✅ Keyword `{keyword}` MATCHES in the sample text.")
+    elif normalize_text(keyword) in normalize_text(sample_text):
+        # Lookalike letters, accents or invisible characters in the way
+        await ctx.send(f"🔤 Keyword `{keyword}` only matches after Unicode normalization. "
+                       "Search with `normalize=on` to find messages like this.")
     else:
         await ctx.send(f"❌ Keyword `{keyword}` does NOT match in the sample text.")
     
@@ -1031,8 +898,71 @@ async def testkeyword(ctx, keyword, *, sample_text):
     if exclusions:
         await ctx.send(f"Exclusions for keyword `{keyword}`: " + ", ".join([f"`{word}`" for word in exclusions]))
 
-# Run Discord bot in a separate thread
-threading.Thread(target=run_discord_bot, daemon=True).start()
-
-# Start Tkinter main loop
-root.mainloop()
+def main(argv=None):
+    """Start the bot, with the Tkinter window unless --headless is given."""
+    global message_index, ui
+    
+    parser = argparse.ArgumentParser(description="ChatScrub Discord message search and cleanup bot")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without the Tkinter window; progress and results go to Discord and stdout")
+    parser.add_argument("--archive", nargs="+", metavar="PATH",
+                        help="search exported messages (.json/.jsonl files or directories) offline instead of starting the bot")
+    parser.add_argument("--keywords", nargs="+", help="keywords to search the archives for")
+    parser.add_argument("--guild", type=int, help="guild ID whose exclusion lists apply to exports that don't name their guild")
+    parser.add_argument("--workers", type=int, default=ARCHIVE_WORKERS,
+                        help="processes searching the archives (default: one per CPU core)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="serve Prometheus metrics at http://127.0.0.1:PORT/metrics")
+    args = parser.parse_args(argv)
+    
+    if args.archive:
+        if not args.keywords:
+            parser.error("--archive needs --keywords")
+        # Offline search: no token, bot or window needed; results go to stdout
+        load_exclusion_lists()
+        session = run_archive_search(args.archive, args.keywords, args.guild, args.workers)
+        return 0 if session is not None else 1
+    
+    # Load bot token from .env file
+    load_dotenv()
+    token = os.getenv("DISCORD_BOT_TOKEN")
+    if not token:
+        print("DISCORD_BOT_TOKEN is not set. Add it to a .env file or the environment.")
+        return 1
+    
+    message_index = MessageIndex(MESSAGE_INDEX_FILE)
+    load_exclusion_lists()
+    metrics.watch_rate_limits()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+        print(f"Serving metrics at http://127.0.0.1:{args.metrics_port}/metrics")
+    
+    if args.headless:
+        try:
+            bot.run(token)
+        finally:
+            exclusion_store.flush()  # Write changes still waiting for their batch
+            match_pool.shutdown()
+        return 0
+    
+    # Tkinter is only loaded when the window is wanted
+    import tkinter as tk
+    from gui import DiscordBotUI
+    
+    # Instantiate UI
+    root = tk.Tk()
+    ui = DiscordBotUI(root, sys.modules[__name__])
+    
+    # Run Discord bot in a separate thread
+    threading.Thread(target=run_discord_bot, args=(token,), daemon=True).start()
+    
+    # Start Tkinter main loop
+    try:
+        root.mainloop()
+    finally:
+        exclusion_store.flush()  # Write changes still waiting for their batch
+        match_pool.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
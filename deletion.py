@@ -0,0 +1,169 @@
+"""Message deletion engine used by the results view.
+
+Messages are grouped by channel. Messages younger than 14 days are removed with
+the channel bulk-delete endpoint, 100 at a time; older messages can only be
+deleted one by one, so those run with bounded concurrency.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+import discord
+
+import metrics
+
+# Discord rejects bulk deletes of messages older than 14 days; keep a margin
+# so messages don't age past the limit while the deletion is running
+BULK_DELETE_MAX_AGE = timedelta(days=14) - timedelta(hours=1)
+BULK_DELETE_CHUNK_SIZE = 100
+DEFAULT_DELETE_CONCURRENCY = 4  # Individual deletes running at the same time
+# Discord's error code for a 404 that means the message itself is gone; other
+# 404s (unknown channel, a wrong ID) mean it was never reached
+UNKNOWN_MESSAGE = 10008
+
+
+def bulk_delete_cutoff(now=None):
+    """Return the snowflake ID below which messages are too old for bulk deletion."""
+    now = now or datetime.now(timezone.utc)
+    return discord.utils.time_snowflake(now - BULK_DELETE_MAX_AGE)
+
+
+@asynccontextmanager
+async def _no_permit():
+    yield
+
+
+async def delete_messages(messages, progress_callback=None, concurrency=DEFAULT_DELETE_CONCURRENCY, permit=None,
+                          deleted_ids=None):
+    """Delete messages channel by channel and return (deleted_ids, channel_progress).
+
+    channel_progress maps channel IDs to {"name", "total", "deleted", "failed",
+    "status"}. progress_callback, if given, is called with it after every step
+    and once more at the end. permit, if given, returns an async context
+    manager that is held around every API request (e.g. the job scheduler's
+    permit). Messages that were already gone (Unknown Message) count as
+    deleted; any other 404 is a failure. deleted_ids, if given, is the list
+    the IDs of deleted messages are appended to.
+
+    If the deletion is cancelled midway, the unfinished channels get the
+    status "cancelled", progress_callback sees that last state and the
+    CancelledError propagates; the caller finds the messages deleted so far
+    in its deleted_ids list.
+    """
+    permit = permit or _no_permit
+    channels = {}
+    for message in messages:
+        channels.setdefault(message.channel.id, (message.channel, []))[1].append(message)
+
+    channel_progress = {
+        channel_id: {"name": getattr(channel, "name", str(channel_id)), "total": len(channel_messages),
+                     "deleted": 0, "failed": 0, "status": "queued"}
+        for channel_id, (channel, channel_messages) in channels.items()
+    }
+    deleted_ids = [] if deleted_ids is None else deleted_ids
+    cutoff = bulk_delete_cutoff()
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.monotonic()
+    counted = {"deleted": 0, "failed": 0}  # Outcomes already added to the metrics
+
+    def count_outcomes():
+        for result in counted:
+            total = sum(progress[result] for progress in channel_progress.values())
+            metrics.messages_deleted.inc(total - counted[result], result=result)
+            counted[result] = total
+
+    def report():
+        count_outcomes()
+        if progress_callback:
+            progress_callback(channel_progress)
+
+    async def delete_one(message, progress):
+        """Delete a single message, recording the outcome."""
+        async with semaphore, permit():
+            try:
+                await message.delete()
+                deleted_ids.append(message.id)
+                progress["deleted"] += 1
+            except discord.NotFound as e:
+                if e.code != UNKNOWN_MESSAGE:
+                    print(f"⚠️ Error deleting message: {e}")
+                    progress["failed"] += 1
+                else:
+                    # Already deleted by someone else
+                    deleted_ids.append(message.id)
+                    progress["deleted"] += 1
+            except discord.Forbidden:
+                print(f"❌ No permission to delete message in #{progress['name']}")
+                progress["failed"] += 1
+            except discord.HTTPException as e:
+                print(f"⚠️ Error deleting message: {e}")
+                progress["failed"] += 1
+            except Exception as e:
+                print(f"⚠️ Unexpected error: {e}")
+                progress["failed"] += 1
+        report()
+
+    async def delete_chunk(channel, chunk, progress):
+        """Bulk delete up to 100 young messages, falling back to single deletes if the request fails."""
+        async with semaphore, permit():
+            try:
+                await channel.delete_messages(chunk)
+                deleted_ids.extend(message.id for message in chunk)
+                progress["deleted"] += len(chunk)
+                report()
+                return
+            except discord.Forbidden:
+                print(f"❌ No permission to delete messages in #{progress['name']}")
+                progress["failed"] += len(chunk)
+                report()
+                return
+            except discord.HTTPException as e:
+                # One unknown or too-old message fails the whole request
+                print(f"⚠️ Bulk delete failed in #{progress['name']}, deleting individually: {e}")
+        await asyncio.gather(*(delete_one(message, progress) for message in chunk))
+
+    async def delete_channel(channel, channel_messages, progress):
+        progress["status"] = "deleting"
+        report()
+
+        young = [message for message in channel_messages if message.id >= cutoff]
+        old = [message for message in channel_messages if message.id < cutoff]
+
+        tasks = []
+        if len(young) > 1 and hasattr(channel, "delete_messages"):
+            for start in range(0, len(young), BULK_DELETE_CHUNK_SIZE):
+                chunk = young[start:start + BULK_DELETE_CHUNK_SIZE]
+                if len(chunk) == 1:
+                    # The bulk endpoint needs at least two messages
+                    tasks.append(delete_one(chunk[0], progress))
+                else:
+                    tasks.append(delete_chunk(channel, chunk, progress))
+        else:
+            old = young + old
+
+        tasks.extend(delete_one(message, progress) for message in old)
+        await asyncio.gather(*tasks)
+
+        progress["status"] = "done" if not progress["failed"] else "done with errors"
+        report()
+
+    try:
+        await asyncio.gather(*(
+            delete_channel(channel, channel_messages, channel_progress[channel_id])
+            for channel_id, (channel, channel_messages) in channels.items()
+        ))
+    except asyncio.CancelledError:
+        for progress in channel_progress.values():
+            if not progress["status"].startswith("done"):
+                progress["status"] = "cancelled"
+        count_outcomes()
+        raise
+    finally:
+        # Report the final (possibly partial) outcome either way
+        report()
+        elapsed = time.monotonic() - started
+        if deleted_ids and elapsed > 0:
+            metrics.deletion_rate.set(len(deleted_ids) / elapsed)
+    return deleted_ids, channel_progress
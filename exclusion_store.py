@@ -0,0 +1,175 @@
+"""On-disk storage for per-guild exclusion lists.
+
+Every guild's lists live in their own JSON file, written atomically (to a
+temporary file that replaces the old one), so a crash mid-write never leaves
+a corrupt file. Changes are batched: the first change schedules a flush a
+few seconds later, and everything changed until then is written together,
+one file per changed guild.
+
+The lists, the dirty set and the flush timer belong to the bot's event loop.
+Writes run in a worker thread, which hands failed guilds back to the loop,
+and a flush from another thread (the window's shutdown) runs on the loop.
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+
+FLUSH_DELAY = 2.0  # Seconds between the first unsaved change and the write
+
+
+def write_atomic(path, data):
+    """Write bytes to path so readers only ever see the old or the new contents."""
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class ExclusionStore:
+    """Exclusion lists by guild ID ({keyword: [words]}), persisted one file per guild."""
+
+    def __init__(self, directory, legacy_file=None, flush_delay=FLUSH_DELAY):
+        self.directory = directory
+        self.legacy_file = legacy_file  # Old single-file store, migrated on first load
+        self.flush_delay = flush_delay
+        self.lists = {}  # Shared with the bot; load() fills it in place
+        self._dirty = set()
+        self._flush_handle = None
+        self._loop = None  # The event loop that schedules flushes
+
+    def _path(self, guild_id):
+        return os.path.join(self.directory, f"{guild_id}.json")
+
+    def load(self):
+        """Read every guild's lists from disk, migrating the legacy file if there is one."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.lists.clear()
+        for name in os.listdir(self.directory):
+            guild_id, ext = os.path.splitext(name)
+            if ext != ".json" or name.startswith("."):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "r") as f:
+                    self.lists[guild_id] = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error loading exclusion lists for guild {guild_id}: {e}")
+
+        if self.legacy_file and os.path.exists(self.legacy_file):
+            self._migrate_legacy()
+        return self.lists
+
+    def _migrate_legacy(self):
+        """Split the old all-guilds file into per-guild files, then set it aside."""
+        try:
+            with open(self.legacy_file, "r") as f:
+                legacy = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading {self.legacy_file}, leaving it in place: {e}")
+            return
+        for guild_id, guild_lists in legacy.items():
+            # Lists already in the per-guild files are newer
+            if guild_id not in self.lists:
+                self.lists[guild_id] = guild_lists
+                self._dirty.add(guild_id)
+        self.flush()
+        os.replace(self.legacy_file, self.legacy_file + ".migrated")
+        print(f"Migrated exclusion lists of {len(legacy)} guilds from {self.legacy_file}")
+
+    def mark_dirty(self, guild_id):
+        """Record that a guild's lists changed and schedule a flush.
+
+        Inside the bot's event loop the write happens after flush_delay, in a
+        worker thread; without a running loop it happens right away.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._dirty.add(guild_id)
+            self.flush()
+            return
+        self._schedule(loop, (guild_id,))
+
+    def _schedule(self, loop, guild_ids=()):
+        """Mark guilds dirty and schedule a flush unless one is pending. Runs on the loop."""
+        self._dirty.update(guild_ids)
+        self._loop = loop
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_delay, lambda: loop.create_task(self.flush_async()))
+
+    def _take_snapshots(self):
+        """Serialize the changed guilds and clear the dirty set. Runs where the lists are edited."""
+        snapshots = {}
+        for guild_id in self._dirty:
+            guild_lists = self.lists.get(guild_id)
+            snapshots[guild_id] = json.dumps(guild_lists, indent=2).encode("utf-8") if guild_lists else None
+        self._dirty.clear()
+        return snapshots
+
+    def _write(self, snapshots):
+        """Write the snapshots; returns the IDs of the guilds that could not be saved."""
+        os.makedirs(self.directory, exist_ok=True)
+        failed = []
+        for guild_id, data in snapshots.items():
+            path = self._path(guild_id)
+            try:
+                if data is None:
+                    # No lists left for the guild
+                    if os.path.exists(path):
+                        os.remove(path)
+                else:
+                    write_atomic(path, data)
+            except OSError as e:
+                print(f"Error saving exclusion lists for guild {guild_id}: {e}")
+                failed.append(guild_id)
+        if len(snapshots) > len(failed):
+            print(f"Exclusion lists saved for {len(snapshots) - len(failed)} guilds")
+        return failed
+
+    def _write_in_thread(self, snapshots, loop):
+        failed = self._write(snapshots)
+        if failed:
+            # Try again with a later flush; the dirty set and the timer belong to the loop
+            loop.call_soon_threadsafe(self._schedule, loop, failed)
+
+    async def flush_async(self):
+        """Write the changed guilds without blocking the event loop."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        snapshots = self._take_snapshots()
+        if snapshots:
+            await asyncio.to_thread(self._write_in_thread, snapshots, asyncio.get_running_loop())
+
+    def flush(self):
+        """Write the changed guilds now (e.g. on shutdown).
+
+        From another thread while the bot's loop is running, the flush is sent
+        to that loop and this waits for it.
+        """
+        loop = self._loop
+        if loop is not None and loop.is_running() and not self._on_loop(loop):
+            asyncio.run_coroutine_threadsafe(self.flush_async(), loop).result()
+            return
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._dirty.update(self._write(self._take_snapshots()))  # Try again with the next flush
+
+    @staticmethod
+    def _on_loop(loop):
+        try:
+            return asyncio.get_running_loop() is loop
+        except RuntimeError:
+            return False
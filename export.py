@@ -0,0 +1,136 @@
+"""Exporting matches to JSONL or CSV files, optionally gzip-compressed.
+
+A search with export= streams every match to the file as it is found: the
+event loop only formats the match into a buffer, and once EXPORT_BATCH
+matches are buffered they are written (and compressed) in a worker thread.
+Nothing but the buffer is kept for the export, so its memory stays flat
+however many matches a sweep finds. !export writes a finished session's
+results the same way.
+
+JSONL exports use the field names archive_search reads, so an export can be
+searched offline again. IDs are strings, as in Discord's own JSON.
+"""
+
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import time
+
+import discord
+
+EXPORT_FORMATS = ("jsonl", "csv")
+EXPORT_FIELDS = ("id", "guild_id", "channel_id", "channel_name", "author_id", "author_name",
+                 "created_at", "content", "keywords", "jump_url")
+EXPORT_BATCH = 1000  # Matches buffered before they are written out
+
+
+def parse_export(value):
+    """Parse an export format (jsonl, csv, jsonl.gz or csv.gz); returns (format, compress).
+
+    Raises ValueError with a message for the user for anything else.
+    """
+    value = value.lower()
+    fmt, compress = (value[:-3], True) if value.endswith(".gz") else (value, False)
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format `{value}`. Use jsonl, csv, jsonl.gz or csv.gz.")
+    return fmt, compress
+
+
+def export_path(directory, guild_id, session_id, fmt, compress):
+    """Return a new file name for a session's export."""
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return os.path.join(directory, f"search-{guild_id}-{session_id}-{stamp}.{fmt}" + (".gz" if compress else ""))
+
+
+def export_fields(record, guild_id, keyword_names=()):
+    """Return the exported fields of a MatchRecord, in EXPORT_FIELDS order.
+
+    keyword_names are the search terms by keyword ID (SearchSession.keyword_names).
+    """
+    keywords = [keyword_names[index] for index in record.keyword_ids if index < len(keyword_names)]
+    return (
+        str(record.id), str(guild_id), str(record.channel_id), record.channel_name,
+        str(record.author_id or ""), record.author_name,
+        discord.utils.snowflake_time(record.id).isoformat(), record.content, keywords,
+        f"https://discord.com/channels/{guild_id}/{record.channel_id}/{record.id}",
+    )
+
+
+class MatchExporter:
+    """Writes MatchRecords to one JSONL or CSV file, in batches."""
+
+    def __init__(self, path, fmt="jsonl", compress=False, guild_id=0, keyword_names=()):
+        self.path = path
+        self.fmt = fmt
+        self.guild_id = guild_id
+        self.keyword_names = keyword_names
+        self.count = 0  # Matches written or buffered
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if compress:
+            self._file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        else:
+            self._file = open(path, "w", encoding="utf-8", newline="")
+        self._buffer = io.StringIO()
+        self._csv = csv.writer(self._buffer) if fmt == "csv" else None
+        self.pending = 0  # Matches in the buffer
+        self._lock = asyncio.Lock()  # Keeps batches written in order
+        if self._csv:
+            self._csv.writerow(EXPORT_FIELDS)
+
+    def write(self, record):
+        """Add a match to the buffer."""
+        fields = export_fields(record, self.guild_id, self.keyword_names)
+        if self._csv:
+            self._csv.writerow(fields[:8] + (", ".join(fields[8]),) + fields[9:])
+        else:
+            self._buffer.write(json.dumps(dict(zip(EXPORT_FIELDS, fields)), ensure_ascii=False))
+            self._buffer.write("\n")
+        self.count += 1
+        self.pending += 1
+
+    def _take_buffer(self):
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self.pending = 0
+        return data
+
+    async def flush_async(self):
+        """Write the buffered matches without blocking the event loop."""
+        data = self._take_buffer()
+        async with self._lock:
+            if data:
+                await asyncio.to_thread(self._file.write, data)
+
+    async def close_async(self):
+        """Write what is left and close the file."""
+        await self.flush_async()
+        async with self._lock:
+            await asyncio.to_thread(self._file.close)
+
+    def flush(self):
+        """Write the buffered matches now, blocking (outside the event loop)."""
+        self._file.write(self._take_buffer())
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def export_results(results, path, fmt="jsonl", compress=False, guild_id=0, keyword_names=()):
+    """Write a sequence of MatchRecords (e.g. a finished session's results) to a file. Returns the count.
+
+    Blocks; the bot runs it in a worker thread.
+    """
+    exporter = MatchExporter(path, fmt, compress, guild_id, keyword_names)
+    try:
+        for record in results:
+            exporter.write(record)
+            if exporter.pending >= EXPORT_BATCH:
+                exporter.flush()
+    finally:
+        exporter.close()
+    return exporter.count
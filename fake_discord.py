@@ -0,0 +1,208 @@
+"""In-process stand-ins for the discord.py objects ChatScrub uses, for benchmarks.
+
+Channels make up their history on the fly from a SyntheticHistory: how many
+messages, how long they are, how often they contain a keyword and how old
+they are. Every API request (one page of history, one delete call) waits a
+configurable latency, standing in for Discord's network and rate limits.
+Messages are generated as they are fetched, so the memory a benchmark
+measures is ChatScrub's, not the fake server's.
+"""
+
+import asyncio
+import random
+import string
+from datetime import datetime, timedelta, timezone
+
+import discord
+
+from jobs import HISTORY_PAGE_SIZE
+
+CONTENT_VARIANTS = 1024  # Distinct message texts per channel, reused round-robin
+
+
+class SyntheticHistory:
+    """Parameters of a channel's made-up history."""
+
+    def __init__(self, message_count=10000, content_length=80, hit_rate=0.02, keywords=("needle",),
+                 span_days=30, author_count=50, seed=1):
+        self.message_count = message_count
+        self.content_length = content_length
+        self.hit_rate = hit_rate  # Fraction of messages that contain a keyword
+        self.keywords = tuple(keywords)
+        self.span_days = span_days  # Age of the oldest message; the newest one is from now
+        self.author_count = author_count
+        self.seed = seed
+
+
+def _filler_text(rng, length, keywords):
+    """Return about length characters of random words that contain none of the keywords."""
+    words = []
+    size = 0
+    while size < length:
+        word = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+        if any(keyword in word for keyword in keywords):
+            continue
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+class FakeMember:
+    """A guild member (message author or command invoker)."""
+
+    def __init__(self, id, name, manage_messages=True):
+        self.id = id
+        self.name = name
+        self.bot = False
+        self.guild_permissions = discord.Permissions(manage_messages=manage_messages)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMessage:
+    """A fetched message, or a partial message when only its ID is known."""
+
+    __slots__ = ("id", "content", "author", "channel", "edited_at")
+
+    # Plain text messages: no attachments, embeds, stickers or mentions
+    attachments = embeds = stickers = mentions = role_mentions = ()
+    mention_everyone = False
+
+    def __init__(self, id, content, author, channel):
+        self.id = id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.edited_at = None
+
+    @property
+    def created_at(self):
+        return discord.utils.snowflake_time(self.id)
+
+    async def delete(self):
+        await self.channel.request()
+        self.channel.deleted += 1
+
+
+class FakeChannel:
+    """A text channel whose history is generated from a SyntheticHistory."""
+
+    def __init__(self, guild, id, name, history, latency=0.0):
+        self.guild = guild
+        self.id = id
+        self.name = name
+        self.history_config = history
+        self.latency = latency  # Seconds every API request takes
+        self.requests = 0
+        self.deleted = 0
+
+        rng = random.Random(f"{history.seed}-{id}")
+        self._plain = [_filler_text(rng, history.content_length, history.keywords) for _ in range(CONTENT_VARIANTS)]
+        self._hits = []
+        for text in self._plain:
+            words = text.split(" ")
+            words.insert(rng.randrange(len(words) + 1), rng.choice(history.keywords))
+            self._hits.append(" ".join(words))
+        self._authors = [FakeMember(1000 + index, f"user{index}") for index in range(history.author_count)]
+
+        # Message IDs are spread evenly from span_days ago until now
+        span = timedelta(days=history.span_days)
+        self._step_ms = max(1, int(span.total_seconds() * 1000) // max(1, history.message_count))
+        self._first_id = discord.utils.time_snowflake(datetime.now(timezone.utc) - span)
+        self._hit_threshold = int(history.hit_rate * 2 ** 32)
+
+    def __repr__(self):
+        return f"<FakeChannel #{self.name}>"
+
+    @property
+    def mention(self):
+        return f"<#{self.id}>"
+
+    def message_id(self, index):
+        return self._first_id + ((index * self._step_ms) << 22)
+
+    def _index_after(self, message_id):
+        """Return the index of the first message with an ID above message_id."""
+        if message_id < self._first_id:
+            return 0
+        return ((message_id - self._first_id) >> 22) // self._step_ms + 1
+
+    def message(self, index):
+        """Build message number index of the history."""
+        # A cheap, deterministic hash decides whether the message contains a keyword
+        is_hit = (index * 2654435761 + self.history_config.seed) % 2 ** 32 < self._hit_threshold
+        texts = self._hits if is_hit else self._plain
+        return FakeMessage(self.message_id(index), texts[index % CONTENT_VARIANTS],
+                           self._authors[index % len(self._authors)], self)
+
+    async def request(self):
+        """Wait like one API request would."""
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+    async def history(self, limit=None, after=None, before=None, oldest_first=None):
+        """Yield the history oldest first, one request per page of HISTORY_PAGE_SIZE messages."""
+        start = self._index_after(after.id) if after is not None else 0
+        stop = self.history_config.message_count
+        if before is not None:
+            stop = min(stop, self._index_after(before.id - 1))
+        if limit is not None:
+            stop = min(stop, start + limit)
+        for index in range(start, stop):
+            if (index - start) % HISTORY_PAGE_SIZE == 0:
+                await self.request()
+            yield self.message(index)
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(message_id, "", None, self)
+
+    async def delete_messages(self, messages):
+        await self.request()
+        self.deleted += len(messages)
+
+
+class FakeGuild:
+    """A guild with fake text channels."""
+
+    def __init__(self, id, name="Benchmark"):
+        self.id = id
+        self.name = name
+        self.channels = []
+
+    def add_channel(self, name, history, latency=0.0):
+        channel = FakeChannel(self, self.id + len(self.channels) + 1, name, history, latency)
+        self.channels.append(channel)
+        return channel
+
+    def get_channel(self, channel_id):
+        return next((channel for channel in self.channels if channel.id == channel_id), None)
+
+
+class FakeClient:
+    """The parts of the bot client that deletion uses: finding channels by ID."""
+
+    def __init__(self, guilds):
+        self.guilds = guilds
+
+    def get_channel(self, channel_id):
+        for guild in self.guilds:
+            channel = guild.get_channel(channel_id)
+            if channel is not None:
+                return channel
+        return None
+
+    def get_partial_messageable(self, channel_id):
+        raise LookupError(f"Unknown channel {channel_id}")
+
+
+class FakeContext:
+    """A command invocation; sent messages are kept instead of posted."""
+
+    def __init__(self, guild, author):
+        self.guild = guild
+        self.author = author
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
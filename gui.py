@@ -0,0 +1,875 @@
+"""Tkinter window for browsing search results and deleting messages.
+
+Only imported when ChatScrub runs with the GUI, so headless servers never
+load Tkinter.
+"""
+
+import asyncio
+import bisect
+import threading
+import tkinter as tk
+from tkinter import filedialog, simpledialog, ttk
+
+import metrics
+from deletion import delete_messages
+from results import ResultStore, ResultView, partial_message
+from selection import Selection
+from ui_events import DRAIN_INTERVAL_MS
+
+# Tk before 8.7 stores characters outside the BMP (most emoji) as surrogate pairs,
+# so they take two places in text indices
+TK_SURROGATE_PAIRS = tk.TkVersion < 8.7
+
+def tk_offsets(text, offsets):
+    """Convert character offsets into text to offsets into the same text in a Tk widget."""
+    if not TK_SURROGATE_PAIRS or text.isascii():
+        return offsets
+    wide = [index for index, ch in enumerate(text) if ord(ch) > 0xFFFF]
+    if not wide:
+        return offsets
+    return [offset + bisect.bisect_left(wide, offset) for offset in offsets]
+
+class ResultRow:
+    """One reusable row of the result list: checkbox, number label and message text."""
+
+    def __init__(self, frame, var, label, text):
+        self.frame = frame
+        self.var = var
+        self.label = label
+        self.text = text
+        self.position = None  # Result position currently shown in this row
+        self.record = None
+
+class VirtualResultList(ttk.Frame):
+    """Scrollable list of results that only creates widgets for the visible rows.
+    
+    A fixed pool of row widgets is reused while scrolling; each row is rebound
+    to whichever result is shown at its place, so showing a range of results
+    costs the same whether it holds 10 or 100,000 of them.
+    """
+
+    def __init__(self, parent, get_row, is_selected, on_toggle, decorate=None, on_context_menu=None, text_lines=4):
+        super().__init__(parent)
+        self.get_row = get_row  # position -> (number, record), or None if not available yet
+        self.is_selected = is_selected  # position -> bool
+        self.on_toggle = on_toggle  # (position, selected) -> None
+        self.decorate = decorate  # (text_widget, record, text) -> None, e.g. keyword highlighting
+        self.on_context_menu = on_context_menu  # (position, record, event) -> None, on right-click
+        self.text_lines = text_lines
+        
+        self.start = 0  # First result position of the range being shown
+        self.count = 0  # Number of results in the range
+        self.first = 0  # Offset of the first visible row within the range
+        self.rows = []
+        self.row_height = None
+        
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+        
+        self.body = ttk.Frame(self)
+        self.body.grid(row=0, column=0, sticky="nsew")
+        self.body.columnconfigure(0, weight=1)
+        self.body.grid_propagate(False)  # The list's size decides how many rows show, not the other way round
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.on_scrollbar)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        
+        self.body.bind("<Configure>", lambda event: self.redraw())
+        self.bind_scroll(self.body)
+
+    def bind_scroll(self, widget):
+        """Route mouse wheel events on a widget to the list."""
+        widget.bind("<MouseWheel>", self.on_mousewheel)
+        widget.bind("<Button-4>", lambda event: self.scroll_by(-1))
+        widget.bind("<Button-5>", lambda event: self.scroll_by(1))
+
+    def create_row(self):
+        """Add a row to the widget pool."""
+        row_frame = ttk.Frame(self.body)
+        row_frame.columnconfigure(2, weight=1)  # Make the text widget column expandable
+        var = tk.BooleanVar()
+        
+        # Checkbox
+        chk = ttk.Checkbutton(row_frame, variable=var)
+        chk.grid(row=0, column=0, sticky="w", padx=(0,5))
+        
+        # Message number label
+        num_label = ttk.Label(row_frame, width=7)
+        num_label.grid(row=0, column=1, sticky="w", padx=(0,10))
+        
+        # Text widget for message content
+        text_widget = tk.Text(row_frame, wrap="word", height=self.text_lines, borderwidth=1, relief="solid")
+        text_widget.grid(row=0, column=2, sticky="nsew", padx=(0,5))
+        text_widget.tag_configure("highlight", foreground="red", underline=True)
+        text_widget.config(state="disabled")
+        
+        row = ResultRow(row_frame, var, num_label, text_widget)
+        chk.config(command=lambda: self.on_row_toggle(row))
+        for widget in (row_frame, chk, num_label, text_widget):
+            self.bind_scroll(widget)
+            if self.on_context_menu:
+                widget.bind("<Button-3>", lambda event: self.on_row_context_menu(row, event))
+        
+        row_frame.grid(row=len(self.rows), column=0, sticky="ew", padx=5, pady=2)
+        self.rows.append(row)
+        
+        # Measure the row height once, from the first row
+        if self.row_height is None:
+            row_frame.update_idletasks()
+            self.row_height = max(1, row_frame.winfo_reqheight() + 4)
+        return row
+
+    def visible_rows(self):
+        """Return how many rows fit in the list's current height."""
+        if self.row_height is None:
+            self.create_row()
+        return max(1, self.body.winfo_height() // self.row_height)
+
+    def show(self, start, count):
+        """Show results start to start + count, scrolled to the top."""
+        self.start = start
+        self.count = count
+        self.first = 0
+        self.refresh()
+
+    def refresh(self):
+        """Rebind every visible row, e.g. after the results or selections changed."""
+        for row in self.rows:
+            row.position = None
+        self.redraw()
+
+    def redraw(self):
+        """Bind the pooled rows to the results that are currently in view."""
+        visible = self.visible_rows()
+        while len(self.rows) < visible:
+            self.create_row()
+        self.first = max(0, min(self.first, self.count - visible))
+        
+        for i, row in enumerate(self.rows):
+            offset = self.first + i
+            data = self.get_row(self.start + offset) if i < visible and offset < self.count else None
+            if data is None:
+                row.frame.grid_remove()
+                row.position = None
+                continue
+            if row.position != self.start + offset:
+                self.bind_row(row, self.start + offset, *data)
+            row.frame.grid()
+        
+        if self.count:
+            self.scrollbar.set(self.first / self.count, min(1.0, (self.first + visible) / self.count))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def bind_row(self, row, position, number, record):
+        """Show a result in a pooled row."""
+        row.position = position
+        row.record = record
+        row.var.set(self.is_selected(position))
+        row.label.config(text=f"{number}.")
+        
+        # Display text is only formatted for rows that are actually drawn
+        text = record.display_text()
+        row.text.config(state="normal")
+        row.text.delete("1.0", "end")
+        row.text.insert("1.0", text)
+        if self.decorate:
+            self.decorate(row.text, record, text)
+        row.text.config(state="disabled")
+
+    def on_row_toggle(self, row):
+        """Pass checkbox changes on to the owner."""
+        if row.position is not None:
+            self.on_toggle(row.position, row.var.get())
+
+    def on_row_context_menu(self, row, event):
+        """Pass right-clicks on a row on to the owner."""
+        if row.position is not None:
+            self.on_context_menu(row.position, row.record, event)
+        return "break"
+
+    def scroll_by(self, rows):
+        """Scroll the list by a number of rows."""
+        self.first += rows
+        self.redraw()
+        return "break"  # Don't let text widgets scroll their own content
+
+    def on_mousewheel(self, event):
+        """Scroll one row per wheel notch (Windows reports 120 per notch, macOS 1)."""
+        notches = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        return self.scroll_by(-notches or (-1 if event.delta > 0 else 1))
+
+    def on_scrollbar(self, action, amount, unit=None):
+        """Handle scrollbar drags and clicks."""
+        if action == "moveto":
+            self.first = int(float(amount) * self.count)
+        elif action == "scroll":
+            step = self.visible_rows() if unit == "pages" else 1
+            self.first += int(amount) * step
+        self.redraw()
+
+class DiscordBotUI:
+    def __init__(self, root, app):
+        """Initialize the Tkinter UI for managing Discord messages.
+        
+        app is the chatscrub module, whose bot, sessions, scheduler and event
+        queue the window works with.
+        """
+        self.root = root
+        self.app = app
+        self.root.title("Discord Message Manager")
+        self.root.geometry("900x600")
+        
+        # Make root window resizable
+        self.root.columnconfigure(0, weight=1)
+        self.root.rowconfigure(0, weight=1)
+
+        # Progress Frame
+        self.progress_frame = ttk.LabelFrame(self.root, text="Search Progress")
+        self.progress_frame.pack(fill="x", padx=10, pady=5)
+        
+        # Session switcher: one entry per running or recently finished search
+        self.session_frame = ttk.Frame(self.progress_frame)
+        self.session_frame.pack(fill="x", padx=5, pady=(5, 0))
+        ttk.Label(self.session_frame, text="Search:").pack(side="left")
+        self.session_var = tk.StringVar()
+        self.session_selector = ttk.Combobox(self.session_frame, textvariable=self.session_var, state="readonly")
+        self.session_selector.pack(side="left", fill="x", expand=True, padx=5)
+        self.session_selector.bind("<<ComboboxSelected>>", self.on_session_selected)
+        self.session_ids = []  # Session IDs in the order of the switcher's entries
+        
+        # Progress Bar
+        self.progress_var = tk.DoubleVar()
+        self.progress_bar = ttk.Progressbar(self.progress_frame, variable=self.progress_var, mode="indeterminate")
+        self.progress_bar.pack(fill="x", padx=5, pady=5)
+        
+        # Progress Labels
+        self.progress_status = ttk.Label(self.progress_frame, text="Ready")
+        self.progress_status.pack(anchor="w", padx=5)
+        
+        self.progress_details = ttk.Label(self.progress_frame, text="")
+        self.progress_details.pack(anchor="w", padx=5)
+        
+        self.elapsed_time = ttk.Label(self.progress_frame, text="")
+        self.elapsed_time.pack(anchor="w", padx=5)
+
+        # Pagination Frame
+        self.pagination_frame = ttk.Frame(self.root)
+        self.pagination_frame.pack(fill="x", padx=10, pady=5)
+        
+        self.page_info = ttk.Label(self.pagination_frame, text="No results")
+        self.page_info.pack(side="left", padx=5)
+        
+        self.prev_button = ttk.Button(self.pagination_frame, text="← Prev", command=self.prev_page, state="disabled")
+        self.prev_button.pack(side="left", padx=5)
+        
+        self.next_button = ttk.Button(self.pagination_frame, text="Next →", command=self.next_page, state="disabled")
+        self.next_button.pack(side="left", padx=5)
+        
+        # Select items per page
+        ttk.Label(self.pagination_frame, text="Items per page:").pack(side="left", padx=(20, 5))
+        self.page_size_var = tk.StringVar(value="100")
+        page_size_combo = ttk.Combobox(self.pagination_frame, textvariable=self.page_size_var, 
+                                        values=["50", "100", "500","1000", "All"], width=5)
+        page_size_combo.pack(side="left")
+        page_size_combo.bind("<<ComboboxSelected>>", self.change_page_size)
+
+        # Selected count label (NEW)
+        self.selected_count_var = tk.StringVar(value="0 items selected")
+        self.selected_count = ttk.Label(self.pagination_frame, textvariable=self.selected_count_var)
+        self.selected_count.pack(side="right", padx=10)
+
+        # Main Frame (Holds everything else) - Now with weight for resizing
+        self.main_frame = ttk.Frame(self.root)
+        self.main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.main_frame.columnconfigure(0, weight=1)
+        self.main_frame.rowconfigure(0, weight=1)
+
+        # Virtualized result list: only the visible rows have widgets
+        self.result_list = VirtualResultList(
+            self.main_frame,
+            get_row=self.get_result_row,
+            is_selected=lambda position: self.all_messages.store_position(position) in self.selection,
+            on_toggle=self.on_checkbox_change,
+            decorate=self.highlight_row,
+            on_context_menu=self.show_row_menu,
+        )
+        self.result_list.pack(fill=tk.BOTH, expand=True)
+
+        # Selection controls: this page, or every result on all pages
+        self.selection_frame = ttk.Frame(self.root)
+        self.selection_frame.pack(pady=5)
+        self.select_all_var = tk.BooleanVar()
+        self.select_all_checkbox = ttk.Checkbutton(self.selection_frame, text="Select All Items on This Page", 
+                                                  variable=self.select_all_var, command=self.toggle_all)
+        self.select_all_checkbox.pack(side="left", padx=5)
+        ttk.Button(self.selection_frame, text="Select All Results", command=self.select_all_results).pack(side="left", padx=5)
+        ttk.Button(self.selection_frame, text="Invert Selection", command=self.invert_selection).pack(side="left", padx=5)
+        ttk.Button(self.selection_frame, text="Clear Selection", command=self.clear_selection).pack(side="left", padx=5)
+        
+        # Right-click menu of a result row: select or deselect its whole channel or author
+        self.row_menu = tk.Menu(self.root, tearoff=0)
+
+        # Delete Button
+        self.delete_button = ttk.Button(self.root, text="Delete Selected", command=self.delete_selected)
+        self.delete_button.pack(pady=5)
+        
+        # Add a button to show exclusions
+        self.exclusions_button = ttk.Button(self.root, text="Show Exclusion Lists", command=self.show_exclusions)
+        self.exclusions_button.pack(pady=5)
+        
+        # Offline search over exported messages
+        self.archive_button = ttk.Button(self.root, text="Search Archives...", command=self.search_archives)
+        self.archive_button.pack(pady=5)
+
+        # Status Label
+        self.status_label = ttk.Label(self.root, text="", foreground="blue")
+        self.status_label.pack(pady=5)
+
+        # Selected results across all pages, by store position (see selection.py)
+        self.selection = Selection()
+        self.session_selections = {}  # Selections of the sessions not shown, by session ID
+        
+        # The search session shown in the UI
+        self.session = None
+
+        # Pagination variables
+        self.current_page = 1
+        self.items_per_page = 25  # 0 shows all results in one scrollable list
+        self.all_messages = ResultView(ResultStore())  # View of the shown session's MatchRecords in result order
+        self.total_pages = 1
+        
+        # Start progress updater
+        self.update_progress_display()
+        
+        # Start applying events from the bot thread
+        self.process_events()
+        
+    def page_bounds(self):
+        """Return the 0-based [start, end) range of results on the current page."""
+        total = len(self.all_messages)
+        if not self.items_per_page:
+            return 0, total
+        start = (self.current_page - 1) * self.items_per_page
+        return start, min(start + self.items_per_page, total)
+
+    def recalculate_pages(self):
+        """Update the page count after the results or the page size changed."""
+        if not self.items_per_page:
+            self.total_pages = 1
+        else:
+            self.total_pages = max(1, (len(self.all_messages) + self.items_per_page - 1) // self.items_per_page)
+
+    def get_result_row(self, position):
+        """Return (number, record) for a 0-based result position, or None."""
+        if position >= len(self.all_messages):
+            return None
+        return position + 1, self.all_messages[position]
+
+    def set_status(self, text, color="blue"):
+        """Show a message in the status label."""
+        self.status_label.config(text=text, foreground=color)
+
+    def process_events(self):
+        """Apply the events posted by the bot thread, then check again shortly."""
+        self.app.ui_events.process()
+        self.root.after(DRAIN_INTERVAL_MS, self.process_events)
+
+    def refresh_session_selector(self):
+        """Update the switcher's entries with the current sessions and their states."""
+        all_sessions = self.app.sessions.all()
+        self.session_ids = [session.session_id for session in all_sessions]
+        self.session_selector["values"] = [session.label() for session in all_sessions]
+        if self.session is not None:
+            self.session_var.set(self.session.label())
+        
+        # Forget the selections of sessions that were dropped from the registry
+        for session_id in list(self.session_selections):
+            if session_id not in self.session_ids:
+                del self.session_selections[session_id]
+
+    def on_session_selected(self, event=None):
+        """Show the session picked in the switcher."""
+        index = self.session_selector.current()
+        if 0 <= index < len(self.session_ids):
+            session = self.app.sessions.get(self.session_ids[index])
+            if session is not None:
+                self.show_session(session)
+
+    def show_session(self, session):
+        """Show a session's results and progress, keeping each session's selection."""
+        if self.session is not None:
+            self.session_selections[self.session.session_id] = self.selection
+        self.session = session
+        self.selection = self.session_selections.pop(session.session_id, None) or Selection()
+        self.all_messages = session.results
+        self.keywords = session.keywords
+        self.delete_button.config(state="disabled" if session.read_only else "normal")
+        
+        self.current_page = 1
+        self.recalculate_pages()
+        self.display_current_page()
+        self.refresh_session_selector()
+        self.update_progress_ui()
+
+    def start_search(self, session):
+        """Add a session that is starting, showing it unless another shown search is still running."""
+        if self.session is None or not self.session.in_progress:
+            self.show_session(session)
+            self.set_status("Starting search...")
+        else:
+            self.refresh_session_selector()
+            self.set_status(f"Search #{session.session_id} started in {session.guild_name}; switch to it above.")
+
+    @metrics.ui_redraw_seconds.time(view="matches")
+    def update_matches(self, session):
+        """Update the pagination after new matches were found during incremental search.
+        
+        Posted with a coalescing key per session, so only one update is applied
+        when several batches arrive between two drains.
+        """
+        try:
+            self.refresh_session_selector()
+            
+            # all_messages is the live view of the search's result store, so
+            # it already contains the new matches
+            if session is not self.session:
+                return
+            
+            # Calculate total pages
+            self.recalculate_pages()
+            
+            # Update pagination controls
+            self.update_pagination_controls()
+            
+            # Show loading message in UI
+            self.status_label.config(text=f"Processing {len(self.all_messages)} matches...", foreground="blue")
+            
+            # Force UI update
+            self.root.update_idletasks()
+            
+            print(f"Search #{session.session_id}: {session.matches_found} matches so far")
+        except Exception as e:
+            print(f"Error updating matches: {e}")
+
+    @metrics.ui_redraw_seconds.time(view="page")
+    def display_current_page(self):
+        """Display current page of messages."""
+        # Bind the result list to the current page; it only draws the visible rows
+        start, end = self.page_bounds()
+        self.result_list.show(start, end - start)
+        
+        # Update page information and button states
+        self.update_pagination_controls()
+        
+        # Update selection counts
+        self.update_selection_count()
+        
+    def on_checkbox_change(self, position, selected):
+        """Track checkbox changes to maintain selections across pages."""
+        store_position = self.all_messages.store_position(position)
+        if selected:
+            self.selection.add(store_position)
+        else:
+            self.selection.discard(store_position)
+                
+        # Update selection count display
+        self.update_selection_count()
+    
+    def update_selection_count(self):
+        """Update the selection count display."""
+        count = len(self.selection)
+        self.selected_count_var.set(f"{count} {'item' if count == 1 else 'items'} selected")
+        
+        # Update Select All checkbox state based on current page
+        start, end = self.page_bounds()
+        all_selected = end > start and self.selection.covers(self.all_messages.mask(start, end))
+        self.select_all_var.set(all_selected)
+
+    def highlight_row(self, text_widget, record, text):
+        """Apply keyword highlighting to a result row.
+        
+        The keyword spans were found while matching, so every keyword of the
+        row is tagged in one call, without searching the text again.
+        """
+        spans = record.display_spans()
+        if spans:
+            text_widget.tag_add("highlight", *(f"1.0+{offset}c" for offset in tk_offsets(text, spans)))
+
+    def update_pagination_controls(self):
+        """Update pagination controls based on current state."""
+        # Update page info text
+        total_items = len(self.all_messages)
+        start, end = self.page_bounds()
+        start_idx = start + 1 if end > start else 0
+        end_idx = end
+        
+        self.page_info.config(text=f"Showing {start_idx}-{end_idx} of {total_items} results " +
+                             f"(Page {self.current_page} of {self.total_pages})")
+        
+        # Enable/disable pagination buttons
+        self.prev_button.config(state="normal" if self.current_page > 1 else "disabled")
+        self.next_button.config(state="normal" if self.current_page < self.total_pages else "disabled")
+
+    def prev_page(self):
+        """Go to previous page."""
+        if self.current_page > 1:
+            self.current_page -= 1
+            self.display_current_page()
+
+    def next_page(self):
+        """Go to next page."""
+        if self.current_page < self.total_pages:
+            self.current_page += 1
+            self.display_current_page()
+
+    def change_page_size(self, event=None):
+        """Change number of items displayed per page."""
+        try:
+            page_size = self.page_size_var.get()
+            self.items_per_page = 0 if page_size == "All" else int(page_size)
+            self.recalculate_pages()
+            self.current_page = 1  # Reset to first page
+            self.display_current_page()
+        except ValueError:
+            pass  # Ignore invalid input
+
+    @metrics.ui_redraw_seconds.time(view="progress")
+    def update_progress_ui(self):
+        """Update the progress UI based on the status of the shown search session"""
+        session = self.session
+        messages_scanned = session.messages_scanned if session else 0
+        matches_found = session.matches_found if session else 0
+        
+        if session and session.in_progress:
+            if self.progress_bar['mode'] == 'determinate':
+                self.progress_bar['mode'] = 'indeterminate'
+            
+            self.progress_bar.start(10)
+            self.progress_status.config(text="Searching...")
+            
+            # Calculate elapsed time during active search
+            elapsed = session.elapsed()
+            elapsed_str = f"Time elapsed: {int(elapsed // 60)}m {int(elapsed % 60)}s"
+            self.elapsed_time.config(text=elapsed_str)
+            
+            # One line per channel that is being (or has been) scanned
+            channel_lines = "\n".join(
+                f"#{progress['name']}: {progress['status']} - {progress['scanned']} scanned, {progress['matches']} matches"
+                for progress in list(session.channel_progress.values())
+                if progress["status"] != "queued"
+            )
+            queued = sum(1 for progress in list(session.channel_progress.values()) if progress["status"] == "queued")
+            if queued:
+                channel_lines += f"\n{queued} channels queued"
+            
+            self.progress_details.config(
+                text=f"{channel_lines}\nMessages scanned: {messages_scanned}\nMatches found: {matches_found}"
+            )
+        else:
+            self.progress_bar.stop()
+            self.progress_bar['mode'] = 'determinate'
+            self.progress_var.set(100) if messages_scanned > 0 else self.progress_var.set(0)
+            
+            if messages_scanned > 0:
+                # Use the final elapsed time when search is complete
+                if session.end_time > 0:
+                    elapsed = session.elapsed()
+                    elapsed_str = f"Total time: {int(elapsed // 60)}m {int(elapsed % 60)}s"
+                    self.elapsed_time.config(text=elapsed_str)
+                
+                self.progress_status.config(text="Search complete!")
+                self.progress_details.config(text=f"Scanned {messages_scanned} messages across {session.channels_total} channels\nFound {matches_found} matches")
+            elif session and session.error:
+                self.progress_status.config(text="Search failed")
+                self.progress_details.config(text=session.error)
+                self.elapsed_time.config(text="")
+            else:
+                self.progress_status.config(text="Ready")
+                self.progress_details.config(text="")
+                self.elapsed_time.config(text="")
+
+    def update_progress_display(self):
+        """Update progress display periodically"""
+        self.update_progress_ui()
+        self.root.after(500, self.update_progress_display)  # Update every 500ms
+
+    def toggle_all(self):
+        """Check or uncheck all message checkboxes on the current page."""
+        # Update the selection for every result on the current page, not just the visible rows
+        start, end = self.page_bounds()
+        if self.select_all_var.get():
+            self.selection.select(self.all_messages.mask(start, end))
+        else:
+            self.selection.deselect(self.all_messages.mask(start, end))
+        self.selection_changed()
+
+    def select_all_results(self):
+        """Select every result of the shown session, on all pages."""
+        self.selection.select(self.all_messages.mask())
+        self.selection_changed()
+
+    def invert_selection(self):
+        """Select the unselected results of the shown session and deselect the selected ones."""
+        self.selection.invert(self.all_messages.mask())
+        self.selection_changed()
+
+    def clear_selection(self):
+        self.selection.clear()
+        self.selection_changed()
+
+    def select_where(self, selected, channel_id=None, author_id=None):
+        """Select or deselect every result of a channel or an author."""
+        mask = self.all_messages.store.mask_where(channel_id, author_id) & self.all_messages.mask()
+        if selected:
+            self.selection.select(mask)
+        else:
+            self.selection.deselect(mask)
+        self.selection_changed()
+
+    def selection_changed(self):
+        """Redraw the visible checkboxes and the selection count after a bulk change."""
+        self.result_list.refresh()
+        self.update_selection_count()
+
+    def show_row_menu(self, position, record, event):
+        """Offer to select or deselect everything from a row's channel or author."""
+        menu = self.row_menu
+        menu.delete(0, "end")
+        menu.add_command(label=f"Select All from #{record.channel_name}",
+                         command=lambda: self.select_where(True, channel_id=record.channel_id))
+        menu.add_command(label=f"Deselect All from #{record.channel_name}",
+                         command=lambda: self.select_where(False, channel_id=record.channel_id))
+        menu.add_separator()
+        menu.add_command(label=f"Select All by {record.author_name}",
+                         command=lambda: self.select_where(True, author_id=record.author_id or 0))
+        menu.add_command(label=f"Deselect All by {record.author_name}",
+                         command=lambda: self.select_where(False, author_id=record.author_id or 0))
+        try:
+            menu.tk_popup(event.x_root, event.y_root)
+        finally:
+            menu.grab_release()
+
+    def delete_selected(self):
+        """Delete selected messages with feedback."""
+        positions = self.selection.positions()
+        
+        if self.session is not None and self.session.read_only:
+            self.status_label.config(text="Archive results can't be deleted.", foreground="red")
+            return
+        if not positions:
+            self.status_label.config(text="No messages selected.", foreground="red")
+            return
+
+        self.status_label.config(text=f"Deleting {len(positions)} messages...", foreground="blue")
+        self.root.update_idletasks()
+
+        # Submit the deletion as a job on the bot's event loop (which lives in another thread)
+        self.app.bot.loop.call_soon_threadsafe(self.submit_deletion, self.session, positions)
+
+    def submit_deletion(self, session, to_delete):
+        """Start a deletion job for selected results (store positions) of a session. Runs on the bot's event loop."""
+        if session.read_only:
+            self.app.ui_events.post(self.set_status, "Archive results can't be deleted.", "red", key="status")
+            return
+        job = self.app.scheduler.submit(
+            "delete", session.guild_id, f"{len(to_delete)} messages from search #{session.session_id}",
+            lambda job: self.perform_deletion(job, session, to_delete),
+            "high", owner_name="UI",
+        )
+        self.app.ui_events.post(self.set_status, f"Deleting {len(to_delete)} messages (job #{job.job_id})...", key="status")
+
+    async def perform_deletion(self, job, session, to_delete):
+        """Perform async message deletion and post status updates to the UI.
+        
+        Runs as a scheduler job on the bot's event loop, so every widget update
+        goes through ui_events and every API request waits for a permit.
+        """
+        total = len(to_delete)
+        done = 0
+        job.progress = lambda: f"{done}/{total} processed"
+        
+        # Partial messages are enough to delete them; the store has the IDs without loading any record
+        store = session.store
+        positions = {store.id_at(position): position for position in to_delete}
+        to_delete = [partial_message(self.app.bot, store.channel_id_at(position), message_id)
+                     for message_id, position in positions.items()]
+        
+        deleted_msg_ids = []
+        channel_progress = {}
+        
+        def show_progress(progress_by_channel):
+            """Show overall and per-channel deletion progress."""
+            nonlocal done, channel_progress
+            channel_progress = progress_by_channel
+            done = sum(progress["deleted"] + progress["failed"] for progress in channel_progress.values())
+            channel_summary = ", ".join(
+                f"#{progress['name']}: {progress['deleted']}/{progress['total']}"
+                for progress in channel_progress.values()
+                if progress["status"] != "queued"
+            )
+            self.app.ui_events.post(self.set_status, f"Deleting messages... ({done}/{total}) {channel_summary}", key="status")
+        
+        # Bulk delete recent messages per channel, older ones individually. A cancelled
+        # deletion still reports what it removed, then ends as cancelled.
+        try:
+            await delete_messages(to_delete, show_progress, permit=lambda: self.app.scheduler.permit(job),
+                                  deleted_ids=deleted_msg_ids)
+        finally:
+            for progress in channel_progress.values():
+                print(f"#{progress['name']}: deleted {progress['deleted']}/{progress['total']}, failed {progress['failed']}")
+            
+            # Deleted messages must not be answered from the local index again
+            if deleted_msg_ids:
+                try:
+                    await asyncio.to_thread(self.app.message_index.delete_messages, deleted_msg_ids)
+                except Exception as e:
+                    print(f"Error removing deleted messages from the index: {e}")
+            
+            deleted_positions = [positions[message_id] for message_id in deleted_msg_ids]
+            self.app.ui_events.post(self.apply_deletion, session, deleted_positions, channel_progress)
+
+    def apply_deletion(self, session, deleted_positions, channel_progress):
+        """Remove deleted messages (store positions) from the session's results and show the outcome of a deletion."""
+        success_deletions = sum(progress["deleted"] for progress in channel_progress.values())
+        failed_deletions = sum(progress["failed"] for progress in channel_progress.values())
+        
+        # If we successfully deleted any messages, update the UI
+        if deleted_positions:
+            # Remove deleted messages from the session, also for when its search finishes later
+            session.remove(deleted_positions)
+            
+            # Remove deleted messages from the session's selection
+            selection = self.selection if session is self.session else self.session_selections.get(session.session_id)
+            if selection is not None:
+                for position in deleted_positions:
+                    selection.discard(position)
+        
+        if deleted_positions and session is self.session:
+            self.all_messages = session.results
+                    
+            # Update pagination
+            self.recalculate_pages()
+            
+            # Adjust current page if needed
+            if self.current_page > self.total_pages:
+                self.current_page = self.total_pages
+                
+            # Refresh display
+            self.display_current_page()
+        
+        # Final status update
+        if any(progress["status"] == "cancelled" for progress in channel_progress.values()):
+            self.set_status(f"Deletion cancelled after deleting {success_deletions} messages.", "orange")
+        elif failed_deletions > 0:
+            failed_channels = ", ".join(
+                f"#{progress['name']}: {progress['failed']}"
+                for progress in channel_progress.values()
+                if progress["failed"]
+            )
+            self.set_status(
+                f"Deleted {success_deletions} messages. Failed to delete {failed_deletions} messages ({failed_channels}).", 
+                "orange"
+            )
+        else:
+            self.set_status(f"Successfully deleted {success_deletions} messages!", "green")
+            
+    def finalize_results(self, session):
+        """Finalize the display of a session's results after all batches have been processed."""
+        try:
+            self.refresh_session_selector()
+            
+            # The final merged order replaces the incrementally streamed batches;
+            # drop the messages deleted while the search was running from it
+            session.apply_removals()
+            if session is not self.session:
+                return
+            
+            # Make sure we have the keywords
+            self.keywords = session.keywords
+            self.all_messages = session.results
+                
+            # Reset to first page
+            self.current_page = 1
+                
+            # Calculate total pages
+            self.recalculate_pages()
+                
+            # Display the first page
+            self.display_current_page()
+                
+            # Update progress display
+            self.update_progress_ui()
+                
+            # Update status
+            if session.error:
+                self.status_label.config(text=f"Search failed: {session.error}", foreground="red")
+            else:
+                self.status_label.config(text=f"Displaying {len(self.all_messages)} matches", foreground="green")
+                
+            # Force UI update
+            self.root.update_idletasks()
+                
+            print(f"Results display finalized. {len(self.all_messages)} messages ready.")
+            
+        except Exception as e:
+            print(f"Error finalizing results: {e}")
+            self.status_label.config(text=f"Error displaying results: {e}", foreground="red")
+    
+    def search_archives(self):
+        """Ask for export files and keywords, then search the files offline in the background."""
+        paths = filedialog.askopenfilenames(
+            parent=self.root, title="Select exported messages",
+            filetypes=[("Discord exports", "*.json *.jsonl"), ("All files", "*.*")],
+        )
+        if not paths:
+            return
+        keywords = simpledialog.askstring("Search Archives", "Keywords (separated by spaces):", parent=self.root)
+        if not keywords or not keywords.split():
+            return
+        
+        self.set_status(f"Searching {len(paths)} archive files...")
+        # Worker processes do the matching; the thread only collects their results into the session
+        threading.Thread(target=self.app.run_archive_search, args=(list(paths), keywords.split()), daemon=True).start()
+
+    def show_exclusions(self):
+        """Show the current exclusion lists in a popup window."""
+        # Create a popup window
+        popup = tk.Toplevel(self.root)
+        popup.title("Keyword Exclusion Lists")
+        popup.geometry("500x400")
+        
+        # Create a frame for the content
+        frame = ttk.Frame(popup, padding=10)
+        frame.pack(fill=tk.BOTH, expand=True)
+        
+        # Get current guild ID if available
+        try:
+            guild_id = str(next(iter(self.app.bot.guilds)).id)
+            guild_exclusions = self.app.exclusion_lists.get(guild_id, {})
+            
+            if not guild_exclusions:
+                ttk.Label(frame, text="No exclusion lists set up for this server.").pack(pady=10)
+            else:
+                # Create a text widget to display the exclusions
+                text = tk.Text(frame, wrap=tk.WORD, width=60, height=20)
+                text.pack(fill=tk.BOTH, expand=True)
+                
+                # Add scrollbar
+                scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=text.yview)
+                scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+                text.config(yscrollcommand=scrollbar.set)
+                
+                # Add the exclusions to the text widget
+                for keyword, exclusions in guild_exclusions.items():
+                    if exclusions:
+                        text.insert(tk.END, f"\nKeyword: {keyword}\n")
+                        for exclude in exclusions:
+                            text.insert(tk.END, f"  - {exclude}\n")
+                            
+                # Make the text widget read-only
+                text.config(state=tk.DISABLED)
+        except Exception as e:
+            ttk.Label(frame, text=f"Error loading exclusion lists: {e}").pack(pady=10)
+        
+        # Add a close button
+        ttk.Button(popup, text="Close", command=popup.destroy).pack(pady=10)
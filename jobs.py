@@ -0,0 +1,224 @@
+"""Background jobs (searches and deletions) with pause, cancel and fair API use.
+
+Every job runs as its own asyncio task. Jobs ask the scheduler for a permit
+before each Discord API request (one page of history, one delete call). The
+permits are the bot's shared API budget: when jobs wait for one, guilds take
+turns, and within a guild higher priority jobs go first, so a huge sweep in
+one guild cannot starve a quick lookup in another. Pausing a job holds it at
+its next permit request.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+DEFAULT_API_PERMITS = 8  # Discord API requests in flight at once, across all jobs
+HISTORY_PAGE_SIZE = 100  # Messages Discord returns per history request
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+MAX_FINISHED_JOBS = 20  # Finished jobs kept for !jobs
+
+
+class Job:
+    """A search or deletion submitted to the scheduler."""
+
+    def __init__(self, job_id, kind, guild_id, description, priority="normal", owner_id=None, owner_name=""):
+        self.job_id = job_id
+        self.kind = kind
+        self.guild_id = guild_id
+        self.description = description
+        self.priority = priority
+        self.owner_id = owner_id
+        self.owner_name = owner_name
+        self.state = "queued"  # queued, running, paused, done, cancelled or failed
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.task = None
+        self.progress = lambda: ""  # Replaced by the job with a short progress description
+        self._unpaused = asyncio.Event()
+        self._unpaused.set()
+
+    @property
+    def finished(self):
+        return self.state in ("done", "cancelled", "failed")
+
+    def pause(self):
+        if not self.finished:
+            self.state = "paused"
+            self._unpaused.clear()
+
+    def unpause(self):
+        if self.state == "paused":
+            self.state = "running"
+            self._unpaused.set()
+
+    async def wait_if_paused(self):
+        """Block while the job is paused."""
+        if not self._unpaused.is_set():
+            await self._unpaused.wait()
+
+    def summary(self):
+        """One line for !jobs."""
+        progress = self.progress()
+        return (f"#{self.job_id} [{self.state}] {self.kind} ({self.priority}): {self.description}"
+                + (f" - {progress}" if progress else "")
+                + (f" - {self.error}" if self.error else ""))
+
+
+class FairPermits:
+    """A pool of API permits handed out round-robin between guilds.
+
+    Waiters of one guild are served by priority, then in arrival order. When
+    a permit is released and several guilds are waiting, the guild after the
+    one served last gets it.
+    """
+
+    def __init__(self, permits=DEFAULT_API_PERMITS):
+        self.permits = permits
+        self._free = permits
+        self._waiters = {}  # guild ID -> heap of (priority, sequence, future)
+        self._rotation = deque()  # Guilds with waiters, in serving order
+        self._sequence = itertools.count()
+
+    async def acquire(self, guild_id, priority=PRIORITIES["normal"]):
+        if self._free > 0 and not self._rotation:
+            self._free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heap = self._waiters.setdefault(guild_id, [])
+        if not heap:
+            self._rotation.append(guild_id)
+        heapq.heappush(heap, (priority, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted and cancelled at the same time: pass the permit on
+                self.release()
+            else:
+                self._forget(guild_id, future)
+            raise
+
+    def release(self):
+        while self._rotation:
+            guild_id = self._rotation.popleft()
+            heap = self._waiters[guild_id]
+            _, _, future = heapq.heappop(heap)
+            if heap:
+                self._rotation.append(guild_id)
+            else:
+                del self._waiters[guild_id]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1
+
+    def _forget(self, guild_id, future):
+        """Remove a cancelled waiter."""
+        heap = self._waiters.get(guild_id)
+        if not heap:
+            return
+        heap[:] = [entry for entry in heap if entry[2] is not future]
+        heapq.heapify(heap)
+        if not heap:
+            del self._waiters[guild_id]
+            self._rotation.remove(guild_id)
+
+    def waiting(self):
+        """Return how many requests wait for a permit, per guild."""
+        return {guild_id: len(heap) for guild_id, heap in self._waiters.items()}
+
+
+class JobScheduler:
+    """Runs jobs as tasks and shares the API permits between them."""
+
+    def __init__(self, permits=DEFAULT_API_PERMITS, max_finished=MAX_FINISHED_JOBS):
+        self.permits = FairPermits(permits)
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._ids = itertools.count(1)
+
+    def submit(self, kind, guild_id, description, run, priority="normal", owner_id=None, owner_name=""):
+        """Start run(job) as a new job and return the job. Must be called on the bot's event loop."""
+        job = Job(next(self._ids), kind, guild_id, description, priority, owner_id, owner_name)
+        self._jobs[job.job_id] = job
+        self._prune()
+        job.task = asyncio.get_running_loop().create_task(self._run(job, run))
+        return job
+
+    async def _run(self, job, run):
+        job.state = "running"
+        try:
+            await run(job)
+            job.state = "done"
+        except asyncio.CancelledError:
+            job.state = "cancelled"
+        except Exception as e:
+            job.state = "failed"
+            job.error = str(e)
+            print(f"Job #{job.job_id} ({job.kind}) failed: {e}")
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond max_finished."""
+        finished = [job for job in self._jobs.values() if job.finished]
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job.job_id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self, guild_id=None):
+        """Return the jobs of a guild (or all jobs), oldest first."""
+        return [job for job in self._jobs.values() if guild_id is None or job.guild_id == guild_id]
+
+    def cancel(self, job_id):
+        """Cancel a job. Returns False if it doesn't exist or already finished."""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.unpause()  # A paused job must wake up to be cancelled
+        job.task.cancel()
+        return True
+
+    @asynccontextmanager
+    async def permit(self, job):
+        """Hold one API permit of the job's guild for the duration of a request."""
+        await job.wait_if_paused()
+        await self.permits.acquire(job.guild_id, PRIORITIES.get(job.priority, PRIORITIES["normal"]))
+        try:
+            yield
+        finally:
+            self.permits.release()
+
+    async def paced(self, iterator, job, page_size=HISTORY_PAGE_SIZE):
+        """Iterate an async iterator (e.g. channel.history) holding a permit for every page it fetches.
+
+        The permit is taken before the first item of each page is requested,
+        which is when the iterator makes its API request, and given back once
+        the page is buffered, before its items are handed to the caller. So a
+        slow consumer doesn't keep other jobs from making requests.
+        """
+        priority = PRIORITIES.get(job.priority, PRIORITIES["normal"])
+        iterator = iterator.__aiter__()
+        exhausted = False
+        while not exhausted:
+            await job.wait_if_paused()
+            await self.permits.acquire(job.guild_id, priority)
+            page = []
+            try:
+                # Only the first item of a page waits for the API; the rest come from the iterator's buffer
+                async for item in iterator:
+                    page.append(item)
+                    if len(page) == page_size:
+                        break
+                else:
+                    exhausted = True
+            finally:
+                self.permits.release()
+            for item in page:
+                yield item
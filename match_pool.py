@@ -0,0 +1,156 @@
+"""Keyword matching in worker processes, off the bot's event loop.
+
+Searches hand batches of message texts to a shared process pool and get
+back the indices of the texts that match, where their keywords are (and how
+many keyword hits their exclusion lists dropped), without holding up the
+event loop (heartbeats, commands) or competing with the Tk thread for the
+GIL. The workers also lowercase or normalize the texts (see normalize.py)
+and map the keyword spans back to the original text, which is the costly
+part of a normalized search. Every search's keywords and exclusion words
+are pickled once and compiled once per worker process. Batches too small
+to be worth sending are matched inline.
+"""
+
+import asyncio
+import hashlib
+import os
+import pickle
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from matcher import ExclusionFilter, KeywordMatcher, classify_spans
+from normalize import normalize as normalize_text, original_spans
+
+MATCH_BATCH_SIZE = 500  # Messages sent to a worker at once
+MIN_POOL_BATCH = 100  # Smaller batches are matched inline; sending them costs more than matching
+MAX_BATCHES_IN_FLIGHT = 4  # Batches of one channel being matched while it keeps fetching
+MAX_CACHED_SPECS = 16  # Compiled searches kept per worker process
+
+
+class MatchSpec:
+    """The keywords and exclusion filters of one search, as used inline and sent to the workers.
+
+    With normalize, texts are normalized before matching instead of just
+    lowercased; the keywords and exclusion words must be normalized already.
+    """
+
+    def __init__(self, matcher, exclusion_filters, normalize=False):
+        self.matcher = matcher
+        self.exclusion_filters = exclusion_filters
+        self.normalize = normalize
+        self.payload = pickle.dumps((
+            tuple(matcher.keywords),
+            {keyword: exclusion_filter.words for keyword, exclusion_filter in exclusion_filters.items()},
+            normalize,
+        ))
+        # Searches with the same keywords and exclusions share the compiled copy in the workers
+        self.key = hashlib.sha1(self.payload).hexdigest()
+
+    def match(self, texts):
+        """Return (indices of the matching texts, excluded keyword hits, spans, keyword IDs), matching in this process."""
+        return _match(self.matcher, self.exclusion_filters, texts, self.normalize)
+
+
+def _match(matcher, exclusion_filters, texts, normalize=False):
+    """Match a batch; spans[i] are the keyword spans (see classify_spans) of the text at matched[i].
+
+    The spans are offsets into the original text, not its lowercased or
+    normalized form. keyword_ids[i] are the IDs (see KeywordMatcher.keyword_ids)
+    of the keywords that made that text match, without the excluded ones.
+    """
+    folded = [normalize_text(text) for text in texts] if normalize else [text.lower() for text in texts]
+    matched = []
+    spans = []
+    keyword_ids = []
+    excluded_hits = 0
+    for index in matcher.candidates(folded):
+        keywords, excluded, text_spans = classify_spans(matcher, folded[index], exclusion_filters)
+        if keywords:
+            matched.append(index)
+            spans.append(original_spans(texts[index], text_spans, normalize))
+            keyword_ids.append(matcher.keyword_ids(keywords))
+        excluded_hits += len(excluded)
+    return matched, excluded_hits, spans, keyword_ids
+
+
+# Compiled specs of a worker process, by key, least recently used first
+_compiled = {}
+
+
+def _match_texts(key, payload, texts):
+    """Worker side of MatchPool.submit."""
+    compiled = _compiled.pop(key, None)
+    if compiled is None:
+        keywords, exclusions, normalize = pickle.loads(payload)
+        compiled = (KeywordMatcher(keywords),
+                    {keyword: ExclusionFilter(words) for keyword, words in exclusions.items()}, normalize)
+        if len(_compiled) >= MAX_CACHED_SPECS:
+            del _compiled[next(iter(_compiled))]
+    _compiled[key] = compiled
+    matcher, exclusion_filters, normalize = compiled
+    return _match(matcher, exclusion_filters, texts, normalize)
+
+
+class MatchPool:
+    """A process pool for matching, started on first use and shared by all searches."""
+
+    def __init__(self, workers=None, min_batch=MIN_POOL_BATCH):
+        self.workers = workers  # None for one per CPU core, 0 to match everything inline
+        self.min_batch = min_batch
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            # Spawned workers: forking a process that runs Tk and the bot's threads is unsafe
+            self._executor = ProcessPoolExecutor(max_workers=self.workers or os.cpu_count() or 1,
+                                                 mp_context=get_context("spawn"))
+        return self._executor
+
+    def submit(self, spec, texts):
+        """Start matching texts; returns an asyncio future of (matching indices, excluded hits, spans, keyword IDs)."""
+        if self.workers == 0 or len(texts) < self.min_batch:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(spec.match(texts))
+            return future
+        return asyncio.wrap_future(self._pool().submit(_match_texts, spec.key, spec.payload, texts))
+
+    def pipeline(self, spec, in_flight=MAX_BATCHES_IN_FLIGHT):
+        return MatchPipeline(self, spec, in_flight)
+
+    def shutdown(self):
+        """Stop the worker processes (they are started again when needed)."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class MatchPipeline:
+    """Batches of one channel being matched, handed back in the order they were submitted."""
+
+    def __init__(self, pool, spec, in_flight=MAX_BATCHES_IN_FLIGHT):
+        self.pool = pool
+        self.spec = spec
+        self.in_flight = in_flight
+        self._pending = deque()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, items, texts):
+        """Queue a batch: the items (messages or index rows) and their texts."""
+        self._pending.append((items, self.pool.submit(self.spec, texts)))
+
+    def full(self):
+        return len(self._pending) >= self.in_flight
+
+    async def next(self):
+        """Wait for the oldest batch; returns (items, (indices of the matching items, excluded hits, spans))."""
+        items, future = self._pending.popleft()
+        return items, await future
+
+    def cancel(self):
+        """Drop the batches not taken yet (e.g. when the search stops early)."""
+        while self._pending:
+            _, future = self._pending.popleft()
+            future.cancel()
@@ -0,0 +1,308 @@
+"""Keyword matching engine used by the search commands."""
+
+from bisect import bisect_right
+from collections import deque
+from itertools import accumulate
+
+
+def _end_order(occurrence):
+    """Sort key of (start, end, keyword) occurrences: by end, longest keyword first, as the automaton finds them."""
+    return occurrence[1], -len(occurrence[2])
+
+
+class KeywordMatcher:
+    """Finds every keyword in a text.
+
+    Small keyword sets are searched with str.find, one scan in C per keyword,
+    and a batch of texts is first narrowed down to the ones that contain a
+    keyword with one scan per keyword over the whole batch (see candidates).
+    From AUTOMATON_THRESHOLD keywords on, they are compiled into an
+    Aho-Corasick automaton that finds all of them in a single pass; walking it
+    in Python only pays off once there are that many keywords to look for.
+    Both report the same occurrences in the same order.
+    """
+
+    # Below this many keywords, one str.find per keyword beats walking the automaton
+    # (see python benchmark.py matcher)
+    AUTOMATON_THRESHOLD = 80
+
+    def __init__(self, keywords):
+        """Compile the keywords, into an automaton if there are enough of them."""
+        # Keep the keywords in the order they were given, without duplicates
+        self.keywords = list(dict.fromkeys(keyword for keyword in keywords if keyword))
+        self._ids = {keyword: index for index, keyword in enumerate(self.keywords)}
+        self._delta = None
+        if len(self.keywords) < self.AUTOMATON_THRESHOLD:
+            # Bound once here rather than picked on every call, which would cost
+            # as much as searching for a handful of keywords
+            self.find_all = self._find_all_small
+            self.matched_keywords = self._matched_keywords_small
+            self.contains_any = self._contains_any_small
+            self.candidates = self._candidates_small
+            return
+
+        # Build the keyword trie: one dict of transitions per state
+        goto = [{}]
+        outputs = [()]
+        for keyword in self.keywords:
+            state = 0
+            for ch in keyword:
+                next_state = goto[state].get(ch)
+                if next_state is None:
+                    goto.append({})
+                    outputs.append(())
+                    next_state = len(goto) - 1
+                    goto[state][ch] = next_state
+                state = next_state
+            outputs[state] = outputs[state] + (keyword,)
+
+        # Breadth-first pass to compute failure links and merge outputs
+        fail = [0] * len(goto)
+        order = []
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            order.append(state)
+            for ch, next_state in goto[state].items():
+                fallback = fail[state]
+                while fallback and ch not in goto[fallback]:
+                    fallback = fail[fallback]
+                target = goto[fallback].get(ch, 0)
+                fail[next_state] = target if target != next_state else 0
+                outputs[next_state] = outputs[next_state] + outputs[fail[next_state]]
+                queue.append(next_state)
+
+        # Flatten the failure links into a full transition table so the scan
+        # loop is a single dict lookup per character
+        delta = [dict(transitions) for transitions in goto]
+        for state in order:
+            for ch, next_state in delta[fail[state]].items():
+                delta[state].setdefault(ch, next_state)
+
+        self._delta = delta
+        self._outputs = outputs
+
+    def __bool__(self):
+        return bool(self.keywords)
+
+    def keyword_ids(self, keywords):
+        """Return the IDs (positions in self.keywords) of keywords the matcher found."""
+        return tuple(map(self._ids.__getitem__, keywords))
+
+    def iter_matches(self, text):
+        """Yield (start, end, keyword) for every keyword occurrence in the text, in order of their end."""
+        if self._delta is None:
+            yield from self._find_all_small(text)
+            return
+        delta = self._delta
+        outputs = self._outputs
+        state = 0
+        for pos, ch in enumerate(text):
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                for keyword in outputs[state]:
+                    yield pos + 1 - len(keyword), pos + 1, keyword
+
+    def _find_all_small(self, text):
+        """find_all for sets below AUTOMATON_THRESHOLD: str.find per keyword, then sorted into the automaton's order."""
+        occurrences = []
+        for keyword in self.keywords:
+            if keyword not in text:
+                continue
+            start = text.find(keyword)
+            while start >= 0:
+                occurrences.append((start, start + len(keyword), keyword))
+                start = text.find(keyword, start + 1)
+        if len(occurrences) > 1:
+            occurrences.sort(key=_end_order)
+        return occurrences
+
+    def find_all(self, text):
+        """Return every keyword occurrence in the text as a list of (start, end, keyword)."""
+        return list(self.iter_matches(text))
+
+    def _matched_keywords_small(self, text):
+        found = []
+        for keyword in self.keywords:
+            if keyword in text:
+                found.append(keyword)
+        if len(found) > 1:
+            found.sort(key=lambda keyword: _end_order((None, text.find(keyword) + len(keyword), keyword)))
+        return found
+
+    def matched_keywords(self, text):
+        """Return the distinct keywords found in the text, in the order they first appear."""
+        return list(dict.fromkeys(keyword for _, _, keyword in self.iter_matches(text)))
+
+    def candidates(self, texts):
+        """Return the indices of the texts that may contain a keyword, in order; the others certainly don't."""
+        return range(len(texts))
+
+    def _candidates_small(self, texts):
+        if len(self.keywords) == 1:
+            # Joining the batch only pays off when several keywords search the copy
+            keyword = self.keywords[0]
+            return [index for index, text in enumerate(texts) if keyword in text]
+        # A keyword found across the end of one text and the start of the next
+        # makes a candidate too many, never one too few
+        joined = "".join(texts)
+        starts = None
+        found = set()
+        for keyword in self.keywords:
+            position = joined.find(keyword)
+            if position < 0:
+                continue
+            if starts is None:
+                # Offset of every text in joined, without a Python loop over the batch
+                starts = list(accumulate(map(len, texts), initial=0))
+            while position >= 0:
+                index = bisect_right(starts, position) - 1
+                found.add(index)
+                if index + 1 >= len(texts):
+                    break
+                position = joined.find(keyword, starts[index + 1])
+        return sorted(found)
+
+    def _contains_any_small(self, text):
+        for keyword in self.keywords:
+            if keyword in text:
+                return True
+        return False
+
+    def contains_any(self, text):
+        """Return True as soon as any keyword is found in the text."""
+        delta = self._delta
+        outputs = self._outputs
+        state = 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                return True
+        return False
+
+
+class ExclusionFilter:
+    """Compiled exclusion words for one keyword."""
+
+    # Below this many words, Python's substring search beats walking the automaton
+    AUTOMATON_THRESHOLD = 100
+
+    def __init__(self, words):
+        """Compile the exclusion words, dropping blanks and duplicates."""
+        self.words = tuple(dict.fromkeys(word for word in words if word))
+        self._matcher = KeywordMatcher(self.words) if len(self.words) >= self.AUTOMATON_THRESHOLD else None
+
+    def __bool__(self):
+        return bool(self.words)
+
+    def excludes(self, text):
+        """Return True if any exclusion word appears in the text."""
+        if self._matcher is not None:
+            return self._matcher.contains_any(text)
+        return any(word in text for word in self.words)
+
+    def first_match(self, text):
+        """Return the first exclusion word found in the text, or None."""
+        if self._matcher is not None:
+            for _, _, word in self._matcher.iter_matches(text):
+                return word
+            return None
+        return next((word for word in self.words if word in text), None)
+
+
+class ExclusionCache:
+    """Compiled exclusion filters per (guild, keyword), built on first use.
+
+    Searches with Unicode normalization get filters of normalized words, cached
+    separately from the plain ones.
+    """
+
+    def __init__(self):
+        self._filters = {}
+        self._folded_filters = {}
+
+    def get(self, guild_id, keyword, words, fold=None):
+        """Return the compiled filter for a guild's keyword, compiling it if needed.
+
+        fold, if given, is applied to the exclusion words first (e.g. normalize.normalize).
+        """
+        key = (guild_id, keyword)
+        filters = self._filters if fold is None else self._folded_filters
+        exclusion_filter = filters.get(key)
+        if exclusion_filter is None:
+            exclusion_filter = ExclusionFilter(words if fold is None else [fold(word) for word in words])
+            filters[key] = exclusion_filter
+        return exclusion_filter
+
+    def filters_for(self, guild_id, keywords, guild_exclusions, fold=None):
+        """Return {keyword: filter} for the keywords that have exclusions in this guild.
+
+        With fold, the keys are the folded keywords, as the matcher of a
+        normalized search reports them.
+        """
+        return {
+            keyword if fold is None else fold(keyword): self.get(guild_id, keyword, guild_exclusions[keyword], fold)
+            for keyword in keywords
+            if guild_exclusions.get(keyword)
+        }
+
+    def invalidate(self, guild_id=None, keyword=None):
+        """Drop cached filters for one keyword, a whole guild, or everything."""
+        for filters in (self._filters, self._folded_filters):
+            if guild_id is None:
+                filters.clear()
+            elif keyword is None:
+                for key in [key for key in filters if key[0] == guild_id]:
+                    del filters[key]
+            else:
+                filters.pop((guild_id, keyword), None)
+
+
+def _split_excluded(keywords, text, exclusion_filters):
+    matched = []
+    excluded = []
+    for keyword in keywords:
+        exclusion_filter = exclusion_filters.get(keyword)
+        if exclusion_filter and exclusion_filter.excludes(text):
+            excluded.append(keyword)
+        else:
+            matched.append(keyword)
+    return matched, excluded
+
+
+def classify_keywords(matcher, text, exclusion_filters):
+    """Return (matched, excluded): the keywords found in the text, split by whether their exclusion filter drops them."""
+    return _split_excluded(matcher.matched_keywords(text), text, exclusion_filters)
+
+
+def classify_spans(matcher, text, exclusion_filters):
+    """Like classify_keywords, but also return where the keywords are: (matched, excluded, spans).
+
+    spans is flat, (start, end, start, end, ...), and covers every keyword
+    occurrence in the text, so the results view can highlight them without
+    searching the text again.
+    """
+    occurrences = matcher.find_all(text)
+    if not occurrences:
+        return [], [], ()
+    if len(occurrences) == 1:
+        # The usual match: one keyword, once
+        start, end, keyword = occurrences[0]
+        if exclusion_filters.get(keyword) and exclusion_filters[keyword].excludes(text):
+            return [], [keyword], (start, end)
+        return [keyword], [], (start, end)
+    matched, excluded = _split_excluded(dict.fromkeys(keyword for _, _, keyword in occurrences), text,
+                                        exclusion_filters)
+    return matched, excluded, tuple(offset for start, end, _ in occurrences for offset in (start, end))
+
+
+def match_keywords(matcher, text, exclusion_filters):
+    """Return the keywords that match the text and are not excluded by their own exclusion filter.
+
+    Every keyword found in the text is checked, so a message still matches when
+    one keyword is excluded but another one is not.
+    """
+    keywords = matcher.matched_keywords(text)
+    if not keywords or not exclusion_filters:
+        return keywords
+    return _split_excluded(keywords, text, exclusion_filters)[0]
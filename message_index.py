@@ -0,0 +1,351 @@
+"""Local SQLite index of fetched Discord messages.
+
+Each channel keeps a high-water mark: the newest message ID up to which its
+history is stored without gaps. Later searches only fetch messages after that
+ID from Discord and answer everything older from the index.
+
+The same database holds per-channel checkpoints of running searches, so an
+interrupted search can be resumed instead of started over. Checkpoints are
+kept per guild and per user who started the search.
+"""
+
+import json
+import sqlite3
+import time
+import threading
+
+from normalize import normalize
+
+# Trigram full-text index; needs at least 3 characters per search term
+FTS_MIN_TERM_LENGTH = 3
+# Rows per candidate_messages query when a search pages through the index
+CANDIDATE_PAGE_SIZE = 5000
+
+
+class MessageIndex:
+    """SQLite store for message ID, channel, author, timestamp and content."""
+
+    def __init__(self, path):
+        """Open (or create) the index database at path."""
+        self.path = path
+        self._lock = threading.Lock()
+        # Used from the bot's event loop and from worker threads, guarded by the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self):
+        """Create tables, indexes and the full-text index if they don't exist."""
+        with self._lock, self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY,
+                    channel_id INTEGER NOT NULL,
+                    author_id INTEGER,
+                    author_name TEXT,
+                    created_at REAL,
+                    content TEXT,
+                    edited_at REAL,
+                    flags INTEGER,
+                    normalized TEXT
+                );
+                CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel_id, id);
+                CREATE TABLE IF NOT EXISTS channel_sync (
+                    channel_id INTEGER PRIMARY KEY,
+                    high_water_mark INTEGER NOT NULL,
+                    synced_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS searches (
+                    search_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    guild_id INTEGER NOT NULL,
+                    owner_id INTEGER,
+                    params TEXT NOT NULL,
+                    started_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS search_checkpoints (
+                    search_id INTEGER NOT NULL,
+                    channel_id INTEGER NOT NULL,
+                    last_message_id INTEGER,
+                    scanned INTEGER NOT NULL DEFAULT 0,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL,
+                    PRIMARY KEY (search_id, channel_id)
+                );
+                CREATE TABLE IF NOT EXISTS checkpoint_results (
+                    search_id INTEGER NOT NULL,
+                    channel_id INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    PRIMARY KEY (search_id, channel_id, message_id)
+                );
+            """)
+            # Databases created before checkpoints were kept per user
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(searches)")]
+            if "owner_id" not in columns:
+                self._conn.execute("ALTER TABLE searches ADD COLUMN owner_id INTEGER")
+            # Databases created before edit times were stored (for normalization caching)
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(messages)")]
+            if "edited_at" not in columns:
+                self._conn.execute("ALTER TABLE messages ADD COLUMN edited_at REAL")
+            # ... and before has: flags were stored; their flags stay NULL (unknown)
+            if "flags" not in columns:
+                self._conn.execute("ALTER TABLE messages ADD COLUMN flags INTEGER")
+            # ... and before the normalized text was stored for the full-text index
+            if "normalized" not in columns:
+                self._conn.execute("ALTER TABLE messages ADD COLUMN normalized TEXT")
+                self._normalize_stored()
+            try:
+                has_normalized_fts = self._conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'messages_norm_fts'"
+                ).fetchone() is not None
+                self._conn.executescript("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                        content, content='messages', content_rowid='id', tokenize='trigram'
+                    );
+                    CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+                        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+                        INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+                        INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+                    END;
+
+                    -- The normalized text of non-ASCII messages, for normalized searches.
+                    -- ASCII messages normalize to their lowercased content, which
+                    -- messages_fts already finds (trigrams ignore case)
+                    CREATE VIRTUAL TABLE IF NOT EXISTS messages_norm_fts USING fts5(
+                        normalized, content='', tokenize='trigram'
+                    );
+                    CREATE TRIGGER IF NOT EXISTS messages_norm_ai AFTER INSERT ON messages
+                    WHEN new.normalized IS NOT NULL BEGIN
+                        INSERT INTO messages_norm_fts (rowid, normalized) VALUES (new.id, new.normalized);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS messages_norm_ad AFTER DELETE ON messages
+                    WHEN old.normalized IS NOT NULL BEGIN
+                        INSERT INTO messages_norm_fts (messages_norm_fts, rowid, normalized)
+                        VALUES ('delete', old.id, old.normalized);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS messages_norm_au AFTER UPDATE ON messages BEGIN
+                        INSERT INTO messages_norm_fts (messages_norm_fts, rowid, normalized)
+                        SELECT 'delete', old.id, old.normalized WHERE old.normalized IS NOT NULL;
+                        INSERT INTO messages_norm_fts (rowid, normalized)
+                        SELECT new.id, new.normalized WHERE new.normalized IS NOT NULL;
+                    END;
+                """)
+                if not has_normalized_fts:
+                    self._conn.execute("INSERT INTO messages_norm_fts (rowid, normalized) "
+                                       "SELECT id, normalized FROM messages WHERE normalized IS NOT NULL")
+                self.has_fts = True
+            except sqlite3.OperationalError as e:
+                # SQLite built without FTS5 or the trigram tokenizer: fall back to full scans
+                print(f"Full-text index unavailable, searches will scan stored messages: {e}")
+                self.has_fts = False
+
+    def _normalize_stored(self):
+        """Fill in the normalized text of messages stored before it was kept, a page at a time."""
+        last_id = 0
+        while True:
+            rows = self._conn.execute("SELECT id, content FROM messages WHERE id > ? ORDER BY id LIMIT ?",
+                                      (last_id, CANDIDATE_PAGE_SIZE)).fetchall()
+            if not rows:
+                return
+            self._conn.executemany(
+                "UPDATE messages SET normalized = ? WHERE id = ?",
+                [(normalize(content), message_id) for message_id, content in rows if content and not content.isascii()],
+            )
+            last_id = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def high_water_mark(self, channel_id):
+        """Return the newest message ID stored without gaps for a channel, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT high_water_mark FROM channel_sync WHERE channel_id = ?", (channel_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def store_messages(self, channel_id, rows, high_water_mark):
+        """Store a batch of (id, author_id, author_name, created_at, content, edited_at, flags) rows.
+
+        The normalized text (see normalize.py) of non-ASCII messages is stored
+        with them, for the full-text index of normalized searches.
+
+        The batch must continue the channel's history without gaps, oldest first;
+        the high-water mark is advanced in the same transaction. With
+        high_water_mark None the rows are stored but the mark stays where it
+        is, for messages fetched past a gap (e.g. a search limited to a date
+        range); they are fetched again when the gap is filled. Rows stored
+        that way while the gap is being filled by someone else (another
+        cursor over the same channel) are covered by a later call with no
+        rows that just moves the mark past them.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                # An upsert (not INSERT OR REPLACE) so the update trigger keeps the full-text index in sync
+                "INSERT INTO messages "
+                "(id, channel_id, author_id, author_name, created_at, content, edited_at, flags, normalized) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET author_id = excluded.author_id, author_name = excluded.author_name, "
+                "created_at = excluded.created_at, content = excluded.content, edited_at = excluded.edited_at, "
+                "flags = excluded.flags, normalized = excluded.normalized",
+                [(row[0], channel_id, *row[1:7], None if not row[4] or row[4].isascii() else normalize(row[4]))
+                 for row in rows],
+            )
+            if high_water_mark is None:
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO channel_sync (channel_id, high_water_mark, synced_at) "
+                "VALUES (?, ?, strftime('%s', 'now'))",
+                (channel_id, high_water_mark),
+            )
+
+    def count_messages(self, channel_id, max_id=None, min_id=None):
+        """Return how many messages are stored for a channel, after min_id and up to max_id."""
+        min_id = min_id if min_id is not None else 0
+        max_id = max_id if max_id is not None else (1 << 63) - 1
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE channel_id = ? AND id > ? AND id <= ?", (channel_id, min_id, max_id)
+            ).fetchone()
+        return row[0]
+
+    def candidate_messages(self, channel_id, keywords, max_id=None, min_id=None, author_ids=None, has_mask=0,
+                           normalized=False, limit=None):
+        """Return stored rows of a channel that may contain any of the keywords, oldest first.
+
+        Rows are (id, author_id, author_name, created_at, content, edited_at,
+        flags), limited to IDs after min_id and up to max_id, and to the given
+        authors and rows whose flags include has_mask. The trigram index
+        narrows the rows down when every keyword is long enough for it; callers
+        still run the exact matcher over the returned content. Without keywords
+        every stored row is returned. With normalized, the keywords are
+        normalized forms and are looked up in the normalized text.
+
+        With a limit, only the oldest limit rows are returned; the next page
+        starts after the last row's ID (min_id).
+        """
+        min_id = min_id if min_id is not None else 0
+        max_id = max_id if max_id is not None else (1 << 63) - 1
+        use_fts = self.has_fts and keywords and all(len(keyword) >= FTS_MIN_TERM_LENGTH for keyword in keywords)
+        sql = ("SELECT id, author_id, author_name, created_at, content, edited_at, flags FROM messages "
+               "WHERE channel_id = ? AND id > ? AND id <= ? ")
+        params = [channel_id, min_id, max_id]
+        if author_ids:
+            sql += f"AND author_id IN ({', '.join('?' * len(author_ids))}) "
+            params.extend(author_ids)
+        if has_mask:
+            sql += "AND flags & ? = ? "
+            params.extend((has_mask, has_mask))
+        if use_fts:
+            query = " OR ".join('"' + keyword.replace('"', '""') + '"' for keyword in keywords)
+            if normalized:
+                sql += ("AND (id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?) "
+                        "OR id IN (SELECT rowid FROM messages_norm_fts WHERE messages_norm_fts MATCH ?)) ")
+                params.extend((query, query))
+            else:
+                sql += "AND id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?) "
+                params.append(query)
+        sql += "ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def delete_messages(self, message_ids):
+        """Remove deleted messages from the index."""
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM messages WHERE id = ?", [(message_id,) for message_id in message_ids])
+
+    def clear_channels(self, channel_ids):
+        """Forget the stored messages of channels so the next search fetches their history again."""
+        params = [(channel_id,) for channel_id in channel_ids]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM messages WHERE channel_id = ?", params)
+            self._conn.executemany("DELETE FROM channel_sync WHERE channel_id = ?", params)
+
+    def create_search(self, guild_id, owner_id, params):
+        """Register a new search and return its ID.
+
+        Each user keeps only one resumable search per guild, so their older
+        unfinished searches in the same guild are discarded.
+        """
+        with self._lock, self._conn:
+            self._discard_searches(guild_id, owner_id)
+            cursor = self._conn.execute(
+                "INSERT INTO searches (guild_id, owner_id, params, started_at) VALUES (?, ?, ?, ?)",
+                (guild_id, owner_id, json.dumps(params), time.time()),
+            )
+            return cursor.lastrowid
+
+    def save_checkpoint(self, search_id, channel_id, last_message_id, scanned, new_result_ids, done=False):
+        """Record how far a channel has been scanned and the matches found since the last checkpoint.
+
+        Every message up to last_message_id must already be stored in the index,
+        so the recorded matches can be restored from it.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_checkpoints "
+                "(search_id, channel_id, last_message_id, scanned, done, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (search_id, channel_id, last_message_id, scanned, int(done), time.time()),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO checkpoint_results (search_id, channel_id, message_id) VALUES (?, ?, ?)",
+                [(search_id, channel_id, message_id) for message_id in new_result_ids],
+            )
+
+    def load_search(self, guild_id, owner_id):
+        """Return the user's interrupted search in a guild, or None.
+
+        The result is {"search_id", "params", "channels"}, where channels maps
+        channel IDs to {"last_message_id", "scanned", "done"}.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT search_id, params FROM searches WHERE guild_id = ? AND owner_id IS ? "
+                "ORDER BY search_id DESC LIMIT 1",
+                (guild_id, owner_id),
+            ).fetchone()
+            if not row:
+                return None
+            search_id, params = row
+            channels = {
+                channel_id: {"last_message_id": last_message_id, "scanned": scanned, "done": bool(done)}
+                for channel_id, last_message_id, scanned, done in self._conn.execute(
+                    "SELECT channel_id, last_message_id, scanned, done FROM search_checkpoints WHERE search_id = ?",
+                    (search_id,),
+                )
+            }
+        return {"search_id": search_id, "params": json.loads(params), "channels": channels}
+
+    def checkpoint_results(self, search_id, channel_id):
+        """Return the stored rows of a channel's checkpointed matches, oldest first."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT m.id, m.author_id, m.author_name, m.created_at, m.content, m.edited_at, m.flags "
+                "FROM checkpoint_results r JOIN messages m ON m.id = r.message_id "
+                "WHERE r.search_id = ? AND r.channel_id = ? ORDER BY m.id",
+                (search_id, channel_id),
+            ).fetchall()
+
+    def finish_search(self, search_id):
+        """Drop a completed search and its checkpoints."""
+        with self._lock, self._conn:
+            for table in ("searches", "search_checkpoints", "checkpoint_results"):
+                self._conn.execute(f"DELETE FROM {table} WHERE search_id = ?", (search_id,))
+
+    def _discard_searches(self, guild_id, owner_id):
+        """Drop every search of a user in a guild. The caller holds the lock and the transaction."""
+        search_ids = [row[0] for row in self._conn.execute(
+            "SELECT search_id FROM searches WHERE guild_id = ? AND owner_id IS ?", (guild_id, owner_id)
+        )]
+        for search_id in search_ids:
+            for table in ("searches", "search_checkpoints", "checkpoint_results"):
+                self._conn.execute(f"DELETE FROM {table} WHERE search_id = ?", (search_id,))
@@ -0,0 +1,366 @@
+"""Metrics: counters, gauges and histograms for the bot's hot paths.
+
+Scans, Discord API requests, rate limits, matching, deletions and UI redraws
+record into one registry. !stats summarizes it, and when ChatScrub runs with
+--metrics-port it is also served in the Prometheus text format on localhost.
+
+Metrics are recorded from the bot's event loop, the Tk thread and worker
+threads, so every metric locks its values.
+"""
+
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds
+REDRAW_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """A named metric with one value per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def _matching(self, labels):
+        """Return the label keys whose values agree with the given (possibly partial) labels."""
+        wanted = [(self.labelnames.index(name), str(value)) for name, value in labels.items()]
+        return [key for key in self._values if all(key[index] == value for index, value in wanted)]
+
+    def samples(self):
+        """Return {label values: value}."""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.samples().items()):
+            lines.append(f"{self.name}{self._labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """A value that only goes up (events, totals)."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self, **labels):
+        """Return the sum over every label set that agrees with the given labels."""
+        with self._lock:
+            return sum(self._values[key] for key in self._matching(labels))
+
+
+class Gauge(_Metric):
+    """A value that is set to the current state (rates, sizes)."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def remove(self, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values.pop(key, None)
+
+    def value(self, default=None, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), default)
+
+
+class Histogram(_Metric):
+    """Observations counted into buckets, e.g. latencies."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]  # Bucket counts, sum, count
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds the with block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def summary(self, **labels):
+        """Return (count, mean, approximate 95th percentile) over the label sets that agree with the labels."""
+        with self._lock:
+            states = [self._values[key] for key in self._matching(labels)]
+            counts = [sum(state[0][index] for state in states) for index in range(len(self.buckets))]
+            total = sum(state[1] for state in states)
+            count = sum(state[2] for state in states)
+        if not count:
+            return 0, 0.0, 0.0
+        return count, total / count, self._quantile(counts, count, 0.95)
+
+    def _quantile(self, counts, count, q):
+        """Estimate a quantile by interpolating inside the bucket it falls in."""
+        rank = q * count
+        seen = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets, counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+            lower = bound if bound != float("inf") else lower
+        return lower
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self.samples().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._labels(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+    def samples(self):
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+
+
+class MetricsRegistry:
+    """The metrics of the process, in the order they were registered."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Scanning
+messages_scanned = registry.counter(
+    "chatscrub_messages_scanned_total", "Messages checked against the keywords", ["source"])
+matches_found = registry.counter(
+    "chatscrub_matches_total", "Messages that matched a keyword", ["source"])
+exclusion_hits = registry.counter(
+    "chatscrub_exclusion_hits_total", "Keyword hits dropped by the keyword's exclusion list", ["source"])
+channel_scan_rate = registry.gauge(
+    "chatscrub_channel_scan_rate", "Messages per second fetched from each channel being scanned", ["guild", "channel"])
+scan_step_seconds = registry.histogram(
+    "chatscrub_scan_step_seconds", "Time a scan waits for matching and for index writes", ["step"])
+
+# Discord API
+api_request_seconds = registry.histogram(
+    "chatscrub_api_request_seconds", "Discord API request latency", ["method", "route"])
+api_responses = registry.counter(
+    "chatscrub_api_responses_total", "Discord API responses by status", ["method", "route", "status"])
+rate_limits = registry.counter(
+    "chatscrub_rate_limits_total", "429 responses from Discord", ["route", "action"])
+rate_limit_retry_after = registry.counter(
+    "chatscrub_rate_limit_retry_after_seconds_total", "Seconds spent waiting out 429 responses", ["route"])
+global_rate_limits = registry.counter(
+    "chatscrub_global_rate_limits_total", "Global rate limits hit")
+
+# Deletion
+messages_deleted = registry.counter(
+    "chatscrub_messages_deleted_total", "Messages handled by deletions", ["result"])
+deletion_rate = registry.gauge(
+    "chatscrub_deletion_rate", "Messages per second deleted by the last finished deletion")
+
+# UI
+ui_redraw_seconds = registry.histogram(
+    "chatscrub_ui_redraw_seconds", "Time to redraw part of the window", ["view"], buckets=REDRAW_BUCKETS)
+
+
+_SNOWFLAKE = re.compile(r"/\d{15,}")
+_API_PREFIX = re.compile(r"^https?://[^/]+(/api/v\d+)?")
+
+
+def route_label(url):
+    """Return the path of an API URL with IDs replaced, so all channels share one label."""
+    path = _API_PREFIX.sub("", str(url).split("?", 1)[0])
+    return _SNOWFLAKE.sub("/{id}", path) or "/"
+
+
+def http_trace():
+    """Return an aiohttp TraceConfig that times every request of the bot's HTTP session."""
+    import aiohttp
+
+    async def on_request_start(session, context, params):
+        context.start = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        route = route_label(params.url)
+        api_request_seconds.observe(time.perf_counter() - context.start, method=params.method, route=route)
+        api_responses.inc(method=params.method, route=route, status=params.response.status)
+
+    async def on_request_exception(session, context, params):
+        api_responses.inc(method=params.method, route=route_label(params.url), status="error")
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    trace.on_request_exception.append(on_request_exception)
+    return trace
+
+
+class RateLimitLogHandler(logging.Handler):
+    """Counts the 429 responses discord.py reports through the discord.http logger."""
+
+    def emit(self, record):
+        message = record.msg if isinstance(record.msg, str) else ""
+        if message.startswith("We are being rate limited.") and len(record.args or ()) == 3:
+            _, url, retry_after = record.args
+            route = route_label(url)
+            if "erroring instead" in message:
+                rate_limits.inc(route=route, action="raised")
+            else:
+                rate_limits.inc(route=route, action="retried")
+                rate_limit_retry_after.inc(retry_after, route=route)
+        elif message.startswith("Global rate limit has been hit"):
+            global_rate_limits.inc()
+
+
+def watch_rate_limits():
+    """Start counting rate limits from discord.py's log (warnings are logged whatever the log setup)."""
+    logger = logging.getLogger("discord.http")
+    if not any(isinstance(handler, RateLimitLogHandler) for handler in logger.handlers):
+        logger.addHandler(RateLimitLogHandler(logging.WARNING))
+
+
+def serve(port, host="127.0.0.1"):
+    """Serve the registry at http://host:port/metrics from a daemon thread; returns the server."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes every few seconds would flood the console
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def stats_lines(guild_id=None):
+    """Summarize the metrics for !stats; per-channel scan rates only for the given guild."""
+    lines = [
+        "**Scanning**",
+        f"Messages scanned: {messages_scanned.total(source='fetch'):,} fetched, "
+        f"{messages_scanned.total(source='index'):,} from the index, {messages_scanned.total(source='archive'):,} from archives",
+        f"Matches: {matches_found.total():,}; keyword hits excluded: {exclusion_hits.total():,}",
+    ]
+    rates = [(key[1], rate) for key, rate in channel_scan_rate.samples().items()
+             if guild_id is None or key[0] == str(guild_id)]
+    if rates:
+        lines.append("Scanning now: " + ", ".join(f"#{channel} {rate:,.0f} msg/s" for channel, rate in sorted(rates)))
+    for step in ("match", "index"):
+        count, mean, p95 = scan_step_seconds.summary(step=step)
+        if count:
+            lines.append(f"Waiting for {step}: {count:,} batches, mean {mean * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms")
+
+    lines.append("**Discord API**")
+    count, mean, p95 = api_request_seconds.summary()
+    lines.append(f"Requests: {count:,}, mean {mean * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms")
+    routes = {}
+    for (method, route), (_, _, route_count) in api_request_seconds.samples().items():
+        routes[(method, route)] = route_count
+    for (method, route), _ in sorted(routes.items(), key=lambda item: -item[1])[:5]:
+        route_count, route_mean, route_p95 = api_request_seconds.summary(method=method, route=route)
+        lines.append(f"  {method} {route}: {route_count:,}, mean {route_mean * 1000:.0f} ms, p95 {route_p95 * 1000:.0f} ms")
+    lines.append(f"Rate limits: {rate_limits.total():,} (global {global_rate_limits.total():,}), "
+                 f"{rate_limit_retry_after.total():.1f} s waited")
+
+    lines.append("**Deletion**")
+    last_rate = deletion_rate.value()
+    lines.append(f"Deleted: {messages_deleted.total(result='deleted'):,}, failed: {messages_deleted.total(result='failed'):,}"
+                 + (f"; last deletion {last_rate:,.1f} msg/s" if last_rate is not None else ""))
+
+    lines.append("**Window**")
+    for view in ("page", "matches", "progress"):
+        count, mean, p95 = ui_redraw_seconds.summary(view=view)
+        if count:
+            lines.append(f"{view.capitalize()} redraws: {count:,}, mean {mean * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms")
+    if not any(ui_redraw_seconds.samples()):
+        lines.append("No redraws (headless)")
+    return lines
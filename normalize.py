@@ -0,0 +1,121 @@
+"""Unicode normalization for keyword matching.
+
+Plain lowercasing misses messages written to dodge a keyword: fullwidth or
+mathematical letters, zero-width characters between letters, accents and
+zalgo marks, or Cyrillic and Greek letters that look like Latin ones. With
+normalization on, keywords, exclusion words and messages are all folded the
+same way before matching:
+
+- compatibility decomposition (NFKD), so 𝐛𝐚𝐝, ｂａｄ and ⓑⓐⓓ become bad
+- full case folding (casefold), so ß matches ss
+- combining marks are dropped, so é, e + U+0301 and zalgo text become plain letters
+- format and invisible characters (zero-width spaces and joiners, soft hyphens,
+  bidi controls, tag characters, Hangul fillers) are dropped
+- common lookalike letters are folded into the Latin letter they imitate
+
+Every step works on one character at a time, so each character of the
+normalized text comes from exactly one character of the original and match
+positions can be mapped back for highlighting.
+
+Texts that are plain ASCII only need lowercasing. Searches normalize
+messages in the match workers (see match_pool.py), and the message index
+stores the normalized text of the others for its full-text index.
+"""
+
+import unicodedata
+
+# Characters that render as nothing but aren't format characters (Cf)
+INVISIBLE = "\u115f\u1160\u3164\uffa0"
+
+# Lookalikes (after case folding) of Latin letters, mostly Cyrillic and Greek
+CONFUSABLES = {
+    # Cyrillic
+    "\u0430": "a", "\u0432": "b", "\u0501": "d", "\u0435": "e", "\u04bb": "h", "\u043d": "h", "\u0456": "i", "\u0458": "j",
+    "\u043a": "k", "\u04cf": "l", "\u043c": "m", "\u043e": "o", "\u0440": "p", "\u051b": "q", "\u0455": "s", "\u0442": "t",
+    "\u0443": "y", "\u04af": "y", "\u051d": "w", "\u0445": "x",
+    # Greek
+    "\u03b1": "a", "\u03b5": "e", "\u03b9": "i", "\u03f3": "j", "\u03ba": "k", "\u03bf": "o", "\u03c1": "p", "\u03f2": "c",
+    "\u03c4": "t", "\u03c5": "u", "\u03c7": "x", "\u03b6": "z",
+    # Latin letters with strokes, which have no decomposition to drop the mark from
+    "\u0131": "i", "\u0269": "i", "\u0268": "i", "\u0251": "a", "\u0261": "g", "\u00f8": "o", "\u0111": "d", "\u0142": "l",
+    "\u0127": "h", "\u0167": "t", "\u0180": "b", "\u0289": "u",
+}
+
+# Code points checked when building the translation table: the first two planes
+# plus tags and variation selectors, which is every dropped character in use
+_TABLE_RANGES = ((0, 0x20000), (0xE0000, 0xE1000))
+
+_table = None
+_folded_chars = {}
+
+
+def _translation_table():
+    """Return the str.translate table that drops marks and invisible characters and folds lookalikes."""
+    global _table
+    if _table is None:
+        table = {}
+        for start, stop in _TABLE_RANGES:
+            for code_point in range(start, stop):
+                ch = chr(code_point)
+                if (unicodedata.combining(ch) or unicodedata.category(ch) in ("Mn", "Me", "Cf")
+                        or ch in INVISIBLE):
+                    table[code_point] = None
+        table.update((ord(lookalike), latin) for lookalike, latin in CONFUSABLES.items())
+        _table = table
+    return _table
+
+
+def normalize(text):
+    """Return the text folded for matching."""
+    if text.isascii():
+        return text.lower()
+    return unicodedata.normalize("NFKD", text).casefold().translate(_translation_table())
+
+
+def _fold_char(ch):
+    folded = _folded_chars.get(ch)
+    if folded is None:
+        folded = _folded_chars[ch] = unicodedata.normalize("NFKD", ch).casefold().translate(_translation_table())
+    return folded
+
+
+def normalize_with_offsets(text):
+    """Return (normalized text, offsets): offsets[i] is the index in text of the character normalized character i came from.
+
+    A span (start, end) of the normalized text covers text[offsets[start]:offsets[end - 1] + 1].
+    """
+    if text.isascii():
+        return text.lower(), range(len(text))
+    parts = []
+    offsets = []
+    for index, ch in enumerate(text):
+        folded = _fold_char(ch)
+        if folded:
+            parts.append(folded)
+            offsets.extend([index] * len(folded))
+    return "".join(parts), offsets
+
+
+def original_span(offsets, start, end):
+    """Map a span of the normalized text back to the original text."""
+    return offsets[start], offsets[end - 1] + 1
+
+
+def original_spans(text, spans, normalized=False):
+    """Map flat (start, end, ...) spans found in the matched form of text back to text itself.
+
+    The matched form is the normalized text, or else the lowercased one;
+    lowercasing can change the length too (\u0130 becomes two characters).
+    """
+    if text.isascii():
+        return spans
+    if normalized:
+        offsets = normalize_with_offsets(text)[1]
+    elif len(text.lower()) != len(text):
+        offsets = [index for index, ch in enumerate(text) for _ in ch.lower()]
+    else:
+        return spans
+    mapped = []
+    for index in range(0, len(spans), 2):
+        mapped.extend(original_span(offsets, spans[index], spans[index + 1]))
+    return tuple(mapped)
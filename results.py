@@ -0,0 +1,454 @@
+"""Compact, disk-backed storage for search results."""
+
+import mmap
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+
+import discord
+
+
+class MatchRecord:
+    """A matched message, reduced to the fields the results view and deletion need.
+
+    Holding a full discord.Message per match keeps its author, member, embeds
+    and attachment objects alive; a record keeps only IDs, names and content.
+    The timestamp is derived from the message ID (a snowflake) and the display
+    text is formatted only when a row is drawn.
+
+    spans are where the keywords are in the content, flat (start, end, ...),
+    as found while matching; the results view highlights them from there.
+    keyword_ids are the keywords that made the message match, as IDs into
+    the search session's keyword_names.
+    """
+
+    __slots__ = ("id", "channel_id", "channel_name", "author_id", "author_name", "content", "spans", "keyword_ids")
+
+    def __init__(self, id, channel_id, channel_name, author_id, author_name, content, spans=(), keyword_ids=()):
+        self.id = id
+        self.channel_id = channel_id
+        self.channel_name = channel_name
+        self.author_id = author_id
+        # Most authors appear many times in a result set; share one string per name
+        self.author_name = sys.intern(author_name) if author_name else ""
+        self.content = content
+        self.spans = spans
+        self.keyword_ids = keyword_ids
+
+    @classmethod
+    def from_message(cls, message, spans=(), keyword_ids=()):
+        """Build a record from a discord.Message."""
+        return cls(message.id, message.channel.id, message.channel.name,
+                   message.author.id, str(message.author), message.content, spans, keyword_ids)
+
+    @classmethod
+    def from_row(cls, channel, row, spans=(), keyword_ids=()):
+        """Build a record from a message index row (id, author_id, author_name, created_at, content, ...)."""
+        message_id, author_id, author_name, _, content = row[:5]
+        return cls(message_id, channel.id, channel.name, author_id, author_name, content, spans, keyword_ids)
+
+    @property
+    def created_at(self):
+        return discord.utils.snowflake_time(self.id)
+
+    def display_text(self):
+        """Format the record for the results list."""
+        return f"[{self.channel_name}] {self.author_name}: {self.content} ({self.created_at.strftime('%Y-%m-%d %H:%M:%S')})"
+
+    def display_spans(self):
+        """Return the keyword spans as offsets into display_text()."""
+        prefix = len(self.channel_name) + len(self.author_name) + 5  # "[", "] " and ": " before the content
+        return [offset + prefix for offset in self.spans]
+
+    def partial_message(self, client):
+        """Return a lightweight handle to the message that can be used to delete it."""
+        return partial_message(client, self.channel_id, self.id)
+
+
+def partial_message(client, channel_id, message_id):
+    """Return a handle to a message that can be used to delete it, knowing only its IDs."""
+    channel = client.get_channel(channel_id) or client.get_partial_messageable(channel_id)
+    return channel.get_partial_message(message_id)
+
+
+def positions_mask(positions):
+    """Return an int with the bit of each of the store positions set."""
+    if not positions:
+        return 0
+    bits = bytearray((max(positions) >> 3) + 1)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, "little")
+
+
+class _KeyPositions:
+    """Store positions of the records of one channel or author, and a mask of them (see positions_mask).
+
+    Positions are appended as records are added; the mask takes in the new
+    ones when it is next asked for, so a lookup only touches what was added
+    since the last one and only the channels and authors looked up keep a mask.
+    """
+
+    __slots__ = ("positions", "_mask", "_masked")
+
+    def __init__(self):
+        self.positions = array("Q")
+        self._mask = 0
+        self._masked = 0  # Positions already in the mask
+
+    def mask(self):
+        if self._masked < len(self.positions):
+            self._mask |= positions_mask(self.positions[self._masked:])
+            self._masked = len(self.positions)
+        return self._mask
+
+
+# Spilled records: id, channel_id, author_id, then the byte lengths of the
+# channel name, author name and content and the numbers of span offsets and
+# keyword IDs, followed by those UTF-8 strings, the offsets as 32-bit
+# integers and the keyword IDs as 16-bit integers
+_RECORD_HEADER = struct.Struct("<QQQHHIHH")
+MAX_SPILLED_SPANS = 0xFFFE  # Span offsets kept per spilled record; an even number, so spans stay whole
+DEFAULT_HOT_CAPACITY = 20000  # Records kept in memory before older ones spill to disk
+
+
+def _encode_record(record):
+    channel_name = record.channel_name.encode("utf-8", "surrogatepass")
+    author_name = record.author_name.encode("utf-8", "surrogatepass")
+    content = record.content.encode("utf-8", "surrogatepass")
+    spans = array("I", record.spans[:MAX_SPILLED_SPANS])
+    keyword_ids = array("H", record.keyword_ids)
+    header = _RECORD_HEADER.pack(record.id, record.channel_id, record.author_id or 0,
+                                 len(channel_name), len(author_name), len(content), len(spans), len(keyword_ids))
+    return header + channel_name + author_name + content + spans.tobytes() + keyword_ids.tobytes()
+
+
+def _decode_record(data, offset):
+    (message_id, channel_id, author_id, channel_len, author_len, content_len,
+     span_count, keyword_count) = _RECORD_HEADER.unpack_from(data, offset)
+    offset += _RECORD_HEADER.size
+    channel_name = data[offset:offset + channel_len].decode("utf-8", "surrogatepass")
+    offset += channel_len
+    author_name = data[offset:offset + author_len].decode("utf-8", "surrogatepass")
+    offset += author_len
+    content = data[offset:offset + content_len].decode("utf-8", "surrogatepass")
+    offset += content_len
+    spans = tuple(array("I", data[offset:offset + 4 * span_count]))
+    offset += 4 * span_count
+    keyword_ids = tuple(array("H", data[offset:offset + 2 * keyword_count]))
+    return MatchRecord(message_id, channel_id, channel_name, author_id, author_name, content, spans, keyword_ids)
+
+
+class ResultStore:
+    """Append-only store of MatchRecords that spills older records to disk.
+
+    The newest records stay in memory (the hot window). When the window grows
+    past twice its capacity, its older half is appended to a temporary file
+    and read back through a memory map, so the number of results is limited
+    by disk space rather than RAM. Records are addressed by their position
+    in the order they were added.
+
+    The bot thread appends while the UI thread reads, so access is locked.
+    """
+
+    def __init__(self, hot_capacity=DEFAULT_HOT_CAPACITY, spill_dir=None):
+        self.hot_capacity = max(1, hot_capacity)
+        self.spill_dir = spill_dir
+        self._lock = threading.Lock()
+        self._hot = []
+        self._ids = array("Q")  # Message ID per position, for lookups that don't need the record
+        self._channel_ids = array("Q")
+        self._author_ids = array("Q")
+        self._by_channel = {}  # _KeyPositions per channel ID
+        self._by_author = {}  # _KeyPositions per author ID (0 for none)
+        self._offsets = array("Q")  # File offset per spilled position
+        self._file = None
+        self._file_size = 0
+        self._map = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def append(self, record):
+        """Add a record and return its position."""
+        with self._lock:
+            self._hot.append(record)
+            self._ids.append(record.id)
+            self._channel_ids.append(record.channel_id)
+            self._author_ids.append(record.author_id or 0)
+            position = len(self._ids) - 1
+            self._key_positions(self._by_channel, record.channel_id).positions.append(position)
+            self._key_positions(self._by_author, record.author_id or 0).positions.append(position)
+            if len(self._hot) >= 2 * self.hot_capacity:
+                self._spill(len(self._hot) - self.hot_capacity)
+            return position
+
+    @staticmethod
+    def _key_positions(by_key, key):
+        key_positions = by_key.get(key)
+        if key_positions is None:
+            key_positions = by_key[key] = _KeyPositions()
+        return key_positions
+
+    def _spill(self, count):
+        """Move the oldest count records of the hot window to the spill file."""
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix="chatscrub-results-", dir=self.spill_dir)
+        chunks = []
+        offset = self._file_size
+        for record in self._hot[:count]:
+            data = _encode_record(record)
+            self._offsets.append(offset)
+            offset += len(data)
+            chunks.append(data)
+        self._file.seek(self._file_size)
+        self._file.write(b"".join(chunks))
+        self._file.flush()
+        self._file_size = offset
+        del self._hot[:count]
+
+    def _mapped(self):
+        """Return a memory map that covers the whole spill file."""
+        if self._map is None or len(self._map) < self._file_size:
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self._ids)
+        with self._lock:
+            spilled = len(self._offsets)
+            if position >= spilled:
+                return self._hot[position - spilled]
+            return _decode_record(self._mapped(), self._offsets[position])
+
+    def id_at(self, position):
+        """Return the message ID at a position without loading the record."""
+        return self._ids[position]
+
+    def channel_id_at(self, position):
+        return self._channel_ids[position]
+
+    def mask_where(self, channel_id=None, author_id=None):
+        """Return a mask (see positions_mask) of the positions of a channel's and/or an author's records."""
+        with self._lock:
+            mask = (1 << len(self._ids)) - 1
+            for by_key, key in ((self._by_channel, channel_id), (self._by_author, author_id)):
+                if key is not None:
+                    key_positions = by_key.get(key)
+                    mask &= key_positions.mask() if key_positions is not None else 0
+            return mask
+
+    def close(self):
+        """Release the spill file."""
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class Tombstones:
+    """Removed slots of a ResultView: a bitset, plus a Fenwick tree of the removals.
+
+    The tree counts removed slots per power-of-two block, so the slot of the
+    nth remaining result is found in O(log n) without renumbering anything.
+    Slots past the tree's capacity were never removed.
+    """
+
+    def __init__(self):
+        self._bits = bytearray()
+        self._tree = array("L", [0])  # 1-based; its capacity is always a power of two (or 0)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, slot):
+        byte = slot >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] >> (slot & 7) & 1)
+
+    @property
+    def capacity(self):
+        return len(self._tree) - 1
+
+    def add(self, slot):
+        """Mark a slot removed; returns False if it already was."""
+        if slot in self:
+            return False
+        if slot >= self.capacity:
+            self._grow(slot)
+        self._bits[slot >> 3] |= 1 << (slot & 7)
+        tree = self._tree
+        index = slot + 1
+        while index < len(tree):
+            tree[index] += 1
+            index += index & -index
+        self._count += 1
+        return True
+
+    def _grow(self, slot):
+        """Rebuild the tree with room for slot, in O(capacity)."""
+        capacity = max(64, self.capacity)
+        while capacity <= slot:
+            capacity *= 2
+        self._bits.extend(bytes(capacity // 8 - len(self._bits)))
+        tree = array("L", [0]) * (capacity + 1)
+        for index in range(1, capacity + 1):
+            tree[index] += self._bits[(index - 1) >> 3] >> ((index - 1) & 7) & 1
+            parent = index + (index & -index)
+            if parent <= capacity:
+                tree[parent] += tree[index]
+        self._tree = tree
+
+    def slot(self, index):
+        """Return the slot of the remaining result at index (0-based)."""
+        if not self._count:
+            return index
+        tree = self._tree
+        capacity = self.capacity
+        slot = 0
+        remaining = index + 1
+        step = capacity
+        while step:
+            block = slot + step
+            if block <= capacity and step - tree[block] < remaining:
+                slot = block
+                remaining -= step - tree[block]
+            step >>= 1
+        return slot if slot < capacity else capacity + remaining - 1
+
+    def mask(self):
+        """Return the removed slots as an int with one bit per slot."""
+        return int.from_bytes(self._bits, "little")
+
+
+COMPACT_MIN_REMOVED = 1024  # Removed results a view with positions keeps before compacting
+COMPACT_RATIO = 0.25  # ... once they are also this fraction of its slots
+
+
+class ResultView:
+    """An ordered sequence of records from a ResultStore.
+
+    Without positions the view follows the store as it grows, in the order
+    records were added. With positions it shows exactly those store positions,
+    in that order, without copying any records.
+
+    Removing results (e.g. after they were deleted) only tombstones their
+    slots, so it costs O(log n) per result however large the view is;
+    indexes skip the tombstones through a Fenwick tree, and a page is one
+    tree lookup plus a walk over its slots. A view with positions drops its
+    tombstones once they pile up (compaction); a view following the store
+    keeps them, since its slots are the store's positions.
+    """
+
+    def __init__(self, store, positions=None):
+        self.store = store
+        self.positions = positions
+        self._removed = Tombstones()
+        self._slots = None  # Slot per store position, to remove from a view with positions
+        self._mask = None
+        self._lock = threading.Lock()  # The UI thread removes results while snapshot() runs on the bot's
+
+    def __len__(self):
+        size = len(self.store) if self.positions is None else len(self.positions)
+        return size - len(self._removed)
+
+    def store_position(self, index):
+        """Return the store position of the result at an index of the view."""
+        slot = self._removed.slot(index)
+        return slot if self.positions is None else self.positions[slot]
+
+    def _store_positions(self, start, stop):
+        """Yield the store positions of the results from start to stop, in view order."""
+        stop = min(stop, len(self))
+        if stop <= start:
+            return
+        removed = self._removed
+        positions = self.positions
+        slot = removed.slot(start)
+        for _ in range(stop - start):
+            while slot in removed:
+                slot += 1
+            yield slot if positions is None else positions[slot]
+            slot += 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return [self.store[position] for position in self._store_positions(start, stop)]
+            return [self.store[self.store_position(i)] for i in range(start, stop, step)]
+        if index < 0:
+            index += len(self)
+        return self.store[self.store_position(index)]
+
+    def __iter__(self):
+        for position in self._store_positions(0, len(self)):
+            yield self.store[position]
+
+    def ids(self, start, stop):
+        """Return the message IDs from start to stop without loading the records."""
+        return [self.store.id_at(position) for position in self._store_positions(start, stop)]
+
+    def mask(self, start=0, stop=None):
+        """Return a mask (see positions_mask) of the store positions of the results from start to stop."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        if stop <= start:
+            return 0
+        if self.positions is None:
+            first, last = self.store_position(start), self.store_position(stop - 1)
+            mask = ((1 << (last + 1 - first)) - 1) << first
+            return mask & ~self._removed.mask() if self._removed else mask
+        if start == 0 and stop == len(self):
+            # Kept until results are removed from the view
+            if self._mask is None:
+                self._mask = positions_mask(list(self._store_positions(0, stop)))
+            return self._mask
+        return positions_mask(list(self._store_positions(start, stop)))
+
+    def remove(self, positions):
+        """Remove the results at the given store positions (e.g. after they were deleted)."""
+        with self._lock:
+            self._remove(positions)
+
+    def _remove(self, positions):
+        if self.positions is not None and self._slots is None:
+            self._slots = array("q", [-1]) * len(self.store)
+            for slot, position in enumerate(self.positions):
+                self._slots[position] = slot
+        slots = self._slots
+        size = len(self.store) if slots is None else len(slots)
+        removed = 0
+        for position in positions:
+            if position >= size:
+                continue
+            slot = position if slots is None else slots[position]
+            if slot >= 0:
+                removed += self._removed.add(slot)
+        if removed:
+            self._mask = None
+            if self.positions is not None and len(self._removed) >= max(COMPACT_MIN_REMOVED,
+                                                                         COMPACT_RATIO * len(self.positions)):
+                self._compact()
+
+    def compact(self):
+        """Drop the tombstones of a view with positions, in O(n)."""
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        self.positions = array("Q", self._store_positions(0, len(self)))
+        self._removed = Tombstones()
+        self._slots = None
+
+    def snapshot(self):
+        """Return a view of the current results that later removals don't change, e.g. to read from another thread."""
+        with self._lock:
+            return ResultView(self.store, array("Q", self._store_positions(0, len(self))))
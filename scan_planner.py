@@ -0,0 +1,101 @@
+"""Splitting one channel's history into snowflake ranges for several cursors.
+
+Discord returns a channel's history one page of 100 messages at a time, so a
+single oldest-first cursor over a channel with millions of messages sets the
+wall-clock time of the whole search. Message IDs are snowflakes, which grow
+with the time a message was sent, so the history between two IDs can be cut
+into time ranges and each range read by its own cursor with after= and
+before= bounds.
+
+Every range costs at least one request, even if nobody wrote anything in
+it, so small channels must not be split. The planner looks at the first page
+of the history (which is fetched anyway): if it isn't full, that page is the
+whole history; otherwise how much time those messages span gives an estimate
+of how many messages the rest of the history holds, and the channel is only
+split when every range would still hold many pages. There are more ranges
+than cursors, so a cursor that finishes a quiet range takes the next one
+while others are still busy with active ones.
+"""
+
+from array import array
+from datetime import timedelta
+
+import discord
+
+from jobs import HISTORY_PAGE_SIZE
+
+RANGES_PER_CURSOR = 4
+MIN_RANGE_MESSAGES = 2000  # Estimated messages a range must hold to be worth its own cursor
+CLOCK_SKEW = timedelta(minutes=1)  # How far our clock may be ahead of Discord's
+
+
+class FetchRange:
+    """A part of a channel's history, from after_id to before_id (both exclusive; None for no bound).
+
+    Holds what the scan has fetched from the range but not yet recorded:
+    the positions of its matches in the result store, the rows waiting to be
+    written to the index and the matches waiting for a checkpoint.
+    """
+
+    def __init__(self, after_id, before_id, prefetched=(), exhausted=False, closed=True):
+        self.after_id = after_id
+        self.before_id = before_id
+        self.prefetched = list(prefetched)  # Messages of the range already fetched by the planner
+        self.exhausted = exhausted  # Whether the prefetched messages are all there is
+        self.closed = closed  # Whether before_id is in the past, so no new messages can appear in the range
+        self.positions = array("Q")
+        self.pending_rows = []
+        self.pending_match_ids = []
+        self.scanned = 0
+        self.last_message_id = None  # Newest message of the range written to the index
+        self.done = False
+
+    def __repr__(self):
+        return f"<FetchRange {self.after_id}..{self.before_id}>"
+
+    @property
+    def fetch_after(self):
+        """ID the range's history request starts after: the end of the prefetched messages, if any."""
+        if self.prefetched:
+            return self.prefetched[-1].id
+        return self.after_id
+
+    @property
+    def boundary(self):
+        """ID up to which the history is complete once the range is done."""
+        if self.closed:
+            return self.before_id - 1
+        return self.last_message_id or self.after_id
+
+
+def estimate_messages(first_page, stop_id):
+    """Estimate how many messages follow a full first page of history, up to stop_id."""
+    first_id, last_id = first_page[0].id, first_page[-1].id
+    return len(first_page) * (stop_id - last_id) // max(1, last_id - first_id)
+
+
+def plan_ranges(after_id, before_id, first_page, cursors):
+    """Split the history from after_id to before_id into FetchRanges, oldest first.
+
+    first_page is the first page of that history, oldest first. It becomes
+    the start of the first range.
+    """
+    now = discord.utils.utcnow()
+    now_id = discord.utils.time_snowflake(now)
+    closed = before_id is not None and before_id < discord.utils.time_snowflake(now - CLOCK_SKEW)
+    if len(first_page) < HISTORY_PAGE_SIZE:
+        return [FetchRange(after_id, before_id, first_page, exhausted=True, closed=closed)]
+    stop_id = min(before_id or now_id, now_id)
+    count = min(cursors * RANGES_PER_CURSOR, estimate_messages(first_page, stop_id) // MIN_RANGE_MESSAGES)
+    if cursors < 2 or count < 2:
+        return [FetchRange(after_id, before_id, first_page, closed=closed)]
+
+    # Even time slices of what follows the first page; each bound is the last ID of one range
+    start_id = first_page[-1].id
+    step = (stop_id - start_id) // count
+    bounds = [start_id + step * index for index in range(1, count)]
+    ranges = [FetchRange(after_id, bounds[0] + 1, first_page)]
+    for lower, upper in zip(bounds, bounds[1:]):
+        ranges.append(FetchRange(lower, upper + 1))
+    ranges.append(FetchRange(bounds[-1], before_id, closed=closed))
+    return ranges
@@ -0,0 +1,212 @@
+"""Filters of a search: date range, authors and message contents (has:).
+
+Date bounds become snowflake IDs, so history outside the range is never
+fetched from Discord or read from the local index. Author and has: filters
+are checked before keyword matching; messages that fail them are never
+matched.
+
+Filters are written as `after:` / `before:` (a date, a date and time, or an
+age such as 7d), `author:` (a mention, user ID or member name) and `has:`
+(link, file, image, video, embed, sticker or mention). Several authors are
+alternatives; several has: filters must all hold.
+"""
+
+import re
+from datetime import datetime, timedelta, timezone
+
+import discord
+
+# What a message contains, stored per message in the local index
+HAS_FILE = 1
+HAS_IMAGE = 2
+HAS_VIDEO = 4
+HAS_EMBED = 8
+HAS_STICKER = 16
+HAS_LINK = 32
+HAS_MENTION = 64
+HAS_FLAGS = {
+    "file": HAS_FILE, "image": HAS_IMAGE, "video": HAS_VIDEO, "embed": HAS_EMBED,
+    "sticker": HAS_STICKER, "link": HAS_LINK, "mention": HAS_MENTION,
+}
+FILTER_PREFIXES = ("after:", "before:", "author:", "has:")
+MAX_SNOWFLAKE = (1 << 63) - 1  # Largest ID the index can store (SQLite integers are signed 64-bit)
+
+_LINK = re.compile(r"https?://", re.IGNORECASE)
+_AGE = re.compile(r"^(\d+)([hdw])$")
+_AGE_UNITS = {"h": "hours", "d": "days", "w": "weeks"}
+_MENTION = re.compile(r"^<@!?(\d+)>$")
+
+
+def message_flags(message):
+    """Return the HAS_* flags of a fetched message."""
+    flags = 0
+    for attachment in message.attachments:
+        flags |= HAS_FILE
+        content_type = attachment.content_type or ""
+        if content_type.startswith("image/"):
+            flags |= HAS_IMAGE
+        elif content_type.startswith("video/"):
+            flags |= HAS_VIDEO
+    for embed in message.embeds:
+        flags |= HAS_EMBED
+        if embed.type == "image":
+            flags |= HAS_IMAGE
+        elif embed.type in ("video", "gifv"):
+            flags |= HAS_VIDEO
+    if message.stickers:
+        flags |= HAS_STICKER
+    if _LINK.search(message.content):
+        flags |= HAS_LINK
+    if message.mentions or message.role_mentions or message.mention_everyone:
+        flags |= HAS_MENTION
+    return flags
+
+
+def parse_time(value, now=None):
+    """Parse a date (2024-05-31), a date and time (2024-05-31T18:00) or an age (12h, 7d, 2w) as UTC."""
+    match = _AGE.match(value.lower())
+    if match:
+        now = now or datetime.now(timezone.utc)
+        try:
+            return now - timedelta(**{_AGE_UNITS[match.group(2)]: int(match.group(1))})
+        except OverflowError:
+            raise ValueError(f"Age out of range: {value}") from None
+    moment = datetime.fromisoformat(value)
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+class SearchFilters:
+    """The after:, before:, author: and has: filters of one search."""
+
+    def __init__(self, after=None, before=None, author_ids=(), has=()):
+        self.after = after  # Messages from this time on
+        self.before = before  # Messages before this time
+        self.author_ids = frozenset(author_ids)
+        self.has = tuple(dict.fromkeys(has))
+        self.has_mask = 0
+        for name in self.has:
+            self.has_mask |= HAS_FLAGS[name]
+
+    def __bool__(self):
+        return bool(self.after or self.before or self.author_ids or self.has)
+
+    @property
+    def after_id(self):
+        """Snowflake the history is fetched after (exclusive), or None.
+
+        None also for a time before Discord's first message.
+        """
+        if not self.after:
+            return None
+        after_id = discord.utils.time_snowflake(self.after) - 1
+        return min(after_id, MAX_SNOWFLAKE - 1) if after_id > 0 else None
+
+    @property
+    def before_id(self):
+        """Snowflake the history is fetched before (exclusive), or None.
+
+        Times before Discord's first message give 1 (nothing is before it);
+        None also for a time past the last snowflake.
+        """
+        if not self.before:
+            return None
+        before_id = discord.utils.time_snowflake(self.before)
+        return max(before_id, 1) if before_id <= MAX_SNOWFLAKE else None
+
+    @property
+    def checks_messages(self):
+        """Whether messages in the date range still have to be checked one by one."""
+        return bool(self.author_ids or self.has_mask)
+
+    def accepts(self, author_id, flags):
+        """Check a message's author and HAS_* flags (None when unknown, e.g. indexed before flags were stored)."""
+        if self.author_ids and author_id not in self.author_ids:
+            return False
+        if self.has_mask and (flags is None or flags & self.has_mask != self.has_mask):
+            return False
+        return True
+
+    def describe(self):
+        parts = []
+        if self.after:
+            parts.append(f"after {self.after:%Y-%m-%d %H:%M}")
+        if self.before:
+            parts.append(f"before {self.before:%Y-%m-%d %H:%M}")
+        if self.author_ids:
+            parts.append("by " + ", ".join(f"<@{author_id}>" for author_id in sorted(self.author_ids)))
+        if self.has:
+            parts.append("with " + " and ".join(self.has))
+        return ", ".join(parts)
+
+    def to_params(self):
+        """Return the filters as JSON-compatible values, for resuming the search."""
+        return {
+            "after": self.after.isoformat() if self.after else None,
+            "before": self.before.isoformat() if self.before else None,
+            "author_ids": sorted(self.author_ids),
+            "has": list(self.has),
+        }
+
+    @classmethod
+    def from_params(cls, params):
+        if not params:
+            return cls()
+        return cls(
+            datetime.fromisoformat(params["after"]) if params.get("after") else None,
+            datetime.fromisoformat(params["before"]) if params.get("before") else None,
+            params.get("author_ids", ()),
+            params.get("has", ()),
+        )
+
+
+def parse_filters(guild, args):
+    """Split the filter arguments off a command's arguments; returns (SearchFilters, remaining args).
+
+    Raises ValueError with a message for the user when a filter can't be understood.
+    """
+    after = before = None
+    author_ids = []
+    has = []
+    remaining = []
+    for arg in args:
+        if not arg.lower().startswith(FILTER_PREFIXES):
+            remaining.append(arg)
+            continue
+        name, _, value = arg.partition(":")
+        name = name.lower()
+        if not value:
+            raise ValueError(f"`{arg}` needs a value, e.g. `{name}:...` without a space.")
+        if name in ("after", "before"):
+            try:
+                moment = parse_time(value)
+            except ValueError:
+                raise ValueError(f"Can't read the date in `{arg}`. Use e.g. `2024-05-31`, "
+                                 "`2024-05-31T18:00` or an age like `7d`.") from None
+            if name == "after":
+                after = moment
+            else:
+                before = moment
+        elif name == "author":
+            author_id = resolve_author(guild, value)
+            if author_id is None:
+                raise ValueError(f"Unknown author `{value}`. Use a mention, a user ID or a member name.")
+            author_ids.append(author_id)
+        else:
+            value = value.lower()
+            if value not in HAS_FLAGS:
+                raise ValueError(f"Unknown filter `{arg}`. Use has: with one of: {', '.join(HAS_FLAGS)}.")
+            has.append(value)
+    if after and before and after >= before:
+        raise ValueError("The `after:` date must be earlier than the `before:` date.")
+    return SearchFilters(after, before, author_ids, has), remaining
+
+
+def resolve_author(guild, value):
+    """Return the user ID of a mention, raw ID or member name, or None."""
+    match = _MENTION.match(value)
+    if match:
+        return int(match.group(1))
+    if value.isdigit():
+        return int(value)
+    member = guild.get_member_named(value.lstrip("@"))
+    return member.id if member else None
@@ -0,0 +1,130 @@
+"""Per-search state, so several searches can run at once on one bot connection."""
+
+import itertools
+import threading
+import time
+
+from results import ResultStore, ResultView
+
+MAX_FINISHED_SESSIONS = 10  # Finished sessions kept for the UI's session switcher
+
+
+class SearchSession:
+    """Counters, results and limits of one !find or !resume invocation.
+
+    The bot thread updates a session while it scans; the UI thread reads it
+    and drops deleted matches from it. Results are a live view of the session's result store until the
+    search finishes, then the merged, channel-ordered view; deleted matches are tombstoned in the view.
+    """
+
+    def __init__(self, session_id, guild, owner, keywords, channels, max_results=None, concurrency=4):
+        self.session_id = session_id
+        self.guild_id = guild.id
+        self.guild_name = guild.name
+        self.owner_id = owner.id
+        self.owner_name = str(owner)
+        self.keywords = keywords
+        # Search terms by keyword ID (see MatchRecord.keyword_ids), for exports
+        self.keyword_names = list(dict.fromkeys(keyword for keyword in keywords if keyword))
+        self.channel_ids = [channel.id for channel in channels]
+        self.max_results = max_results  # None for no limit
+        self.concurrency = concurrency
+        self.search_id = None  # Checkpoint ID in the message index
+        # Results that aren't live Discord messages (archive searches) can't be deleted
+        self.read_only = False
+
+        self.store = ResultStore()
+        self.results = ResultView(self.store)  # Grows with the store while the search runs
+        self.in_progress = False
+        self.messages_scanned = 0
+        self.matches_found = 0
+        self.channels_total = len(channels)
+        # Per-channel progress, keyed by channel ID
+        self.channel_progress = {
+            channel.id: {"name": channel.name, "status": "queued", "scanned": 0, "matches": 0}
+            for channel in channels
+        }
+        self.limit_warning_sent = False
+        self.removed_positions = set()  # Store positions of matches deleted from the results
+        self.start_time = 0
+        self.end_time = 0
+        self.error = None  # Why the search couldn't run, if it failed
+
+    def start(self):
+        self.in_progress = True
+        self.start_time = time.time()
+        self.end_time = 0
+
+    def finish(self, results=None, error=None):
+        """Mark the search as finished, optionally replacing the live results with the final order.
+
+        error is a message for the user if the search failed.
+        """
+        if results is not None:
+            self.results = results
+        self.error = error
+        self.in_progress = False
+        self.end_time = time.time()
+
+    def remove(self, positions):
+        """Drop deleted matches (store positions) from the results. Called from the UI thread."""
+        self.removed_positions.update(positions)
+        self.results.remove(positions)
+
+    def apply_removals(self):
+        """Drop the removed matches from the current results (e.g. the final merged view)."""
+        if self.removed_positions:
+            self.results.remove(self.removed_positions)
+
+    def limit_reached(self):
+        return self.max_results is not None and self.matches_found >= self.max_results
+
+    def elapsed(self):
+        """Return the seconds the search has run (so far, or in total)."""
+        if not self.start_time:
+            return 0
+        return (self.end_time or time.time()) - self.start_time
+
+    def label(self):
+        """Describe the session for the session switcher."""
+        state = "running" if self.in_progress else "failed" if self.error else "done"
+        return (f"#{self.session_id} {self.guild_name}: {', '.join(self.keywords)} "
+                f"({self.owner_name}, {state}, {self.matches_found} matches)")
+
+
+class SessionRegistry:
+    """All search sessions of the bot, running and recently finished."""
+
+    def __init__(self, max_finished=MAX_FINISHED_SESSIONS):
+        self.max_finished = max_finished
+        self._sessions = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()  # Read from the UI thread while the bot adds sessions
+
+    def create(self, guild, owner, keywords, channels, max_results=None, concurrency=4):
+        """Register and return a new session, dropping the oldest finished ones beyond max_finished."""
+        with self._lock:
+            session = SearchSession(next(self._ids), guild, owner, keywords, channels, max_results, concurrency)
+            self._sessions[session.session_id] = session
+            finished = [s for s in self._sessions.values() if not s.in_progress and s is not session]
+            for old in finished[:max(0, len(finished) - self.max_finished)]:
+                del self._sessions[old.session_id]
+            return session
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def all(self):
+        """Return every session, oldest first."""
+        with self._lock:
+            return list(self._sessions.values())
+
+    def running(self, guild_id=None, owner_id=None):
+        """Return the sessions still searching, optionally only those of one guild and/or owner."""
+        return [
+            session for session in self.all()
+            if session.in_progress
+            and (guild_id is None or session.guild_id == guild_id)
+            and (owner_id is None or session.owner_id == owner_id)
+        ]
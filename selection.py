@@ -0,0 +1,83 @@
+"""Which search results are selected for deletion, one bit per result.
+
+Results are addressed by their position in the session's ResultStore, which
+never changes: not when the search's final order replaces the live one, and
+not when deleted results are dropped from the view. The selection is a
+bitset over those positions. Single rows are toggled in the bytearray;
+selecting or inverting all results, a page, a channel or an author is one
+bitwise operation with a mask of the results concerned (see
+ResultView.mask and ResultStore.mask_where), so it costs about the same as
+copying a few kilobytes, however many rows it changes.
+"""
+
+from array import array
+
+
+def _popcount(value):
+    return bin(value).count("1")
+
+
+class Selection:
+    """A set of result store positions, stored as a bitset."""
+
+    def __init__(self):
+        self._bits = bytearray()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, position):
+        byte = position >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] >> (position & 7) & 1)
+
+    def add(self, position):
+        byte = position >> 3
+        if byte >= len(self._bits):
+            self._bits.extend(bytes(byte + 1 - len(self._bits)))
+        bit = 1 << (position & 7)
+        if not self._bits[byte] & bit:
+            self._bits[byte] |= bit
+            self._count += 1
+
+    def discard(self, position):
+        byte = position >> 3
+        bit = 1 << (position & 7)
+        if byte < len(self._bits) and self._bits[byte] & bit:
+            self._bits[byte] &= ~bit & 0xFF
+            self._count -= 1
+
+    def clear(self):
+        self._bits = bytearray()
+        self._count = 0
+
+    def _value(self):
+        return int.from_bytes(self._bits, "little")
+
+    def _set_value(self, value):
+        self._bits = bytearray(value.to_bytes((value.bit_length() + 7) // 8, "little"))
+        self._count = _popcount(value)
+
+    def select(self, mask):
+        """Select every position in a mask (an int with one bit per store position)."""
+        self._set_value(self._value() | mask)
+
+    def deselect(self, mask):
+        self._set_value(self._value() & ~mask)
+
+    def invert(self, mask):
+        """Flip the positions in a mask: selected ones are deselected and the others selected."""
+        self._set_value(self._value() ^ mask)
+
+    def covers(self, mask):
+        """Return True if every position in the mask is selected."""
+        return self._value() & mask == mask
+
+    def positions(self):
+        """Return the selected positions in store order."""
+        positions = array("Q")
+        for index, byte in enumerate(self._bits):
+            if byte:
+                base = index << 3
+                positions.extend(base + bit for bit in range(8) if byte >> bit & 1)
+        return positions
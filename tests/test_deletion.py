@@ -0,0 +1,139 @@
+"""Tests for deletion.py: bulk and single deletes against fake_discord channels."""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from deletion import BULK_DELETE_CHUNK_SIZE, UNKNOWN_MESSAGE, bulk_delete_cutoff, delete_messages
+from fake_discord import FakeChannel, FakeGuild, FakeMessage, SyntheticHistory
+
+NOW = datetime.now(timezone.utc)
+
+
+def http_error(error_type, status, code):
+    return error_type(SimpleNamespace(status=status, reason="Error"), {"code": code, "message": "Error"})
+
+
+class Message(FakeMessage):
+    """A message whose delete fails with the error its channel has for it."""
+
+    __slots__ = ()
+
+    async def delete(self):
+        self.channel.single_ids.append(self.id)
+        error = self.channel.errors.get(self.id)
+        if error is not None:
+            raise error
+        await super().delete()
+
+
+class Channel(FakeChannel):
+    """A channel that records its bulk deletes and can fail them."""
+
+    def __init__(self, channel_id=1):
+        super().__init__(FakeGuild(1 << 40), channel_id, f"channel{channel_id}", SyntheticHistory(message_count=0))
+        self.bulk_sizes = []
+        self.bulk_error = None
+        self.single_ids = []
+        self.errors = {}  # Error of a single delete, by message ID
+
+    async def delete_messages(self, messages):
+        self.bulk_sizes.append(len(messages))
+        if self.bulk_error is not None:
+            raise self.bulk_error
+        await super().delete_messages(messages)
+
+    def messages(self, count, age):
+        """Partial messages sent age ago, a millisecond apart."""
+        first = discord.utils.time_snowflake(NOW - age)
+        return [Message(first + (index << 22), "", None, self) for index in range(count)]
+
+
+def run(messages, **kwargs):
+    return asyncio.run(delete_messages(messages, **kwargs))
+
+
+def test_cutoff_is_fourteen_days_minus_an_hour():
+    assert bulk_delete_cutoff(NOW) == discord.utils.time_snowflake(NOW - timedelta(days=14) + timedelta(hours=1))
+
+
+def test_messages_past_the_cutoff_are_deleted_one_by_one():
+    channel = Channel()
+    young = channel.messages(3, timedelta(days=13, hours=22))
+    old = channel.messages(2, timedelta(days=13, hours=23, minutes=30))
+    deleted_ids, progress = run(young + old)
+    assert channel.bulk_sizes == [3]
+    assert channel.single_ids == [message.id for message in old]
+    assert sorted(deleted_ids) == sorted(message.id for message in young + old)
+    assert progress[channel.id]["deleted"] == 5
+    assert progress[channel.id]["status"] == "done"
+
+
+@pytest.mark.parametrize("count, bulk_sizes, singles", [
+    (2, [2], 0),
+    (100, [100], 0),
+    (250, [100, 100, 50], 0),
+    # The bulk endpoint needs at least two messages, so a last chunk of one is deleted alone
+    (201, [100, 100], 1),
+    (1, [], 1),
+])
+def test_young_messages_are_bulk_deleted_in_chunks(count, bulk_sizes, singles):
+    channel = Channel()
+    deleted_ids, progress = run(channel.messages(count, timedelta(days=1)))
+    assert sorted(channel.bulk_sizes, reverse=True) == bulk_sizes
+    assert all(size <= BULK_DELETE_CHUNK_SIZE for size in channel.bulk_sizes)
+    assert len(channel.single_ids) == singles
+    assert len(deleted_ids) == count
+    assert progress[channel.id]["deleted"] == count
+
+
+def test_failed_bulk_delete_falls_back_to_single_deletes():
+    channel = Channel()
+    channel.bulk_error = http_error(discord.HTTPException, 400, 50034)
+    messages = channel.messages(10, timedelta(days=1))
+    deleted_ids, progress = run(messages)
+    assert channel.bulk_sizes == [10]
+    assert sorted(channel.single_ids) == [message.id for message in messages]
+    assert len(deleted_ids) == 10
+    assert progress[channel.id]["failed"] == 0
+
+
+def test_forbidden_bulk_delete_fails_the_chunk():
+    channel = Channel()
+    channel.bulk_error = http_error(discord.Forbidden, 403, 50013)
+    deleted_ids, progress = run(channel.messages(10, timedelta(days=1)))
+    assert channel.single_ids == []
+    assert deleted_ids == []
+    assert progress[channel.id]["failed"] == 10
+    assert progress[channel.id]["status"] == "done with errors"
+
+
+def test_single_delete_outcomes():
+    channel = Channel()
+    gone, unknown_channel, forbidden, ok = channel.messages(4, timedelta(days=30))
+    channel.errors = {
+        gone.id: http_error(discord.NotFound, 404, UNKNOWN_MESSAGE),
+        unknown_channel.id: http_error(discord.NotFound, 404, 10003),
+        forbidden.id: http_error(discord.Forbidden, 403, 50013),
+    }
+    deleted_ids, progress = run([gone, unknown_channel, forbidden, ok])
+    # Only a message Discord knows is gone counts as deleted; the other failures keep their rows
+    assert sorted(deleted_ids) == sorted([gone.id, ok.id])
+    assert progress[channel.id]["deleted"] == 2
+    assert progress[channel.id]["failed"] == 2
+
+
+def test_progress_per_channel():
+    first, second = Channel(1), Channel(2)
+    second.bulk_error = http_error(discord.Forbidden, 403, 50013)
+    reports = []
+    deleted_ids, progress = run(first.messages(3, timedelta(days=1)) + second.messages(4, timedelta(days=1)),
+                                progress_callback=lambda channels: reports.append({
+                                    channel_id: dict(channel) for channel_id, channel in channels.items()}))
+    assert len(deleted_ids) == 3
+    assert progress[1] == {"name": "channel1", "total": 3, "deleted": 3, "failed": 0, "status": "done"}
+    assert progress[2] == {"name": "channel2", "total": 4, "deleted": 0, "failed": 4, "status": "done with errors"}
+    assert reports[-1] == progress
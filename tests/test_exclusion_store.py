@@ -0,0 +1,152 @@
+"""Tests for exclusion_store.py: atomic writes, batched flushes, the legacy file and flushes from other threads."""
+
+import asyncio
+import json
+import os
+import threading
+
+import pytest
+
+import exclusion_store
+from exclusion_store import ExclusionStore, write_atomic
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def make_store(tmp_path, flush_delay=0.05, legacy_file=None):
+    store = ExclusionStore(str(tmp_path / "lists"), legacy_file=legacy_file, flush_delay=flush_delay)
+    store.load()
+    return store
+
+
+def count_writes(store):
+    """Record the guilds of every write of the store."""
+    writes = []
+    write = store._write
+
+    def recording_write(snapshots):
+        writes.append(sorted(snapshots))
+        return write(snapshots)
+
+    store._write = recording_write
+    return writes
+
+
+def test_failed_write_keeps_the_old_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "1.json")
+    write_atomic(path, b"old")
+
+    def fail(fd):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(exclusion_store.os, "fsync", fail)
+    with pytest.raises(OSError, match="disk full"):
+        write_atomic(path, b"new contents")
+    with open(path, "rb") as f:
+        assert f.read() == b"old"
+    assert os.listdir(tmp_path) == ["1.json"]  # The temporary file is gone
+
+
+def test_guild_that_could_not_be_saved_is_written_by_the_next_flush(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    store.lists["1"] = {"bad": ["badge"]}
+
+    def fail(path, data):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(exclusion_store, "write_atomic", fail)
+    store.mark_dirty("1")
+    assert not os.path.exists(store._path("1"))
+    monkeypatch.undo()
+    store.flush()
+    assert read_json(store._path("1")) == {"bad": ["badge"]}
+
+
+def test_edits_within_the_delay_are_written_together(tmp_path):
+    store = make_store(tmp_path)
+    writes = count_writes(store)
+
+    async def edit():
+        store.lists["1"] = {"bad": ["badge"]}
+        store.mark_dirty("1")
+        store.lists["1"]["bad"].append("badminton")
+        store.mark_dirty("1")
+        store.lists["2"] = {"word": ["sword"]}
+        store.mark_dirty("2")
+        await asyncio.sleep(0)
+        assert writes == []  # Nothing is written before the delay
+        await asyncio.sleep(store.flush_delay + 0.2)
+
+    asyncio.run(edit())
+    assert writes == [["1", "2"]]
+    assert read_json(store._path("1")) == {"bad": ["badge", "badminton"]}
+    assert read_json(store._path("2")) == {"word": ["sword"]}
+
+
+def test_guild_without_lists_loses_its_file(tmp_path):
+    store = make_store(tmp_path)
+    store.lists["1"] = {"bad": ["badge"]}
+    store.mark_dirty("1")
+    assert os.path.exists(store._path("1"))
+    del store.lists["1"]
+    store.mark_dirty("1")
+    assert not os.path.exists(store._path("1"))
+
+
+def test_legacy_file_is_split_per_guild(tmp_path):
+    legacy_file = str(tmp_path / "exclusion_lists.json")
+    with open(legacy_file, "w") as f:
+        json.dump({"1": {"bad": ["old"]}, "2": {"word": ["sword"]}}, f)
+    directory = tmp_path / "lists"
+    directory.mkdir()
+    # A guild that already has its own file keeps it; that file is newer
+    write_atomic(str(directory / "1.json"), json.dumps({"bad": ["new"]}).encode())
+
+    store = make_store(tmp_path, legacy_file=legacy_file)
+    assert store.lists == {"1": {"bad": ["new"]}, "2": {"word": ["sword"]}}
+    assert read_json(store._path("2")) == {"word": ["sword"]}
+    assert read_json(store._path("1")) == {"bad": ["new"]}
+    assert not os.path.exists(legacy_file)
+    assert os.path.exists(legacy_file + ".migrated")
+
+    # Loading again reads the per-guild files only
+    assert make_store(tmp_path, legacy_file=legacy_file).lists == store.lists
+
+
+def test_unreadable_legacy_file_is_left_in_place(tmp_path):
+    legacy_file = str(tmp_path / "exclusion_lists.json")
+    with open(legacy_file, "w") as f:
+        f.write("{not json")
+    store = make_store(tmp_path, legacy_file=legacy_file)
+    assert store.lists == {}
+    assert os.path.exists(legacy_file)
+
+
+def test_flush_from_another_thread_runs_on_the_loop(tmp_path):
+    store = make_store(tmp_path, flush_delay=60)
+    writes = count_writes(store)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    try:
+        async def edit():
+            store.lists["1"] = {"bad": ["badge"]}
+            store.mark_dirty("1")
+
+        asyncio.run_coroutine_threadsafe(edit(), loop).result()
+        assert store._flush_handle is not None  # Scheduled on the loop, long after the test
+        assert writes == []
+
+        # The window's shutdown flushes from its own thread and waits for the write
+        store.flush()
+        assert writes == [["1"]]
+        assert read_json(store._path("1")) == {"bad": ["badge"]}
+        assert store._flush_handle is None
+        assert not store._dirty
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
@@ -0,0 +1,155 @@
+"""Tests for export.py: JSONL and CSV exports read back, and how the bot writes them."""
+
+import asyncio
+import csv
+import gzip
+import json
+import os
+
+import pytest
+
+import chatscrub
+from export import EXPORT_BATCH, EXPORT_FIELDS, MatchExporter, export_results, parse_export
+from fake_discord import FakeContext, FakeGuild, FakeMember, SyntheticHistory
+from results import MatchRecord
+from search_session import SessionRegistry
+
+GUILD_ID = 1 << 40
+KEYWORD_NAMES = ["bad", "Needle"]
+
+
+def make_records(count):
+    contents = ["a bad needle", 'quote " and, comma', "line\nbreak", "ñ 🙂 𝐛𝐚𝐝", ""]
+    return [MatchRecord((1 << 60) + index, 10 + index % 3, f"channel{index % 3}", index % 4 or None,
+                        f"user{index % 4}", contents[index % len(contents)], (),
+                        [(), (0,), (1, 0), (5,)][index % 4])
+            for index in range(count)]
+
+
+def read_export(path, fmt, compress):
+    """Read an export back as dicts of EXPORT_FIELDS, with the keywords as lists."""
+    opener = gzip.open if compress else open
+    with opener(path, "rt", encoding="utf-8", newline="") as file:
+        if fmt == "jsonl":
+            return [json.loads(line) for line in file]
+        rows = list(csv.reader(file))
+    assert tuple(rows[0]) == EXPORT_FIELDS
+    exported = [dict(zip(EXPORT_FIELDS, row)) for row in rows[1:]]
+    for row in exported:
+        row["keywords"] = row["keywords"].split(", ") if row["keywords"] else []
+    return exported
+
+
+def check_export(exported, records):
+    assert len(exported) == len(records)
+    for row, record in zip(exported, records):
+        assert row["id"] == str(record.id)
+        assert row["guild_id"] == str(GUILD_ID)
+        assert row["channel_id"] == str(record.channel_id)
+        assert row["channel_name"] == record.channel_name
+        assert row["author_id"] == str(record.author_id or "")
+        assert row["author_name"] == record.author_name
+        assert row["content"] == record.content
+        # Keyword IDs name the search terms; IDs past the known terms are left out
+        assert row["keywords"] == [KEYWORD_NAMES[index] for index in record.keyword_ids if index < 2]
+        assert row["jump_url"] == f"https://discord.com/channels/{GUILD_ID}/{record.channel_id}/{record.id}"
+
+
+FORMATS = [("jsonl", False), ("csv", False), ("jsonl", True), ("csv", True)]
+
+
+@pytest.mark.parametrize("fmt, compress", FORMATS)
+def test_export_results_round_trip(tmp_path, fmt, compress):
+    records = make_records(2 * EXPORT_BATCH + 7)
+    path = str(tmp_path / "out" / f"export.{fmt}")
+    assert export_results(records, path, fmt, compress, GUILD_ID, KEYWORD_NAMES) == len(records)
+    check_export(read_export(path, fmt, compress), records)
+
+
+@pytest.mark.parametrize("fmt, compress", FORMATS)
+def test_streamed_export_round_trip(tmp_path, fmt, compress):
+    records = make_records(EXPORT_BATCH + 3)
+    path = str(tmp_path / f"export.{fmt}")
+
+    async def stream():
+        exporter = MatchExporter(path, fmt, compress, GUILD_ID, KEYWORD_NAMES)
+        for record in records:
+            exporter.write(record)
+            if exporter.pending >= EXPORT_BATCH:
+                await exporter.flush_async()
+        await exporter.close_async()
+        return exporter.count
+
+    assert asyncio.run(stream()) == len(records)
+    check_export(read_export(path, fmt, compress), records)
+
+
+def test_empty_csv_export_has_the_header(tmp_path):
+    path = str(tmp_path / "export.csv")
+    assert export_results([], path, "csv") == 0
+    assert read_export(path, "csv", False) == []
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("jsonl", ("jsonl", False)), ("CSV", ("csv", False)), ("jsonl.gz", ("jsonl", True)), ("csv.GZ", ("csv", True)),
+])
+def test_parse_export(value, expected):
+    assert parse_export(value) == expected
+
+
+@pytest.mark.parametrize("value", ["json", "gz", "csv.zip", ""])
+def test_parse_export_rejects_unknown_formats(value):
+    with pytest.raises(ValueError, match="Unknown export format"):
+        parse_export(value)
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """The bot's sessions and export directory, fresh for one test."""
+    monkeypatch.setattr(chatscrub, "sessions", SessionRegistry())
+    monkeypatch.setattr(chatscrub, "EXPORT_DIR", str(tmp_path / "exports"))
+    return chatscrub
+
+
+def test_export_command_writes_a_snapshot(bot, monkeypatch):
+    guild = FakeGuild(GUILD_ID)
+    owner = FakeMember(5, "owner", manage_messages=False)
+    channels = [guild.add_channel(f"channel{index}", SyntheticHistory(message_count=0)) for index in range(3)]
+    session = bot.sessions.create(guild, owner, KEYWORD_NAMES, channels)
+    records = make_records(50)
+    for record in records:
+        session.store.append(record)
+    session.keyword_names = KEYWORD_NAMES
+    session.finish()
+
+    # The window deletes results while the export is being written; the export keeps what was there
+    def export_while_deleting(results, *args):
+        session.remove(range(0, 50, 2))
+        return export_results(results, *args)
+
+    monkeypatch.setattr(bot, "export_results", export_while_deleting)
+    ctx = FakeContext(guild, owner)
+    asyncio.run(bot.export_session.callback(ctx, "csv.gz"))
+    assert ctx.sent[-1].startswith(f"📄 Exported 50 matches of search #{session.session_id}")
+    path, = (os.path.join(bot.EXPORT_DIR, name) for name in os.listdir(bot.EXPORT_DIR))
+    assert path.endswith(".csv.gz")
+    check_export(read_export(path, "csv", True), records)
+    assert len(session.results) == 25
+
+
+def test_search_that_cannot_write_its_export_fails(bot, tmp_path, monkeypatch):
+    # The export directory can't be created where a file is
+    (tmp_path / "exports").write_text("")
+    events = []
+    monkeypatch.setattr(bot, "report", lambda event, session, key=None: events.append((event, session)))
+    guild = FakeGuild(GUILD_ID)
+    channels = [guild.add_channel("general", SyntheticHistory(message_count=0))]
+    ctx = FakeContext(guild, FakeMember(5, "owner"))
+    asyncio.run(bot.run_search(ctx, None, ["bad"], channels, export="jsonl"))
+
+    session, = bot.sessions.all()
+    assert not session.in_progress
+    assert "Can't write the export file" in session.error
+    assert "failed" in session.label()
+    assert [event for event, _ in events] == ["start_search", "finalize_results"]
+    assert ctx.sent == [f"⚠️ {session.error}"]
@@ -0,0 +1,244 @@
+"""Tests for jobs.py: fair API permits, pausing and cancelling jobs, and paced iteration."""
+
+import asyncio
+
+import pytest
+
+from jobs import PRIORITIES, FairPermits, JobScheduler
+
+
+class CountingPermits(FairPermits):
+    """FairPermits that count the permits taken and held."""
+
+    def __init__(self, permits):
+        super().__init__(permits)
+        self.acquired = 0
+        self.held = 0
+
+    async def acquire(self, guild_id, priority=PRIORITIES["normal"]):
+        await super().acquire(guild_id, priority)
+        self.acquired += 1
+        self.held += 1
+
+    def release(self):
+        self.held -= 1
+        super().release()
+
+
+async def settle():
+    """Let every task that can run do so."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def grant_order(permits, waiters):
+    """Queue (label, guild, priority) waiters behind a held permit; return the order they get it in."""
+    order = []
+
+    async def waiter(label, guild_id, priority):
+        await permits.acquire(guild_id, priority)
+        order.append(label)
+
+    await permits.acquire("holder")
+    tasks = []
+    for label, guild_id, priority in waiters:
+        tasks.append(asyncio.create_task(waiter(label, guild_id, priority)))
+        await settle()
+    for _ in waiters:
+        permits.release()
+        await settle()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_guilds_take_turns():
+    normal = PRIORITIES["normal"]
+    waiters = [(f"{guild}{index}", guild, normal) for guild, count in (("a", 3), ("b", 3), ("c", 1))
+               for index in range(count)]
+    order = asyncio.run(grant_order(FairPermits(1), waiters))
+    # A guild that queued many requests first doesn't hold back the others
+    assert order == ["a0", "b0", "c0", "a1", "b1", "a2", "b2"]
+
+
+def test_priority_then_arrival_within_a_guild():
+    waiters = [("low", 1, PRIORITIES["low"]), ("normal0", 1, PRIORITIES["normal"]),
+               ("high", 1, PRIORITIES["high"]), ("normal1", 1, PRIORITIES["normal"])]
+    order = asyncio.run(grant_order(FairPermits(1), waiters))
+    assert order == ["high", "normal0", "normal1", "low"]
+
+
+def test_free_permits_are_taken_without_waiting():
+    async def run():
+        permits = FairPermits(2)
+        await permits.acquire(1)
+        await permits.acquire(2)
+        third = asyncio.create_task(permits.acquire(1))
+        await settle()
+        assert not third.done()
+        assert permits.waiting() == {1: 1}
+        permits.release()
+        await settle()
+        assert third.done()
+        assert permits.waiting() == {}
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def run():
+        permits = FairPermits(1)
+        await permits.acquire(1)
+        waiter = asyncio.create_task(permits.acquire(2))
+        await settle()
+        waiter.cancel()
+        await settle()
+        assert permits.waiting() == {}
+        # The permit goes back to the pool instead of to the cancelled waiter
+        permits.release()
+        await asyncio.wait_for(permits.acquire(3), 1)
+
+    asyncio.run(run())
+
+
+def test_waiter_cancelled_as_it_is_granted_passes_the_permit_on():
+    async def run():
+        permits = FairPermits(1)
+        await permits.acquire(1)
+        first = asyncio.create_task(permits.acquire(1))
+        second = asyncio.create_task(permits.acquire(1))
+        await settle()
+        permits.release()  # Grants first's permit...
+        first.cancel()  # ...which is cancelled before it can run
+        await settle()
+        assert first.cancelled()
+        assert second.done()
+        assert permits.waiting() == {}
+        # The second waiter holds the only permit; once it is released the pool is full again
+        permits.release()
+        await asyncio.wait_for(permits.acquire(1), 1)
+
+    asyncio.run(run())
+
+
+def test_pause_holds_a_job_at_its_next_permit():
+    async def run():
+        scheduler = JobScheduler(permits=4)
+        requests = []
+        resume = asyncio.Event()
+
+        async def work(job):
+            for index in range(3):
+                async with scheduler.permit(job):
+                    requests.append(index)
+                if index == 0:
+                    await resume.wait()
+
+        job = scheduler.submit("search", 1, "test", work)
+        await settle()
+        assert requests == [0]
+        job.pause()
+        assert job.state == "paused"
+        resume.set()
+        await settle()
+        assert requests == [0]  # Waiting at its next request
+        job.unpause()
+        await job.task
+        assert requests == [0, 1, 2]
+        assert job.state == "done"
+
+    asyncio.run(run())
+
+
+def test_cancelling_a_paused_job():
+    async def run():
+        scheduler = JobScheduler(permits=1)
+
+        async def work(job):
+            while True:
+                async with scheduler.permit(job):
+                    await asyncio.sleep(0)
+
+        job = scheduler.submit("search", 1, "test", work)
+        await settle()
+        job.pause()
+        await settle()
+        assert scheduler.cancel(job.job_id)
+        await job.task
+        assert job.state == "cancelled"
+        assert not scheduler.cancel(job.job_id)
+        # The cancelled job gave its permit back
+        await asyncio.wait_for(scheduler.permits.acquire(2), 1)
+
+    asyncio.run(run())
+
+
+def test_failed_job_keeps_its_error():
+    async def run():
+        scheduler = JobScheduler()
+
+        async def work(job):
+            raise RuntimeError("boom")
+
+        job = scheduler.submit("delete", 1, "test", work)
+        await job.task
+        assert job.state == "failed"
+        assert job.summary().endswith(" - boom")
+
+    asyncio.run(run())
+
+
+async def numbers(count, permits, held):
+    """An async iterator that records how many permits are held whenever it produces an item."""
+    for number in range(count):
+        held.append(permits.held)
+        yield number
+
+
+@pytest.mark.parametrize("count, pages", [(0, 1), (1, 1), (99, 1), (100, 2), (250, 3), (300, 4)])
+def test_paced_takes_one_permit_per_page(count, pages):
+    async def run():
+        scheduler = JobScheduler()
+        scheduler.permits = permits = CountingPermits(4)
+        items = []
+        held = []
+
+        async def work(job):
+            async for item in scheduler.paced(numbers(count, permits, held), job, page_size=100):
+                # The caller gets the items after the page's permit is given back
+                assert permits.held == 0
+                items.append(item)
+
+        job = scheduler.submit("search", 1, "test", work)
+        await job.task
+        assert job.state == "done", job.error
+        assert items == list(range(count))
+        # Items are fetched holding a permit; the last page's request also finds the end
+        assert held == [1] * count
+        assert permits.acquired == pages
+
+    asyncio.run(run())
+
+
+def test_paced_stops_at_the_next_page_while_paused():
+    async def run():
+        scheduler = JobScheduler()
+        scheduler.permits = permits = CountingPermits(4)
+        received = []
+
+        async def work(job):
+            async for item in scheduler.paced(numbers(30, permits, []), job, page_size=10):
+                received.append(item)
+                if item == 4:
+                    job.pause()
+
+        job = scheduler.submit("search", 1, "test", work)
+        await settle()
+        # The page that was fetched is handed out; the next one waits
+        assert received == list(range(10))
+        assert permits.acquired == 1
+        job.unpause()
+        await job.task
+        assert received == list(range(30))
+        assert permits.acquired == 4
+
+    asyncio.run(run())
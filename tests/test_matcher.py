@@ -0,0 +1,125 @@
+"""Tests for matcher.py: KeywordMatcher, with str.find and with the automaton, against plain substring search."""
+
+import random
+
+import pytest
+
+from matcher import ExclusionFilter, KeywordMatcher, classify_spans
+
+
+def naive_matches(keywords, text):
+    """Every (start, end, keyword) occurrence, overlapping ones included, found with str.find.
+
+    Sorted as the matcher reports them: by end, longest keyword first.
+    """
+    occurrences = []
+    for keyword in dict.fromkeys(keyword for keyword in keywords if keyword):
+        start = text.find(keyword)
+        while start >= 0:
+            occurrences.append((start, start + len(keyword), keyword))
+            start = text.find(keyword, start + 1)
+    return sorted(occurrences, key=lambda occurrence: (occurrence[1], -len(occurrence[2])))
+
+
+def random_text(rng, alphabet, length):
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+class AutomatonMatcher(KeywordMatcher):
+    """KeywordMatcher that compiles even a single keyword into the automaton."""
+
+    AUTOMATON_THRESHOLD = 0
+
+
+@pytest.fixture(params=[KeywordMatcher, AutomatonMatcher], ids=["find", "automaton"])
+def engine(request):
+    return request.param
+
+
+def check_matcher(matcher, keywords, text):
+    expected = naive_matches(keywords, text)
+    assert matcher.find_all(text) == expected
+    assert matcher.matched_keywords(text) == list(dict.fromkeys(keyword for _, _, keyword in expected))
+    assert matcher.contains_any(text) == bool(expected)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_like_substring_search(engine, seed):
+    rng = random.Random(seed)
+    # A small alphabet makes keywords overlap, nest and share prefixes and suffixes
+    alphabet = "abcé🙂" if seed % 2 else "ab"
+    keywords = [random_text(rng, alphabet, rng.randint(1, 5)) for _ in range(rng.randint(1, 12))] + [""]
+    matcher = engine(keywords)
+    for _ in range(20):
+        check_matcher(matcher, keywords, random_text(rng, alphabet, rng.randint(0, 80)))
+
+
+def test_large_sets_use_the_automaton():
+    keywords = [f"word{index}" for index in range(KeywordMatcher.AUTOMATON_THRESHOLD)]
+    assert KeywordMatcher(keywords)._delta is not None
+    assert KeywordMatcher(keywords[:-1])._delta is None
+
+
+def test_occurrences_come_in_end_order(engine):
+    matcher = engine(["he", "she", "his", "hers"])
+    # Keywords ending at the same character come longest first
+    assert matcher.find_all("ushers") == [(1, 4, "she"), (2, 4, "he"), (2, 6, "hers")]
+
+
+@pytest.mark.parametrize("keywords, text, expected", [
+    # Overlapping occurrences of one keyword are all reported
+    (["aa"], "aaaa", [(0, 2, "aa"), (1, 3, "aa"), (2, 4, "aa")]),
+    # Nested keywords, the inner one ending first
+    (["bad", "badword", "word"], "a badword", [(2, 5, "bad"), (2, 9, "badword"), (5, 9, "word")]),
+    # A keyword that is the whole text, and one at its very end
+    (["needle"], "needle", [(0, 6, "needle")]),
+    (["end", "d"], "the end", [(4, 7, "end"), (6, 7, "d")]),
+    # Overlapping different keywords: the end of one is the start of the other
+    (["abc", "cde"], "abcde", [(0, 3, "abc"), (2, 5, "cde")]),
+    (["needle"], "", []),
+    (["needle"], "needl", []),
+])
+def test_pinned_matches(engine, keywords, text, expected):
+    matcher = engine(keywords)
+    assert matcher.find_all(text) == expected
+    check_matcher(matcher, keywords, text)
+
+
+@pytest.mark.parametrize("keywords", [["needle"], ["needle", "bad"], ["ab", "ba", "b"]])
+def test_candidates_cover_every_matching_text(engine, keywords):
+    matcher = engine(keywords)
+    texts = ["", "needle", "a needle", "nee", "dle", "ab", "b", "ba", "nothing", "", "bad", "needle"]
+    candidates = list(matcher.candidates(texts))
+    assert candidates == sorted(set(candidates))
+    # Extra candidates are allowed, for a keyword found across two texts; missing ones are not
+    assert {index for index, text in enumerate(texts) if matcher.contains_any(text)} <= set(candidates)
+    assert list(matcher.candidates([])) == []
+
+
+def test_keyword_ids(engine):
+    matcher = engine(["needle", "", "bad", "needle", "apple"])
+    assert matcher.keywords == ["needle", "bad", "apple"]
+    assert matcher.keyword_ids(["apple", "needle"]) == (2, 0)
+    assert not KeywordMatcher(["", ""])
+
+
+def test_exclusion_filter_with_and_without_automaton():
+    words = [f"word{index}" for index in range(ExclusionFilter.AUTOMATON_THRESHOLD + 10)]
+    for exclusion_filter in (ExclusionFilter(words), ExclusionFilter(words[:5])):
+        assert exclusion_filter.excludes("a word3 here")
+        assert exclusion_filter.first_match("a word3 here") == "word3"
+        assert not exclusion_filter.excludes("a word here")
+        assert exclusion_filter.first_match("a word here") is None
+
+
+def test_classify_spans(engine):
+    matcher = engine(["bad", "needle"])
+    filters = {"bad": ExclusionFilter(["bad apple"])}
+    matched, excluded, spans = classify_spans(matcher, "needle, bad apple, needle", filters)
+    assert matched == ["needle"]
+    assert excluded == ["bad"]
+    assert spans == (0, 6, 8, 11, 19, 25)
+    assert classify_spans(matcher, "nothing here", filters) == ([], [], ())
+    # A single occurrence, kept and excluded
+    assert classify_spans(matcher, "a needle", filters) == (["needle"], [], (2, 8))
+    assert classify_spans(matcher, "bad apple", filters) == ([], ["bad"], (0, 3))
@@ -0,0 +1,99 @@
+"""Tests for message_index.py: reading candidate rows a page at a time, and the normalized full-text index."""
+
+import sqlite3
+
+import pytest
+
+from message_index import MessageIndex
+from normalize import normalize
+
+CHANNEL_ID = 7
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = MessageIndex(str(tmp_path / "index.db"))
+    rows = [(100 + message_id, message_id % 3, f"user{message_id % 3}", 0.0,
+             "has a needle" if message_id % 4 == 1 else "nothing here", None, message_id % 2)
+            for message_id in range(50)]
+    index.store_messages(CHANNEL_ID, rows, rows[-1][0])
+    index.store_messages(CHANNEL_ID + 1, [(1000, 1, "user1", 0.0, "needle", None, 0)], 1000)
+    yield index
+    index.close()
+
+
+def read_pages(index, keywords, page_size, max_id=None, min_id=None, **filters):
+    """Page through candidate_messages the way a search does."""
+    rows = []
+    while True:
+        page = index.candidate_messages(CHANNEL_ID, keywords, max_id, min_id, limit=page_size, **filters)
+        assert len(page) <= page_size
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        min_id = page[-1][0]
+
+
+@pytest.mark.parametrize("keywords", [None, ["needle"], ["ne"]])
+@pytest.mark.parametrize("page_size", [1, 7, 13, 50, 51])
+def test_pages_add_up_to_all_candidates(index, keywords, page_size):
+    everything = index.candidate_messages(CHANNEL_ID, keywords)
+    assert read_pages(index, keywords, page_size) == everything
+    assert [row[0] for row in everything] == sorted(row[0] for row in everything)
+    assert len(everything) == (13 if keywords == ["needle"] else 50)
+
+
+def test_pages_keep_the_filters(index):
+    expected = index.candidate_messages(CHANNEL_ID, ["needle"], 140, 110, author_ids=[0, 1], has_mask=1)
+    assert expected
+    assert read_pages(index, ["needle"], 2, 140, 110, author_ids=[0, 1], has_mask=1) == expected
+    assert all(110 < row[0] <= 140 and row[1] in (0, 1) and row[6] & 1 for row in expected)
+
+
+def test_empty_range(index):
+    assert index.candidate_messages(CHANNEL_ID, None, 120, 120, limit=5) == []
+    assert read_pages(index, None, 5, min_id=149) == []
+
+
+def candidate_ids(index, keywords, channel_id=CHANNEL_ID, normalized=True):
+    return [row[0] for row in index.candidate_messages(channel_id, keywords, normalized=normalized)]
+
+
+def test_normalized_search_finds_disguised_keywords(tmp_path):
+    index = MessageIndex(str(tmp_path / "index.db"))
+    texts = ["so 𝐛𝐚𝐝", "ｂ\u200bａｄ", "BAD", "b\u0430d", "good", "bat", "ﬁre bad"]
+    index.store_messages(CHANNEL_ID, [(1 + i, 1, "user", 0.0, text, None, 0) for i, text in enumerate(texts)], len(texts))
+    assert candidate_ids(index, [normalize("bad")]) == [1, 2, 3, 4, 7]
+    assert candidate_ids(index, ["fire"]) == [7]
+    # The raw index only finds the plain spelling
+    assert candidate_ids(index, ["bad"], normalized=False) == [3, 7]
+
+    # Edits and deletions keep the normalized index in step
+    index.store_messages(CHANNEL_ID, [(1, 1, "user", 0.0, "so 𝐠𝐨𝐨𝐝", 1.0, 0), (5, 1, "user", 0.0, "𝐛𝐚𝐝", 1.0, 0)], None)
+    index.delete_messages([2])
+    assert candidate_ids(index, ["bad"]) == [3, 4, 5, 7]
+    assert candidate_ids(index, ["good"]) == [1]
+    index.close()
+
+
+def test_older_database_gets_normalized_text(tmp_path):
+    path = str(tmp_path / "index.db")
+    # The messages table and raw full-text index as they were before normalized text was stored
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE messages (id INTEGER PRIMARY KEY, channel_id INTEGER NOT NULL, author_id INTEGER,
+                               author_name TEXT, created_at REAL, content TEXT, edited_at REAL, flags INTEGER);
+        CREATE VIRTUAL TABLE messages_fts USING fts5(content, content='messages', content_rowid='id', tokenize='trigram');
+        CREATE TRIGGER messages_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END;
+    """)
+    conn.executemany("INSERT INTO messages VALUES (?, ?, 1, 'user', 0.0, ?, NULL, 0)",
+                     [(1, CHANNEL_ID, "so 𝐛𝐚𝐝"), (2, CHANNEL_ID, "bad"), (3, CHANNEL_ID, "good")])
+    conn.commit()
+    conn.close()
+
+    index = MessageIndex(path)
+    assert candidate_ids(index, ["bad"]) == [1, 2]
+    assert candidate_ids(index, ["bad"], normalized=False) == [2]
+    index.close()
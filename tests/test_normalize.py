@@ -0,0 +1,93 @@
+"""Tests for normalize.py: normalize_with_offsets against normalize() and the original text, also as matched by MatchSpec."""
+
+import random
+
+import pytest
+
+from match_pool import MatchSpec
+from matcher import ExclusionFilter, KeywordMatcher
+from normalize import CONFUSABLES, normalize, normalize_with_offsets, original_spans
+
+# Characters the folding treats specially, mixed into random texts
+TRICKY = ("ｂａｄ𝐛𝐚𝐝ⓑⓐⓓ" "ßİĳﬁ" "\u00e9e\u0301\u0489"  # Compatibility forms, case folding, marks
+          "\u200b\u200d\u00ad\u202e\U000e0041\u3164"  # Invisible characters
+          "ΣσςΑα🙂👍🏽" + "".join(CONFUSABLES) + "abc XYZ")
+
+
+def random_text(rng, length):
+    chars = []
+    for _ in range(length):
+        if rng.random() < 0.7:
+            chars.append(rng.choice(TRICKY))
+        else:
+            chars.append(chr(rng.randrange(0x20, 0x2FFFF)))
+    return "".join(chars)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_normalize_with_offsets_matches_normalize(seed):
+    rng = random.Random(seed)
+    for _ in range(50):
+        text = random_text(rng, rng.randint(0, 40))
+        normalized, offsets = normalize_with_offsets(text)
+        assert normalized == normalize(text)
+        assert len(offsets) == len(normalized)
+        # Offsets point into the original text, never backwards
+        assert all(0 <= offset < len(text) for offset in offsets)
+        assert list(offsets) == sorted(offsets)
+        # Each normalized character comes from the character its offset names
+        for index, offset in enumerate(offsets):
+            assert normalized[index] in normalize(text[offset])
+
+
+def test_ascii_text_is_lowercased():
+    normalized, offsets = normalize_with_offsets("Needle IN a Haystack")
+    assert normalized == "needle in a haystack"
+    assert list(offsets) == list(range(20))
+
+
+@pytest.mark.parametrize("keyword, text, original", [
+    ("bad", "so 𝐛𝐚𝐝!", "𝐛𝐚𝐝"),
+    ("bad", "ｂ\u200bａｄ apple", "ｂ\u200bａｄ"),
+    ("cafe", "un caf\u00e9", "caf\u00e9"),
+    ("cafe", "un cafe\u0301", "cafe"),
+    ("cafe", "un café", "cafe"),
+    ("strasse", "Straße", "Straße"),
+    # NFKD expands one character into several; a span covering part of them covers the whole character
+    ("fire", "on ﬁre!", "ﬁre"),
+    ("ire", "on ﬁre!", "ﬁre"),
+    ("f", "on ﬁre!", "ﬁ"),
+    ("1kg", "1㎏", "1㎏"),
+    ("5", "½ of 5", "5"),
+    # A keyword at the very end, after an expanded character
+    ("kg", "x ㎏", "㎏"),
+])
+def test_spans_map_back_to_the_original(keyword, text, original):
+    normalized = normalize(text)
+    start = normalized.index(keyword)
+    mapped = original_spans(text, (start, start + len(keyword)), normalized=True)
+    assert text[mapped[0]:mapped[1]] == original
+
+
+def test_offsets_across_an_expanded_character():
+    normalized, offsets = normalize_with_offsets("a½b")
+    assert normalized == "a1\u20442b"
+    assert list(offsets) == [0, 1, 1, 1, 2]
+
+
+@pytest.mark.parametrize("normalized", [False, True])
+def test_match_spec_spans_point_into_the_original_text(normalized):
+    keywords = ["bad", "ire"]
+    matcher = KeywordMatcher([normalize(keyword) for keyword in keywords] if normalized else keywords)
+    spec = MatchSpec(matcher, {"bad": ExclusionFilter(["not bad"])}, normalized)
+    texts = ["on ﬁre", "so 𝐛𝐚𝐝", "BAD", "not bad", "İ bad", ""]
+    matched, excluded_hits, spans, keyword_ids = spec.match(texts)
+    found = {index: ([texts[index][start:end] for start, end in zip(span[::2], span[1::2])],
+                     [matcher.keywords[keyword_id] for keyword_id in ids])
+             for index, span, ids in zip(matched, spans, keyword_ids)}
+    # Without normalization only lowercasing applies, which makes İ two characters long
+    expected = {2: (["BAD"], ["bad"]), 4: (["bad"], ["bad"])}
+    if normalized:
+        expected.update({0: (["ﬁre"], ["ire"]), 1: (["𝐛𝐚𝐝"], ["bad"])})
+    assert found == expected
+    assert excluded_hits == 1
@@ -0,0 +1,226 @@
+"""Tests for results.py: tombstoned ResultViews against a plain list of store positions, and spilled records."""
+
+import mmap
+import random
+from array import array
+
+import pytest
+
+from results import (COMPACT_MIN_REMOVED, MatchRecord, ResultStore, ResultView, Tombstones, _encode_record,
+                     positions_mask)
+
+
+def make_store(count, hot_capacity=1000):
+    store = ResultStore(hot_capacity=hot_capacity)
+    for position in range(count):
+        store.append(MatchRecord(1000 + position, position % 7, "c", position % 5, "a", f"needle {position}"))
+    return store
+
+
+def check_view(view, expected):
+    """Compare every way of reading a view with the list of store positions it should show."""
+    store = view.store
+    assert len(view) == len(expected)
+    assert [view.store_position(index) for index in range(len(view))] == expected
+    assert [record.id for record in view] == [store.id_at(position) for position in expected]
+    assert view.ids(0, len(view)) == [store.id_at(position) for position in expected]
+    assert view.mask() == positions_mask(expected)
+    if expected:
+        assert view[-1].id == store.id_at(expected[-1])
+    for start, stop in ((0, 10), (len(expected) // 3, len(expected) // 3 + 25), (len(expected) - 5, len(expected) + 5)):
+        start = max(start, 0)
+        assert [record.id for record in view[start:stop]] == [store.id_at(p) for p in expected[start:stop]]
+        assert view.ids(start, stop) == [store.id_at(p) for p in expected[start:stop]]
+        assert view.mask(start, stop) == positions_mask(expected[start:stop])
+    assert [record.id for record in view[::7]] == [store.id_at(p) for p in expected[::7]]
+
+
+def test_tombstones_slot_skips_removed_slots():
+    rng = random.Random(3)
+    tombstones = Tombstones()
+    removed = set()
+    for slot in rng.sample(range(5000), 1200) + [7, 7, 4999]:
+        assert tombstones.add(slot) == (slot not in removed)
+        removed.add(slot)
+    remaining = [slot for slot in range(6000) if slot not in removed]
+    assert len(tombstones) == len(removed)
+    assert [tombstones.slot(index) for index in range(len(remaining))] == remaining
+    assert tombstones.mask() == positions_mask(removed)
+
+
+def test_empty_tombstones():
+    tombstones = Tombstones()
+    assert tombstones.slot(41) == 41
+    assert 41 not in tombstones
+    assert tombstones.mask() == 0
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_view_following_the_store(seed):
+    rng = random.Random(seed)
+    store = make_store(3000)
+    view = ResultView(store)
+    expected = list(range(len(store)))
+    for _ in range(20):
+        doomed = rng.sample(range(len(store)), 150) + rng.sample(expected, 20) + [len(store) + 5]
+        view.remove(doomed)
+        expected = [position for position in expected if position not in set(doomed)]
+        # The view follows results added after the removals
+        for _ in range(rng.randrange(50)):
+            expected.append(store.append(MatchRecord(1000 + len(store), 1, "c", 1, "a", "needle")))
+        check_view(view, expected)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_view_with_positions(seed):
+    rng = random.Random(seed)
+    store = make_store(4000)
+    order = list(range(len(store)))
+    rng.shuffle(order)
+    order = order[:3500]  # Positions the view doesn't show can't be removed from it
+    view = ResultView(store, array("Q", order))
+    expected = list(order)
+    for _ in range(30):
+        doomed = rng.sample(range(len(store)), 120)
+        view.remove(doomed)
+        expected = [position for position in expected if position not in set(doomed)]
+        if rng.random() < 0.2:
+            view.compact()
+        check_view(view, expected)
+
+
+def test_remove_after_compact_and_twice():
+    store = make_store(500)
+    view = ResultView(store, array("Q", range(499, -1, -1)))
+    expected = list(range(499, -1, -1))
+    view.remove([10, 20, 30])
+    view.compact()
+    expected = [position for position in expected if position not in (10, 20, 30)]
+    check_view(view, expected)
+
+    # Positions removed before the compaction are gone from the view; removing them again is a no-op
+    view.remove([10, 20, 30])
+    check_view(view, expected)
+
+    view.remove([40, 40, 41])
+    view.remove([41])
+    expected = [position for position in expected if position not in (40, 41)]
+    check_view(view, expected)
+    view.compact()
+    check_view(view, expected)
+
+
+def test_view_compacts_itself():
+    store = make_store(3 * COMPACT_MIN_REMOVED)
+    view = ResultView(store, array("Q", range(len(store))))
+    view.remove(range(0, 2 * COMPACT_MIN_REMOVED, 2))
+    assert len(view._removed) == 0
+    check_view(view, list(range(1, 2 * COMPACT_MIN_REMOVED, 2)) + list(range(2 * COMPACT_MIN_REMOVED, len(store))))
+
+
+@pytest.mark.parametrize("count", [1, 2, 64, 65, 500])
+@pytest.mark.parametrize("with_positions", [False, True])
+def test_tombstone_the_last_row(count, with_positions):
+    store = make_store(count)
+    expected = list(range(count - 1, -1, -1)) if with_positions else list(range(count))
+    view = ResultView(store, array("Q", expected) if with_positions else None)
+    view.remove([expected[-1]])
+    expected.pop()
+    check_view(view, expected)
+    if not with_positions:
+        # A view following the store shows results added after its last row was removed
+        expected.append(store.append(MatchRecord(1000 + count, 1, "c", 1, "a", "needle")))
+        check_view(view, expected)
+
+    # Removing from the end until nothing is left
+    while expected:
+        view.remove([expected.pop()])
+        check_view(view, expected)
+    assert view.mask() == 0
+    assert list(view) == []
+
+
+def test_snapshot_is_not_changed_by_later_removals():
+    store = make_store(1000)
+    view = ResultView(store)
+    view.remove(range(0, 1000, 3))
+    snapshot = view.snapshot()
+    expected = [position for position in range(1000) if position % 3]
+    view.remove(range(1, 1000, 3))
+    check_view(snapshot, expected)
+    check_view(view, list(range(2, 1000, 3)))
+
+
+def random_record(rng, message_id):
+    content = "".join(rng.choice("needle bad 𝐛𝐚𝐝 é​🙂\ud800") for _ in range(rng.randrange(0, 200)))
+    spans = tuple(sorted(rng.sample(range(len(content) + 1), 2 * rng.randrange(0, min(4, len(content) // 2 + 1)))))
+    return MatchRecord(message_id, rng.randrange(1 << 63), rng.choice(["general", "ñ-🙂", ""]),
+                       rng.choice([None, rng.randrange(1, 1 << 63)]), rng.choice(["user", "Zoë", ""]),
+                       content, spans, tuple(rng.sample(range(50), rng.randrange(0, 3))))
+
+
+def record_fields(record):
+    return (record.id, record.channel_id, record.channel_name, record.author_id or 0, record.author_name,
+            record.content, tuple(record.spans), tuple(record.keyword_ids))
+
+
+@pytest.mark.parametrize("hot_capacity", [1, 7, 100])
+def test_spilled_records_read_back_equal(hot_capacity, tmp_path):
+    rng = random.Random(hot_capacity)
+    store = ResultStore(hot_capacity=hot_capacity, spill_dir=tmp_path)
+    records = []
+    try:
+        for index in range(1000):
+            record = random_record(rng, (1 << 60) + index)
+            assert store.append(record) == index
+            records.append(record)
+            if index % 97 == 0:
+                # Reading while the spill file grows remaps it
+                position = rng.randrange(index + 1)
+                assert record_fields(store[position]) == record_fields(records[position])
+        assert len(store) == len(records)
+        assert store._offsets, "nothing was spilled"
+        for position, record in enumerate(records):
+            assert record_fields(store[position]) == record_fields(record)
+            assert store.id_at(position) == record.id
+            assert store.channel_id_at(position) == record.channel_id
+        assert record_fields(store[-1]) == record_fields(records[-1])
+    finally:
+        store.close()
+
+
+def sized_record(message_id, size):
+    """A record whose spilled form is size bytes."""
+    overhead = len(_encode_record(MatchRecord(message_id, 1, "c", 2, "a", "", (0, 1), (0,))))
+    return MatchRecord(message_id, 1, "c", 2, "a", "x" * (size - overhead), (0, 1), (0,))
+
+
+def test_spilled_records_at_page_boundaries(tmp_path):
+    page = mmap.PAGESIZE
+    # The first record fills a page exactly, the next starts on the boundary, then records
+    # straddle the next boundaries by one byte, a header's worth and half a record
+    sizes = [page, page - 1, 2, page - 30, 60, page - 100, 200, page, 100]
+    store = ResultStore(hot_capacity=1, spill_dir=tmp_path)
+    records = []
+    try:
+        for index, size in enumerate(sizes):
+            records.append(sized_record((1 << 60) + index, size))
+            store.append(records[-1])
+            # Read back the record at the edge of the spill file and the first one still in memory
+            spilled = len(store._offsets)
+            for position in {max(spilled - 1, 0), spilled, index}:
+                assert record_fields(store[position]) == record_fields(records[position])
+        offsets = list(store._offsets)
+        assert offsets[:3] == [0, page, 2 * page - 1]
+        assert any(offset % page and (offset + size) % page and offset // page != (offset + size - 1) // page
+                   for offset, size in zip(offsets, sizes))
+        for position, record in enumerate(records):
+            assert record_fields(store[position]) == record_fields(record)
+        # A results page that runs from the spill file into the records in memory
+        spilled = len(store._offsets)
+        assert 0 < spilled < len(store)
+        page_records = ResultView(store)[spilled - 3:spilled + 3]
+        assert [record_fields(record) for record in page_records] == [
+            record_fields(record) for record in records[spilled - 3:spilled + 3]]
+    finally:
+        store.close()
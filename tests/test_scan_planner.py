@@ -0,0 +1,108 @@
+"""Tests for scan_planner.py: planned ranges cover the snowflake interval with no gaps or overlaps."""
+
+import random
+from datetime import timedelta
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from jobs import HISTORY_PAGE_SIZE
+from scan_planner import plan_ranges
+
+
+def snowflake(days_ago):
+    return discord.utils.time_snowflake(discord.utils.utcnow() - timedelta(days=days_ago))
+
+
+def first_page(start_id, count, gap):
+    return [SimpleNamespace(id=start_id + gap * (index + 1)) for index in range(count)]
+
+
+def owners(ranges, message_id):
+    """Ranges whose (after_id, before_id) bounds, both exclusive, hold the ID."""
+    return [fetch_range for fetch_range in ranges
+            if (fetch_range.after_id is None or fetch_range.after_id < message_id)
+            and (fetch_range.before_id is None or message_id < fetch_range.before_id)]
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_ranges_tile_the_interval(seed):
+    rng = random.Random(seed)
+    after_id = rng.choice([None, snowflake(rng.uniform(30, 2000))])
+    before_id = rng.choice([None, snowflake(rng.uniform(0, 25))])
+    cursors = rng.randint(1, 8)
+    start_id = after_id or snowflake(3000)
+    # From a few messages a day to thousands a minute
+    gap = rng.choice([1 << 22, 1 << 30, 1 << 36, 1 << 40])
+    page = first_page(start_id, rng.choice([HISTORY_PAGE_SIZE, HISTORY_PAGE_SIZE, 40]), gap)
+
+    ranges = plan_ranges(after_id, before_id, page, cursors)
+
+    assert ranges[0].after_id == after_id
+    assert ranges[-1].before_id == before_id
+    assert ranges[0].prefetched == page
+    for previous, fetch_range in zip(ranges, ranges[1:]):
+        # The next range starts (exclusive) at the last ID of the previous one
+        assert fetch_range.after_id == previous.before_id - 1
+        assert fetch_range.before_id is None or fetch_range.after_id + 1 < fetch_range.before_id
+        assert not fetch_range.prefetched
+    if len(ranges) > 1:
+        assert cursors >= 2
+        assert all(fetch_range.closed for fetch_range in ranges[:-1])
+
+    lower = (after_id or 0) + 1
+    upper = (before_id or snowflake(-1)) - 1
+    probes = [lower, upper] + [message.id for message in page]
+    probes += [fetch_range.after_id + offset for fetch_range in ranges[1:] for offset in (0, 1)]
+    probes += [rng.randint(lower, upper) for _ in range(200)]
+    for message_id in probes:
+        assert len(owners(ranges, message_id)) == 1, message_id
+
+
+def test_partial_first_page_is_the_whole_history():
+    page = first_page(snowflake(100), 40, 1 << 40)
+    ranges = plan_ranges(None, None, page, 8)
+    assert len(ranges) == 1
+    assert ranges[0].exhausted
+    assert ranges[0].prefetched == page
+
+
+def test_busy_channel_is_split():
+    after_id = snowflake(365)
+    ranges = plan_ranges(after_id, None, first_page(after_id, HISTORY_PAGE_SIZE, 1 << 22), 4)
+    assert len(ranges) > 4
+    assert not ranges[-1].closed
+
+
+@pytest.mark.parametrize("cursors", [1, 8])
+def test_empty_range(cursors):
+    after_id, before_id = snowflake(10), snowflake(5)
+    ranges = plan_ranges(after_id, before_id, [], cursors)
+    assert len(ranges) == 1
+    fetch_range = ranges[0]
+    assert fetch_range.exhausted and fetch_range.closed
+    assert fetch_range.fetch_after == after_id
+    # A closed range is complete up to its end even with nothing in it
+    assert fetch_range.boundary == before_id - 1
+
+    # Without a before: date, nothing new is complete yet
+    fetch_range, = plan_ranges(after_id, None, [], cursors)
+    assert not fetch_range.closed
+    assert fetch_range.boundary == after_id
+
+
+@pytest.mark.parametrize("cursors", [1, 8])
+def test_one_message_range(cursors):
+    after_id = snowflake(10)
+    page = first_page(after_id, 1, 1 << 22)
+    fetch_range, = plan_ranges(after_id, after_id + (2 << 22), page, cursors)
+    assert fetch_range.exhausted and fetch_range.closed
+    assert fetch_range.prefetched == page
+    assert fetch_range.fetch_after == page[0].id
+    assert fetch_range.boundary == after_id + (2 << 22) - 1
+
+    fetch_range, = plan_ranges(after_id, None, page, cursors)
+    assert fetch_range.boundary == after_id
+    fetch_range.last_message_id = page[0].id
+    assert fetch_range.boundary == page[0].id
@@ -0,0 +1,123 @@
+"""Tests for search_filters.py: parsing filter arguments and the snowflake bounds of the date range."""
+
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from search_filters import HAS_LINK, HAS_MENTION, MAX_SNOWFLAKE, SearchFilters, parse_filters, parse_time
+
+NOW = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc)
+MEMBERS = {"alice": 11, "bob": 22}
+GUILD = SimpleNamespace(get_member_named=lambda name: (SimpleNamespace(id=MEMBERS[name])
+                                                       if name in MEMBERS else None))
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2024-05-31", utc(2024, 5, 31)),
+    ("20240531", utc(2024, 5, 31)),
+    ("2024-05-31T18:00", utc(2024, 5, 31, 18)),
+    ("2024-05-31 18:00:30", utc(2024, 5, 31, 18, 0, 30)),
+    ("2024-05-31T18:00Z", utc(2024, 5, 31, 18)),
+    ("2024-05-31T18:00+02:00", utc(2024, 5, 31, 16)),
+    ("12h", NOW - timedelta(hours=12)),
+    ("7D", NOW - timedelta(days=7)),
+    ("2w", NOW - timedelta(weeks=2)),
+    ("0d", NOW),
+])
+def test_parse_time(value, expected):
+    assert parse_time(value, NOW) == expected
+
+
+@pytest.mark.parametrize("value", ["yesterday", "2024-13-01", "2024-05-32", "7", "7y", "-7d", "1234567890123456789",
+                                   "999999999999w"])
+def test_parse_time_rejects(value):
+    with pytest.raises(ValueError):
+        parse_time(value, NOW)
+
+
+@pytest.mark.parametrize("args, after, before, author_ids, has, remaining", [
+    (["bad", "word"], None, None, set(), (), ["bad", "word"]),
+    (["after:2024-01-01", "bad"], utc(2024, 1, 1), None, set(), (), ["bad"]),
+    (["BEFORE:2024-01-01", "bad"], None, utc(2024, 1, 1), set(), (), ["bad"]),
+    (["after:2024-01-01", "before:2024-01-01T00:00:01"], utc(2024, 1, 1), utc(2024, 1, 1, 0, 0, 1), set(), (), []),
+    # The last of a repeated date wins
+    (["after:2023-01-01", "after:2024-01-01"], utc(2024, 1, 1), None, set(), (), []),
+    # Author IDs, mentions and member names; several authors are alternatives
+    (["author:123456789012345678"], None, None, {123456789012345678}, (), []),
+    (["author:<@22>", "author:<@!33>", "author:alice", "author:@bob", "bad"], None, None, {11, 22, 33}, (), ["bad"]),
+    (["author:alice", "author:11"], None, None, {11}, (), []),
+    # Digits are a user ID for author:, and a date for after:
+    (["author:20240531", "after:20240531"], utc(2024, 5, 31), None, {20240531}, (), []),
+    (["has:link", "HAS:Mention", "has:link"], None, None, set(), ("link", "mention"), []),
+    (["hashtag", "authority", "http://after:x"], None, None, set(), (), ["hashtag", "authority", "http://after:x"]),
+])
+def test_parse_filters(args, after, before, author_ids, has, remaining):
+    filters, rest = parse_filters(GUILD, args)
+    assert (filters.after, filters.before, filters.author_ids, filters.has, rest) == (
+        after, before, author_ids, has, remaining)
+    assert bool(filters) == bool(after or before or author_ids or has)
+    assert SearchFilters.from_params(filters.to_params()).to_params() == filters.to_params()
+
+
+@pytest.mark.parametrize("args, message", [
+    (["after:"], "needs a value"),
+    (["after:yesterday"], "Can't read the date"),
+    (["before:2024-02-30"], "Can't read the date"),
+    (["after:123456789012345678"], "Can't read the date"),
+    (["after:99999999999w"], "Can't read the date"),
+    (["after:2024-02-01", "before:2024-01-01"], "must be earlier"),
+    (["after:2024-01-01", "before:2024-01-01"], "must be earlier"),
+    (["author:carol"], "Unknown author `carol`"),
+    (["has:gif"], "Unknown filter `has:gif`"),
+    (["has:"], "needs a value"),
+])
+def test_invalid_filters_give_a_message(args, message):
+    with pytest.raises(ValueError, match=message):
+        parse_filters(GUILD, args)
+
+
+def test_date_bounds_are_snowflakes():
+    after, before = utc(2024, 1, 1), utc(2024, 2, 1)
+    filters = SearchFilters(after, before)
+    first_after = discord.utils.time_snowflake(after)
+    first_before = discord.utils.time_snowflake(before)
+    # after: includes messages sent at that very moment: the bound is exclusive, one below the first ID
+    assert filters.after_id == first_after - 1
+    assert discord.utils.snowflake_time(filters.after_id + 1) == after
+    assert discord.utils.snowflake_time(filters.after_id) < after
+    # before: excludes them: its bound is the first ID of that moment
+    assert filters.before_id == first_before
+    assert discord.utils.snowflake_time(filters.before_id - 1) < before
+    assert SearchFilters().after_id is None and SearchFilters().before_id is None
+
+
+@pytest.mark.parametrize("after, before, after_id, before_id", [
+    # Before Discord's first message: no lower bound, and nothing before it
+    (utc(2010, 1, 1), utc(2010, 1, 2), None, 1),
+    (utc(2015, 1, 1), None, None, None),
+    # Past the last snowflake the index can store: no upper bound
+    (None, utc(2100, 1, 1), None, None),
+    (utc(2100, 1, 1), None, MAX_SNOWFLAKE - 1, None),
+])
+def test_date_bounds_out_of_range(after, before, after_id, before_id):
+    filters = SearchFilters(after, before)
+    assert (filters.after_id, filters.before_id) == (after_id, before_id)
+
+
+def test_accepts():
+    filters = SearchFilters(author_ids=[1, 2], has=["link", "mention"])
+    assert filters.checks_messages
+    assert filters.accepts(1, HAS_LINK | HAS_MENTION)
+    assert filters.accepts(2, HAS_LINK | HAS_MENTION | 1)
+    assert not filters.accepts(3, HAS_LINK | HAS_MENTION)
+    assert not filters.accepts(1, HAS_LINK)
+    # Messages indexed before flags were stored can't show they have anything
+    assert not filters.accepts(1, None)
+    assert SearchFilters(after=NOW).accepts(3, None)
+    assert not SearchFilters(after=NOW).checks_messages
@@ -0,0 +1,115 @@
+"""Tests for selection.py: the Selection bitset against a plain set of positions."""
+
+import random
+
+import pytest
+
+from results import MatchRecord, ResultStore, positions_mask
+from selection import Selection
+
+
+def check_selection(selection, expected):
+    assert len(selection) == len(expected)
+    assert list(selection.positions()) == sorted(expected)
+    for position in list(expected)[:50] + [0, 1, 7, 8, 100000]:
+        assert (position in selection) == (position in expected)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_selection_matches_a_set(seed):
+    rng = random.Random(seed)
+    selection = Selection()
+    expected = set()
+    for _ in range(300):
+        operation = rng.randrange(7)
+        if operation == 0:
+            position = rng.randrange(3000)
+            selection.add(position)
+            expected.add(position)
+        elif operation == 1:
+            position = rng.choice(sorted(expected)) if expected and rng.random() < 0.7 else rng.randrange(4000)
+            selection.discard(position)
+            expected.discard(position)
+        else:
+            positions = set(rng.sample(range(3000), rng.randrange(1, 400)))
+            mask = positions_mask(positions)
+            if operation == 2:
+                selection.select(mask)
+                expected |= positions
+            elif operation == 3:
+                selection.deselect(mask)
+                expected -= positions
+            elif operation == 4:
+                selection.invert(mask)
+                expected ^= positions
+            elif operation == 5:
+                assert selection.covers(mask) == (positions <= expected)
+            else:
+                assert selection.covers(positions_mask(expected))
+                selection.clear()
+                expected.clear()
+        check_selection(selection, expected)
+
+
+def test_add_and_discard_twice():
+    selection = Selection()
+    selection.add(9)
+    selection.add(9)
+    check_selection(selection, {9})
+    selection.discard(9)
+    selection.discard(9)
+    selection.discard(123)  # Past the end of the bitset
+    check_selection(selection, set())
+
+
+def test_deselect_everything_shrinks_to_empty():
+    selection = Selection()
+    selection.select(positions_mask(range(64, 80)))
+    selection.deselect(positions_mask(range(100)))
+    check_selection(selection, set())
+    selection.add(3)
+    check_selection(selection, {3})
+
+
+def test_select_by_channel_and_author():
+    store = ResultStore(hot_capacity=100)
+    for position in range(1000):
+        store.append(MatchRecord(1000 + position, position % 3, "c", position % 4 or None, "a", "needle"))
+    selection = Selection()
+    selection.select(store.mask_where(channel_id=1))
+    selection.invert(store.mask_where(author_id=2))
+    expected = {p for p in range(1000) if p % 3 == 1} ^ {p for p in range(1000) if p % 4 == 2}
+    check_selection(selection, expected)
+    selection.deselect(store.mask_where(channel_id=1, author_id=0))
+    check_selection(selection, expected - {p for p in range(1000) if p % 3 == 1 and p % 4 == 0})
+
+
+def test_invert_empty_selection():
+    selection = Selection()
+    selection.invert(0)
+    check_selection(selection, set())
+    # Inverting against a mask selects all of it; inverting again empties the selection
+    selection.invert(positions_mask([0, 9, 64]))
+    check_selection(selection, {0, 9, 64})
+    selection.invert(positions_mask([0, 9, 64]))
+    check_selection(selection, set())
+
+
+def test_mask_where_follows_appends():
+    store = ResultStore(hot_capacity=10)
+    expected = {}
+    for position in range(200):
+        channel_id, author_id = position % 3, position % 5 or None
+        assert store.append(MatchRecord(1000 + position, channel_id, "c", author_id, "a", "needle")) == position
+        expected.setdefault((channel_id, author_id or 0), set()).add(position)
+        if position % 37 == 0:
+            # Lookups in between only take in the records added since
+            for channel_id in range(3):
+                assert store.mask_where(channel_id=channel_id) == positions_mask(
+                    {p for (channel, _), positions in expected.items() if channel == channel_id for p in positions})
+    for (channel_id, author_id), positions in expected.items():
+        assert store.mask_where(channel_id, author_id) == positions_mask(positions)
+    assert store.mask_where(author_id=0) == positions_mask(range(0, 200, 5))
+    assert store.mask_where() == positions_mask(range(200))
+    assert store.mask_where(channel_id=7) == 0
+    assert store.mask_where(channel_id=1, author_id=99) == 0
@@ -0,0 +1,89 @@
+"""Tests for ui_events.py: coalescing events by key and running them in order."""
+
+import threading
+
+from ui_events import UIEventQueue
+
+
+def test_last_post_of_a_key_wins_at_its_position():
+    events = UIEventQueue()
+    calls = []
+    record = calls.append
+    events.post(record, "unkeyed 1")
+    events.post(record, "matches #1 first", key=("matches", 1))
+    events.post(record, "unkeyed 2")
+    events.post(record, "matches #2", key=("matches", 2))
+    events.post(record, "matches #1 last", key=("matches", 1))
+    events.post(record, "unkeyed 3")
+    assert events.process() == 5
+    assert calls == ["unkeyed 1", "unkeyed 2", "matches #2", "matches #1 last", "unkeyed 3"]
+    assert events.process() == 0
+
+
+def test_unkeyed_posts_all_run_in_order():
+    events = UIEventQueue()
+    calls = []
+    for index in range(100):
+        events.post(calls.append, index)
+    assert [args for _, args in events.drain()] == [(index,) for index in range(100)]
+    assert events.drain() == []
+
+
+def test_keys_only_coalesce_within_a_drain():
+    events = UIEventQueue()
+    calls = []
+    events.post(calls.append, "first", key="status")
+    events.process()
+    events.post(calls.append, "second", key="status")
+    events.process()
+    assert calls == ["first", "second"]
+
+
+def test_drain_takes_at_most_max_events():
+    events = UIEventQueue()
+    calls = []
+    for index in range(25):
+        events.post(calls.append, index, key="progress" if index % 2 else None)
+    first = events.drain(max_events=10)
+    # Of the first ten, the odd ones share a key: only the last of them is kept
+    assert [args for _, args in first] == [(0,), (2,), (4,), (6,), (8,), (9,)]
+    assert [args for _, args in events.drain(max_events=100)] == [(10,), (12,), (14,), (16,), (18,), (20,), (22,),
+                                                                  (23,), (24,)]
+
+
+def test_failing_callback_does_not_stop_the_others():
+    events = UIEventQueue()
+    calls = []
+
+    def fail(value):
+        raise RuntimeError(value)
+
+    events.post(calls.append, 1)
+    events.post(fail, "boom")
+    events.post(calls.append, 2)
+    assert events.process() == 3
+    assert calls == [1, 2]
+
+
+def test_posts_from_other_threads_keep_their_order():
+    events = UIEventQueue()
+    calls = []
+
+    def post_all(thread_id):
+        for index in range(500):
+            events.post(calls.append, (thread_id, index))
+            events.post(calls.append, (thread_id, "progress", index), key=("progress", thread_id))
+
+    threads = [threading.Thread(target=post_all, args=(thread_id,)) for thread_id in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    while events.process():
+        pass
+    for thread_id in range(4):
+        assert [call[1] for call in calls if call[0] == thread_id and len(call) == 2] == list(range(500))
+        # However the drains fell, each thread's last progress update ran, and older ones never after it
+        progress = [call[2] for call in calls if call[0] == thread_id and len(call) == 3]
+        assert progress[-1] == 499
+        assert progress == sorted(progress)
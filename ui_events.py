@@ -0,0 +1,54 @@
+"""Event queue from the Discord bot thread to the Tkinter UI.
+
+Tk is not thread-safe, so the bot never touches widgets (or calls root.after)
+itself. It posts events to the queue and the Tk main loop drains it on a timer.
+"""
+
+import queue
+
+DRAIN_INTERVAL_MS = 50  # How often the UI drains the queue
+MAX_EVENTS_PER_DRAIN = 2000  # Events taken per drain, so a flood can't block the main loop
+
+
+class UIEventQueue:
+    """Thread-safe queue of UI callbacks with coalescing.
+
+    Events posted with the same key replace each other: when several are
+    waiting, only the newest one runs, at the position of the newest post.
+    Match batches and progress updates use this, so a fast scan causes one
+    redraw per drain instead of one per batch.
+    """
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+
+    def post(self, callback, *args, key=None):
+        """Schedule callback(*args) on the UI thread. Safe to call from any thread."""
+        self._queue.put((key, callback, args))
+
+    def drain(self, max_events=MAX_EVENTS_PER_DRAIN):
+        """Take up to max_events waiting events and return the (callback, args) to run, in order."""
+        events = []
+        for _ in range(max_events):
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        # Keep only the newest event of every key
+        latest = {key: index for index, (key, _, _) in enumerate(events) if key is not None}
+        return [
+            (callback, args)
+            for index, (key, callback, args) in enumerate(events)
+            if key is None or latest[key] == index
+        ]
+
+    def process(self):
+        """Run the waiting events. Called from the UI thread; returns how many ran."""
+        ready = self.drain()
+        for callback, args in ready:
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Error handling UI event {getattr(callback, '__name__', callback)}: {e}")
+        return len(ready)